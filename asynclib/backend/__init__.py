@@ -4,8 +4,10 @@ import json
 import requests
 import glob
 import datetime
-from dateutil import parser
 from UFrame import UFrame
+from asynclib.streams import fetch_instrument_streams
+from asynclib.erddap import index_erddap_datasets
+from asynclib.timestamps import parse_iso8601
 
 #def write_active_deployments_catalog(uframe, dest_dir=None, clobber=False):
 #    '''Fetch and write the list of active instrument deployments and associated
@@ -108,7 +110,7 @@ from UFrame import UFrame
 #        
 #    return datasets
     
-def get_updated_datasets(uframe, uframe_catalog_json, erddap_catalog_json, skip_csv=None):
+def get_updated_datasets(uframe, uframe_catalog_json, erddap_catalog_json, skip_csv=None, cache=None, workers=1):
     
     updated_datasets = []
     
@@ -116,8 +118,14 @@ def get_updated_datasets(uframe, uframe_catalog_json, erddap_catalog_json, skip_
         sys.stderr.write('Write code to parse skip_csv for streams to skip\n')
         return
     
-    # Create a list of ERDDAP datasetIDs
-    erddap_dataset_ids = [d['datasetID'] for d in erddap_catalog_json]
+    # Index the ERDDAP datasets by datasetID
+    erddap_datasets = index_erddap_datasets(erddap_catalog_json)
+    
+    # Resolve the streams for all instruments, using the cache if specified
+    instrument_streams = fetch_instrument_streams(uframe,
+        [i['instrument']['reference_designator'] for i in uframe_catalog_json],
+        workers=workers,
+        cache=cache)
 
     for instrument in uframe_catalog_json:
         
@@ -125,10 +133,10 @@ def get_updated_datasets(uframe, uframe_catalog_json, erddap_catalog_json, skip_
         #deployment_dt0 = parser.parse(instrument['event_start_ts'])
         deployment_dt1 = None
         if instrument['event_stop_ts']:
-            deployment_dt1 = parser.parse(instrument['event_stop_ts'])
+            deployment_dt1 = parse_iso8601(instrument['event_stop_ts'])
         
         # Get the list of all streams produced by this instrument
-        streams = uframe.instrument_to_streams(instrument['instrument']['reference_designator'])
+        streams = instrument_streams[instrument['instrument']['reference_designator']]
         if not streams:
             sys.stderr.write('{:s}: No streams found\n'.format(instrument['instrument']['reference_designator']))
             continue
@@ -142,22 +150,24 @@ def get_updated_datasets(uframe, uframe_catalog_json, erddap_catalog_json, skip_
                 
             # If the stream_dataset_id does not exist, this is a new stream, so 
             # we can skip it
-            if stream_dataset_id not in erddap_dataset_ids:
+            if stream_dataset_id not in erddap_datasets:
                 continue
-                
-            # Find the list index for the ERDDAP dataset
-            i = erddap_dataset_ids.index(stream_dataset_id)
             
             # Create datetimes for the stream start and end times
             #stream_dt0 = parser.parse(stream['beginTime'])
-            stream_dt1 = parser.parse(stream['endTime'])
+            stream_dt1 = parse_iso8601(stream['endTime'])
+            if not stream_dt1:
+                continue
             
             # Create datetimes for the erddap dataset minTime and maxTime
-            #dataset_dt0 = parser.parse(erddap_catalog_json[i]['minTime'])
+            #dataset_dt0 = parser.parse(erddap_datasets[stream_dataset_id]['minTime'])
             # Add the stream_dt1 microseconds to the dataset_dt1 datetime object to 
             # account for the fact that UFrame keeps track of microseconds, but
             # ERDDAP dataset minTime values do not
-            dataset_dt1 = parser.parse(erddap_catalog_json[i]['maxTime']) + datetime.timedelta(0,0,stream_dt1.microsecond)
+            dataset_dt1 = parse_iso8601(erddap_datasets[stream_dataset_id]['maxTime'])
+            if not dataset_dt1:
+                continue
+            dataset_dt1 += datetime.timedelta(0,0,stream_dt1.microsecond)
             
             # Compare the stream end time to the ERDDAP dataset end time to see if
             # the stream has been updated
@@ -188,7 +198,7 @@ def get_updated_datasets(uframe, uframe_catalog_json, erddap_catalog_json, skip_
     
     return updated_datasets
     
-def get_new_datasets(uframe, uframe_catalog_json, erddap_catalog_json, skip_csv=None):
+def get_new_datasets(uframe, uframe_catalog_json, erddap_catalog_json, skip_csv=None, cache=None, workers=1):
     
     new_datasets = []
     
@@ -196,16 +206,22 @@ def get_new_datasets(uframe, uframe_catalog_json, erddap_catalog_json, skip_csv=
         sys.stderr.write('Write code to parse skip_csv for streams to skip\n')
         return
         
-    # Create the list of ERDDAP dataset Ids
+    # Create the set of ERDDAP dataset Ids
     if erddap_catalog_json:
-        erddap_dataset_ids = [d['datasetID'] for d in erddap_catalog_json]
+        erddap_dataset_ids = set([d['datasetID'] for d in erddap_catalog_json])
     else:
-        erddap_dataset_ids = []
+        erddap_dataset_ids = set()
+        
+    # Resolve the streams for all instruments, using the cache if specified
+    instrument_streams = fetch_instrument_streams(uframe,
+        [i['instrument']['reference_designator'] for i in uframe_catalog_json],
+        workers=workers,
+        cache=cache)
 
     for instrument in uframe_catalog_json:
         
         # Get the list of all streams produced by this instrument
-        streams = uframe.instrument_to_streams(instrument['instrument']['reference_designator'])
+        streams = instrument_streams[instrument['instrument']['reference_designator']]
         if not streams:
             sys.stderr.write('{:s}: No streams found\n'.format(instrument['instrument']['reference_designator']))
             continue
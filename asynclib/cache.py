@@ -0,0 +1,416 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+import requests
+from asynclib import session
+
+# Default lifetime, in seconds, of a cached stream listing.  New streams on a
+# cached instrument are not seen until its listing expires.
+_DEFAULT_TTL = 6 * 3600
+# Default maximum number of cached stream listings
+_DEFAULT_MAX_ENTRIES = 20000
+
+# Default number of seconds a cached HTTP response is used without revalidation
+_DEFAULT_RESPONSE_TTL = 60
+
+_SCHEMA = ['CREATE TABLE IF NOT EXISTS streams (base_url TEXT NOT NULL, reference_designator TEXT NOT NULL, streams TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (base_url, reference_designator))',
+    'CREATE INDEX IF NOT EXISTS streams_accessed ON streams (accessed)',
+    'CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)']
+_RESPONSE_SCHEMA = ['CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, body TEXT NOT NULL, etag TEXT, last_modified TEXT, fetched REAL NOT NULL, version INTEGER NOT NULL)']
+
+def default_cache_dir():
+    '''Return the directory containing the local caches and the build manifest,
+    OOI_ERDDAP_ASYNC_HOME/cache.  Returns None if OOI_ERDDAP_ASYNC_HOME is not
+    set.'''
+
+    async_home = os.getenv('OOI_ERDDAP_ASYNC_HOME')
+    if not async_home:
+        return None
+
+    return os.path.join(async_home, 'cache')
+
+def default_stream_cache_file():
+    '''Return the default location of the UFrame stream listing cache, which is
+    created in default_cache_dir().  Returns None if OOI_ERDDAP_ASYNC_HOME is not
+    set.'''
+
+    cache_dir = default_cache_dir()
+    if not cache_dir:
+        return None
+
+    return os.path.join(cache_dir, 'uframe-streams.db')
+
+class StreamCache(object):
+    '''SQLite backed cache of UFrame instrument_to_streams listings keyed by UFrame
+    base url and instrument reference designator.  Entries older than ttl seconds
+    are considered stale and the least recently used entries are evicted once the
+    cache contains more than max_entries listings.  Access times, counters and
+    new listings are written to the database when flush or close is called.'''
+
+    def __init__(self, db_file, ttl=_DEFAULT_TTL, max_entries=_DEFAULT_MAX_ENTRIES):
+
+        self.db_file = db_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        # Access times and counter increments not yet written to the database
+        self._accessed = {}
+        self._counts = {}
+        self._dirty = False
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def get(self, base_url, reference_designator):
+        '''Return the cached stream listing for reference_designator on the UFrame
+        instance at base_url, or None if it is not cached or is stale'''
+
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT streams, created FROM streams WHERE base_url = ? AND reference_designator = ?',
+                (base_url, reference_designator)).fetchone()
+            if not row or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                if row:
+                    self.expired += 1
+                self._count('misses')
+                return None
+
+            self._accessed[(base_url, reference_designator)] = now
+            self.hits += 1
+            self._count('hits')
+
+        return json.loads(row[0])
+
+    def put(self, base_url, reference_designator, streams):
+        '''Cache the stream listing for reference_designator on the UFrame instance
+        at base_url'''
+
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO streams (base_url, reference_designator, streams, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (base_url, reference_designator, json.dumps(streams), now, now))
+            self._accessed.pop((base_url, reference_designator), None)
+            self._dirty = True
+
+    def flush(self):
+        '''Write the access times, counters and listings recorded since the last
+        flush to the database in a single transaction'''
+
+        with self._lock:
+            self._flush()
+
+    def invalidate(self, base_url=None, reference_designators=None):
+        '''Remove cached listings for the specified base_url and/or reference
+        designators.  All listings are removed if neither is specified.  Returns
+        the number of listings removed.'''
+
+        clauses = []
+        params = []
+        if base_url:
+            clauses.append('base_url = ?')
+            params.append(base_url)
+        if reference_designators:
+            clauses.append('reference_designator IN ({:s})'.format(','.join(['?'] * len(reference_designators))))
+            params.extend(reference_designators)
+
+        statement = 'DELETE FROM streams'
+        if clauses:
+            statement = '{:s} WHERE {:s}'.format(statement, ' AND '.join(clauses))
+
+        with self._lock:
+            count = self._db.execute(statement, params).rowcount
+            self._db.commit()
+
+        return count
+
+    def purge_expired(self):
+        '''Remove all stale listings.  Returns the number of listings removed.'''
+
+        if not self.ttl:
+            return 0
+
+        with self._lock:
+            count = self._db.execute('DELETE FROM streams WHERE created < ?', (time.time() - self.ttl,)).rowcount
+            self._db.commit()
+
+        return count
+
+    def stats(self):
+        '''Return a dict containing the hit/miss counts for this instance, the
+        cumulative hit/miss counts of all instances and the number of cached
+        listings'''
+
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM streams').fetchone()[0]
+            counters = dict(self._db.execute('SELECT name, value FROM counters').fetchall())
+            for (name, value) in self._counts.items():
+                counters[name] = counters.get(name, 0) + value
+
+        return {'hits' : self.hits,
+            'misses' : self.misses,
+            'expired' : self.expired,
+            'entries' : entries,
+            'total_hits' : counters.get('hits', 0),
+            'total_misses' : counters.get('misses', 0)}
+
+    def format_stats(self):
+        '''Return the cache statistics as a single line of text'''
+
+        s = self.stats()
+
+        return 'Stream cache hits: {:d}, misses: {:d} ({:d} expired), entries: {:d}'.format(s['hits'],
+            s['misses'],
+            s['expired'],
+            s['entries'])
+
+    def close(self):
+
+        with self._lock:
+            self._flush()
+            self._db.close()
+
+    def _count(self, name):
+
+        self._counts[name] = self._counts.get(name, 0) + 1
+
+    def _flush(self):
+
+        if not self._accessed and not self._counts and not self._dirty:
+            return
+
+        self._db.executemany('UPDATE streams SET accessed = ? WHERE base_url = ? AND reference_designator = ?',
+            [(accessed, base_url, reference_designator) for ((base_url, reference_designator), accessed) in self._accessed.items()])
+        for (name, value) in self._counts.items():
+            self._db.execute('INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)', (name,))
+            self._db.execute('UPDATE counters SET value = value + ? WHERE name = ?', (value, name))
+        self._evict()
+        self._db.commit()
+
+        self._accessed = {}
+        self._counts = {}
+        self._dirty = False
+
+    def _evict(self):
+
+        if not self.max_entries:
+            return
+
+        count = self._db.execute('SELECT COUNT(*) FROM streams').fetchone()[0]
+        if count <= self.max_entries:
+            return
+
+        self._db.execute('DELETE FROM streams WHERE rowid IN (SELECT rowid FROM streams ORDER BY accessed LIMIT ?)',
+            (count - self.max_entries,))
+
+def open_stream_cache(db_file=None, ttl=_DEFAULT_TTL, max_entries=_DEFAULT_MAX_ENTRIES):
+    '''Open the UFrame stream listing cache, creating the cache directory if
+    necessary.  Returns None if the cache cannot be opened.'''
+
+    if not db_file:
+        db_file = default_stream_cache_file()
+    if not db_file:
+        sys.stderr.write('No stream cache file specified and OOI_ERDDAP_ASYNC_HOME not set\n')
+        return None
+
+    cache_dir = os.path.dirname(db_file)
+    if cache_dir and not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            sys.stderr.write('{:s}\n'.format(e))
+            return None
+
+    try:
+        return StreamCache(db_file, ttl=ttl, max_entries=max_entries)
+    except sqlite3.Error as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(db_file, e))
+        return None
+
+def default_response_cache_file():
+    '''Return the default location of the HTTP response cache, which is created
+    in default_cache_dir().  Returns None if OOI_ERDDAP_ASYNC_HOME is not set.'''
+
+    cache_dir = default_cache_dir()
+    if not cache_dir:
+        return None
+
+    return os.path.join(cache_dir, 'erddap-responses.db')
+
+class ResponseCache(object):
+    '''SQLite backed cache of HTTP GET response bodies keyed by URL.  Responses
+    fetched less than ttl seconds ago are used without contacting the server.
+    Older responses are revalidated with a conditional GET using the ETag and/or
+    Last-Modified validators sent by the server, so that an unchanged response
+    costs a 304 rather than a full transfer.  The parsed form of each response is
+    also kept in memory and reused until the response changes.'''
+
+    def __init__(self, db_file, ttl=_DEFAULT_RESPONSE_TTL):
+
+        self.db_file = db_file
+        self.ttl = ttl
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.stale = 0
+
+        # url: (version, parsed response)
+        self._parsed = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        for statement in _RESPONSE_SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def fetch(self, url, parse, on_request=None):
+        '''Return parse(body) for the response body of url, using the cached body
+        if it is fresh or the server confirms it has not changed.  The cached body
+        is returned if the server cannot be reached.  If specified, on_request()
+        is called before each HTTP request is sent.  Returns None if the request
+        fails and nothing is cached or if the body cannot be parsed.'''
+
+        with self._lock:
+            row = self._db.execute('SELECT body, etag, last_modified, fetched, version FROM responses WHERE url = ?',
+                (url,)).fetchone()
+
+        if row and self.ttl and time.time() - row[3] <= self.ttl:
+            self._count('hits')
+            return self._parse(url, row[0], row[4], parse)
+
+        headers = {}
+        if row and row[1]:
+            headers['If-None-Match'] = row[1]
+        if row and row[2]:
+            headers['If-Modified-Since'] = row[2]
+
+        if on_request:
+            on_request()
+
+        try:
+            r = session.get(url, headers=headers)
+        except requests.exceptions.RequestException as e:
+            sys.stderr.write('{:s}\n'.format(e))
+            if not row:
+                return None
+            sys.stderr.write('Using stale cached response: {:s}\n'.format(url))
+            self._count('stale')
+            return self._parse(url, row[0], row[4], parse)
+
+        if r.status_code == 304 and row:
+            with self._lock:
+                self._db.execute('UPDATE responses SET fetched = ? WHERE url = ?', (time.time(), url))
+                self._db.commit()
+            self._count('revalidated')
+            return self._parse(url, row[0], row[4], parse)
+
+        self._count('misses')
+        if r.status_code != 200:
+            sys.stderr.write('GET request failed: {:s} ({:s})\n'.format(url, r.reason))
+            return None
+
+        version = row[4] + 1 if row else 1
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses (url, body, etag, last_modified, fetched, version) VALUES (?, ?, ?, ?, ?, ?)',
+                (url, r.text, r.headers.get('ETag'), r.headers.get('Last-Modified'), time.time(), version))
+            self._db.commit()
+
+        return self._parse(url, r.text, version, parse)
+
+    def invalidate(self, url=None):
+        '''Remove the cached response for url or all cached responses if url is
+        not specified.  Returns the number of responses removed.'''
+
+        with self._lock:
+            if url:
+                count = self._db.execute('DELETE FROM responses WHERE url = ?', (url,)).rowcount
+                self._parsed.pop(url, None)
+            else:
+                count = self._db.execute('DELETE FROM responses').rowcount
+                self._parsed.clear()
+            self._db.commit()
+
+        return count
+
+    def stats(self):
+        '''Return a dict containing the fresh hit, revalidated (304), miss and
+        stale counts and the number of cached responses'''
+
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+        return {'hits' : self.hits,
+            'revalidated' : self.revalidated,
+            'misses' : self.misses,
+            'stale' : self.stale,
+            'entries' : entries}
+
+    def format_stats(self):
+        '''Return the cache statistics as a single line of text'''
+
+        s = self.stats()
+
+        return 'Response cache hits: {:d}, revalidated: {:d}, misses: {:d}, stale: {:d}, entries: {:d}'.format(s['hits'],
+            s['revalidated'],
+            s['misses'],
+            s['stale'],
+            s['entries'])
+
+    def close(self):
+
+        with self._lock:
+            self._db.close()
+
+    def _count(self, name):
+
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _parse(self, url, body, version, parse):
+
+        with self._lock:
+            parsed = self._parsed.get(url)
+        if parsed and parsed[0] == version:
+            return parsed[1]
+
+        try:
+            parsed = parse(body)
+        except (ValueError, KeyError) as e:
+            sys.stderr.write('{:s}: {:s}\n'.format(e, url))
+            return None
+
+        with self._lock:
+            self._parsed[url] = (version, parsed)
+
+        return parsed
+
+def open_response_cache(db_file=None, ttl=_DEFAULT_RESPONSE_TTL):
+    '''Open the HTTP response cache, creating the cache directory if necessary.
+    Returns None if the cache cannot be opened.'''
+
+    if not db_file:
+        db_file = default_response_cache_file()
+    if not db_file:
+        sys.stderr.write('No response cache file specified and OOI_ERDDAP_ASYNC_HOME not set\n')
+        return None
+
+    cache_dir = os.path.dirname(db_file)
+    if cache_dir and not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            sys.stderr.write('{:s}\n'.format(e))
+            return None
+
+    try:
+        return ResponseCache(db_file, ttl=ttl)
+    except sqlite3.Error as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(db_file, e))
+        return None
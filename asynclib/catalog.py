@@ -0,0 +1,225 @@
+import os
+import re
+import sys
+import glob
+import json
+import shutil
+import tempfile
+from asynclib.filesystem import write_atomic
+
+# Pattern matching the dataset xml fragments in a stream-xml directory
+DEFAULT_FRAGMENT_PATTERN = '*dataset.xml'
+# Size of the blocks copied between files
+_COPY_BUFFER_SIZE = 1048576
+# Regex for pulling the dataset ids out of a dataset xml fragment
+_DATASET_ID_REGEX = re.compile(br'<dataset\s[^>]*datasetID\s*=\s*"([^"]+)"')
+
+def default_index_file(datasets_xml_file):
+    '''Return the name of the file recording the fragment offsets of
+    datasets_xml_file'''
+
+    (xml_dir, xml_fname) = os.path.split(os.path.abspath(datasets_xml_file))
+
+    return os.path.join(xml_dir, '.{:s}.index.json'.format(xml_fname))
+
+def assemble_datasets_xml(fragment_dir, datasets_xml_file, head_file, tail_file, pattern=DEFAULT_FRAGMENT_PATTERN, index_file=None, debug=False):
+    '''Write the ERDDAP datasets_xml_file consisting of head_file, each dataset xml
+    fragment in fragment_dir, in sorted order, and tail_file.  The offset, size
+    and modification time of each fragment are recorded in index_file, so that
+    subsequent calls copy unchanged fragments directly from the existing
+    datasets_xml_file and read only added or modified fragments.  The file is
+    not written at all if no fragments were added, modified or removed.  The new
+    file is written to a temporary file and renamed to datasets_xml_file.
+    Returns a dict containing the number of fragments, the numbers added,
+    changed, removed and unchanged, whether the file was written, the bytes
+    copied from the existing file and read from fragments and the ids of the
+    datasets in the added, changed and removed fragments, which should be
+    flagged for reload once the file is written, or None on error.  The dataset
+    ids are only known if the existing datasets_xml_file was indexed.'''
+
+    if not os.path.isdir(fragment_dir):
+        sys.stderr.write('Invalid stream XML directory: {:s}\n'.format(fragment_dir))
+        return None
+    for f in [head_file, tail_file]:
+        if not os.path.isfile(f):
+            sys.stderr.write('Missing erddap head/tail file: {:s}\n'.format(f))
+            return None
+
+    if not index_file:
+        index_file = default_index_file(datasets_xml_file)
+
+    fragment_dir = os.path.abspath(fragment_dir)
+    fragments = [f for f in sorted(glob.glob(os.path.join(fragment_dir, pattern))) if os.path.isfile(f)]
+    if not fragments:
+        sys.stderr.write('No stream xml files found: {:s}\n'.format(fragment_dir))
+        return None
+
+    head = _file_state(head_file)
+    tail = _file_state(tail_file)
+    current = dict([(f, _file_state(f)) for f in fragments])
+
+    # Offsets of the fragments in the existing datasets_xml_file, provided it has
+    # not been modified since it was written and has the same head
+    previous = {}
+    index = _load_index(index_file)
+    if index and index['datasets_xml'] == _file_state(datasets_xml_file) and index['head'] == head:
+        previous = dict([(e['file'], e) for e in index['fragments']])
+
+    stats = {'fragments' : len(fragments),
+        'added' : len([f for f in fragments if f not in previous]),
+        'changed' : len([f for f in fragments if f in previous and previous[f]['state'] != current[f]]),
+        'removed' : len([f for f in previous if f not in current]),
+        'written' : False,
+        'bytes_copied' : 0,
+        'bytes_read' : 0,
+        'dataset_ids' : []}
+    stats['unchanged'] = stats['fragments'] - stats['added'] - stats['changed']
+
+    if previous and not stats['added'] and not stats['changed'] and not stats['removed'] and index['tail'] == tail:
+        return stats
+
+    # Datasets removed from the file
+    updated_ids = set()
+    for f in previous:
+        if f not in current:
+            updated_ids.update(previous[f].get('dataset_ids', []))
+
+    if debug:
+        return stats
+
+    (xml_dir, xml_fname) = os.path.split(os.path.abspath(datasets_xml_file))
+    try:
+        (fd, tmp_file) = tempfile.mkstemp(prefix='.{:s}.'.format(xml_fname), dir=xml_dir)
+    except OSError as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(datasets_xml_file, e))
+        return None
+
+    entries = []
+    try:
+        with os.fdopen(fd, 'wb') as out_fid:
+
+            stats['bytes_read'] += _copy_file(head_file, out_fid)
+
+            # Runs of unchanged fragments that are also contiguous in the existing
+            # file are copied with a single read
+            old_fid = open(datasets_xml_file, 'rb') if previous else None
+            try:
+                run = None
+                for f in fragments:
+                    entry = previous.get(f)
+                    if entry and entry['state'] == current[f]:
+                        if run and run[0] + run[1] == entry['offset']:
+                            run[1] += entry['length']
+                        else:
+                            stats['bytes_copied'] += _copy_run(old_fid, run, out_fid)
+                            run = [entry['offset'], entry['length']]
+                        # The run is written before any later fragment, so the
+                        # new offset is the current position plus the run so far
+                        length = entry['length']
+                        offset = out_fid.tell() + run[1] - length
+                        dataset_ids = entry.get('dataset_ids', [])
+                    else:
+                        stats['bytes_copied'] += _copy_run(old_fid, run, out_fid)
+                        run = None
+                        offset = out_fid.tell()
+                        (length, dataset_ids) = _copy_fragment(f, out_fid)
+                        stats['bytes_read'] += length
+                        if previous:
+                            updated_ids.update(dataset_ids)
+                    entries.append({'file' : f,
+                        'state' : current[f],
+                        'offset' : offset,
+                        'length' : length,
+                        'dataset_ids' : dataset_ids})
+                stats['bytes_copied'] += _copy_run(old_fid, run, out_fid)
+            finally:
+                if old_fid:
+                    old_fid.close()
+
+            stats['bytes_read'] += _copy_file(tail_file, out_fid)
+
+        os.chmod(tmp_file, 0o644)
+        os.rename(tmp_file, datasets_xml_file)
+    except (IOError, OSError) as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(datasets_xml_file, e))
+        if os.path.isfile(tmp_file):
+            os.unlink(tmp_file)
+        return None
+
+    stats['written'] = True
+    stats['dataset_ids'] = sorted(updated_ids)
+
+    index = {'datasets_xml' : _file_state(datasets_xml_file),
+        'head' : head,
+        'tail' : tail,
+        'fragments' : entries}
+    # If the index is not written, the next call rebuilds the whole file
+    write_atomic(index_file, json.dumps(index))
+
+    return stats
+
+def format_assembly_stats(stats):
+    '''Return the assemble_datasets_xml result as a single line of text'''
+
+    return '{:d} fragments: {:d} added, {:d} changed, {:d} removed, {:d} unchanged, {:0.1f} MB copied, {:0.1f} MB read{:s}'.format(stats['fragments'],
+        stats['added'],
+        stats['changed'],
+        stats['removed'],
+        stats['unchanged'],
+        stats['bytes_copied'] / 1048576.,
+        stats['bytes_read'] / 1048576.,
+        '' if stats['written'] else ' (not written)')
+
+def _file_state(filename):
+
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+
+    return [st.st_size, st.st_mtime]
+
+def _load_index(index_file):
+
+    if not os.path.isfile(index_file):
+        return None
+
+    try:
+        with open(index_file, 'r') as fid:
+            return json.load(fid)
+    except (IOError, ValueError) as e:
+        sys.stderr.write('Ignoring invalid datasets.xml index: {:s} ({:s})\n'.format(index_file, e))
+        return None
+
+def _copy_file(filename, out_fid):
+
+    with open(filename, 'rb') as fid:
+        start = out_fid.tell()
+        shutil.copyfileobj(fid, out_fid, _COPY_BUFFER_SIZE)
+
+    return out_fid.tell() - start
+
+def _copy_fragment(filename, out_fid):
+
+    with open(filename, 'rb') as fid:
+        fragment = fid.read()
+    out_fid.write(fragment)
+
+    return (len(fragment), [i.decode('utf-8') for i in _DATASET_ID_REGEX.findall(fragment)])
+
+def _copy_run(old_fid, run, out_fid):
+
+    if not run:
+        return 0
+
+    (offset, length) = run
+    old_fid.seek(offset)
+    remaining = length
+    while remaining > 0:
+        block = old_fid.read(min(remaining, _COPY_BUFFER_SIZE))
+        if not block:
+            raise IOError('datasets.xml is shorter than its index')
+        out_fid.write(block)
+        remaining -= len(block)
+
+    return length
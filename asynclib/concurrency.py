@@ -0,0 +1,172 @@
+import sys
+import time
+import random
+import threading
+import traceback
+from contextlib import contextmanager
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+# Rate limiters shared by all callers talking to the same host
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+# Pool.apply_async only takes an error_callback in Python 3
+_POOL_ERROR_CALLBACK = sys.version_info >= (3, 2)
+
+class RateLimiter(object):
+    '''Thread-safe token bucket allowing rate acquisitions per second with bursts
+    of up to burst acquisitions'''
+
+    def __init__(self, rate, burst=1):
+
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Block until a token is available and consume it'''
+
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+class KeyedLocks(object):
+    '''Registry of locks keyed by name, typically a directory, so that threads
+    working on the same key are serialized'''
+
+    def __init__(self):
+
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Return the lock for key, creating it if it does not exist'''
+
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+
+        return self._locks[key]
+
+    @contextmanager
+    def locked(self, key):
+        '''Context manager holding the lock for key'''
+
+        lock = self.get(key)
+        with lock:
+            yield
+
+class BoundedProcessPool(object):
+    '''Pool of worker processes for CPU-bound tasks.  submit() blocks once
+    max_pending tasks are queued or running, so that the resources held by
+    pending tasks, such as temporary files, stay bounded while the caller
+    produces more work.'''
+
+    def __init__(self, processes=None, max_pending=None):
+
+        self.processes = max(processes or cpu_count(), 1)
+        self.max_pending = max(max_pending or 2 * self.processes, 1)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = Pool(self.processes)
+
+    def submit(self, func, *args):
+        '''Queue func(*args) in a worker process, blocking until fewer than
+        max_pending tasks are outstanding.  Exceptions raised by func are written
+        to stderr and the task returns None.  Returns the AsyncResult.'''
+
+        # The slot is released whether the task succeeds or fails, e.g. if its
+        # arguments or result cannot be pickled.  _call_task catches the
+        # exceptions raised by func for Python 2 pools, which do not call back
+        # on failure.
+        callbacks = {'callback' : self._release}
+        if _POOL_ERROR_CALLBACK:
+            callbacks['error_callback'] = self._release
+
+        self._slots.acquire()
+        try:
+            return self._pool.apply_async(_call_task, (func, args), **callbacks)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def join(self):
+        '''Wait for all submitted tasks to complete and stop the workers'''
+
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        '''Stop the workers without waiting for outstanding tasks'''
+
+        self._pool.terminate()
+        self._pool.join()
+
+    def _release(self, result):
+
+        self._slots.release()
+
+def _call_task(func, args):
+
+    try:
+        return func(*args)
+    except Exception:
+        sys.stderr.write(traceback.format_exc())
+        return None
+
+def host_rate_limiter(url, rate, burst=1):
+    '''Return the RateLimiter shared by all requests to the host in url, creating
+    it with the specified rate and burst if it does not exist'''
+
+    host = urlparse(url).netloc
+
+    with _host_limiters_lock:
+        if host not in _host_limiters:
+            _host_limiters[host] = RateLimiter(rate, burst=burst)
+
+    return _host_limiters[host]
+
+def map_concurrent(func, items, workers=1):
+    '''Call func on each item in items using a pool of workers threads and return
+    the results in the same order as items.  Items are processed serially if
+    workers < 2.'''
+
+    if workers < 2 or len(items) < 2:
+        return [func(item) for item in items]
+
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        results = pool.map(func, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+def retry_with_jitter(func, should_retry, retries=3, backoff=1.0, max_backoff=60.0):
+    '''Call func() and return its result.  If should_retry(result) is True, func
+    is called again, up to retries more times, after sleeping for a random
+    interval between 0 and backoff * 2**attempt seconds (capped at max_backoff).
+    The last result is returned if all retries fail.'''
+
+    result = func()
+    for attempt in range(retries):
+        if not should_retry(result):
+            break
+        time.sleep(random.uniform(0, min(max_backoff, backoff * 2 ** attempt)))
+        result = func()
+
+    return result
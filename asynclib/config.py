@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import threading
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from asynclib.util import csv2json
+
+# Loaded indexes keyed by fully-qualified filename and stored with the file
+# modification time they were loaded from
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+class FrozenIndex(Mapping):
+    '''Read-only dict-like lookup table'''
+
+    def __init__(self, items):
+
+        self._items = dict(items)
+
+    def __getitem__(self, key):
+
+        return self._items[key]
+
+    def __iter__(self):
+
+        return iter(self._items)
+
+    def __len__(self):
+
+        return len(self._items)
+
+    def __repr__(self):
+
+        return 'FrozenIndex({:s})'.format(repr(self._items))
+
+    def copy(self):
+        '''Return a regular, mutable dict copy'''
+
+        return dict(self._items)
+
+def index_records(records, key):
+    '''Return a FrozenIndex mapping the value of key in each record dict to a
+    read-only copy of the record.  Records without key are skipped.  If key is
+    not unique, the last record wins.'''
+
+    return FrozenIndex([(r[key], FrozenIndex(r)) for r in records if key in r])
+
+def default_config_file(filename):
+    '''Return the location of filename in the OOI_ERDDAP_ASYNC_HOME config
+    directory or None if OOI_ERDDAP_ASYNC_HOME is not set'''
+
+    async_home = os.getenv('OOI_ERDDAP_ASYNC_HOME')
+    if not async_home:
+        return None
+
+    return os.path.join(async_home, 'config', filename)
+
+def load_subsites(subsite_csv=None):
+    '''Return a FrozenIndex of the subsites.csv cable types keyed by subsite
+    name.  Returns None if the file is invalid.'''
+
+    return _load_index(subsite_csv or default_config_file('subsites.csv'), 'subsite', csv2json)
+
+def load_stream_list(stream_csv=None):
+    '''Return a FrozenIndex of the stream-list.csv stream descriptions keyed by
+    stream name.  Returns None if the file is invalid.'''
+
+    return _load_index(stream_csv or default_config_file('stream-list.csv'), 'name', csv2json)
+
+def load_instrument_metadata(instruments_json=None):
+    '''Return a FrozenIndex of the visualocean instrument metadata keyed by
+    reference designator.  Returns None if the file is invalid.'''
+
+    return _load_index(instruments_json or default_config_file('visualocean-instruments-metadata.json'),
+        'reference_designator',
+        _load_json)
+
+def _load_json(json_file):
+
+    try:
+        with open(json_file, 'r') as fid:
+            return json.load(fid)
+    except (IOError, ValueError) as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(e, json_file))
+        return None
+
+def _load_index(filename, key, loader):
+    '''Load and index the records in filename once, reloading it only if the file
+    has been modified since it was last loaded'''
+
+    if not filename:
+        sys.stderr.write('No configuration file specified and OOI_ERDDAP_ASYNC_HOME not set\n')
+        return None
+
+    filename = os.path.abspath(filename)
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError as e:
+        sys.stderr.write('Invalid configuration file: {:s} ({:s})\n'.format(filename, e.strerror))
+        return None
+
+    with _loaded_lock:
+        if filename in _loaded and _loaded[filename][0] == mtime:
+            return _loaded[filename][1]
+
+        records = loader(filename)
+        if not records:
+            return None
+        if any([key not in r for r in records]):
+            sys.stderr.write('{:s}: One or more records missing {:s}\n'.format(filename, key))
+            return None
+
+        index = index_records(records, key)
+        _loaded[filename] = (mtime, index)
+
+    return index
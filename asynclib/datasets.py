@@ -0,0 +1,258 @@
+import re
+import sys
+import numpy as np
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from asynclib.timestamps import iso8601_to_epoch
+
+# Fields parsed from each datasetID and returned as the dataset instrument dict
+INSTRUMENT_FIELDS = ['reference_designator',
+    'subsite',
+    'node',
+    'instrument',
+    'method',
+    'stream',
+    'deployment_number']
+# allDatasets time columns parsed to seconds since 1970-01-01 and stored as
+# <column>Epoch
+EPOCH_COLUMNS = ['minTime',
+    'maxTime']
+
+_DEPLOYMENT_REGEX = re.compile('d(\d{4,})$')
+_STRING_TYPES = (str, type(u''))
+
+class ErddapDatasets(object):
+    '''Columnar, read-only representation of an ERDDAP allDatasets table.  Each
+    column is stored as a single NumPy array, with repeated strings shared, rather
+    than as one dict per dataset.  Iterating or indexing returns a new dict for
+    each dataset, in the same form as the dicts previously returned by
+    fetch_erddap_datasets, so existing callers work unchanged.  Use filter() to
+    select datasets by instrument field and column() to access whole columns
+    without creating per-dataset dicts.  failed is True if the allDatasets
+    request failed, as opposed to returning no OOI datasets.'''
+
+    def __init__(self, column_names, columns, instrument_columns, erddap_url=None, failed=False):
+
+        self.column_names = list(column_names)
+        self.erddap_url = erddap_url
+        self.failed = failed
+        self._columns = columns
+        self._instrument_columns = instrument_columns
+        self._index = None
+
+    @classmethod
+    def from_table(cls, table, erddap_url=None):
+        '''Create an ErddapDatasets from the table object of an allDatasets.json
+        response.  Rows whose datasetID is not a valid OOI stream datasetID are
+        skipped.'''
+
+        column_names = table['columnNames']
+        if 'datasetID' not in column_names:
+            return cls.empty(erddap_url, failed=True)
+        id_column = column_names.index('datasetID')
+
+        # Share a single copy of each repeated string value
+        interned = {}
+        values = [[] for c in column_names]
+        instrument_values = dict([(f, []) for f in INSTRUMENT_FIELDS])
+        for row in table['rows']:
+
+            instrument = parse_dataset_id(row[id_column])
+            if not instrument:
+                continue
+
+            for (col, v) in zip(values, row):
+                col.append(interned.setdefault(v, v) if isinstance(v, _STRING_TYPES) else v)
+            for f in INSTRUMENT_FIELDS:
+                v = instrument[f]
+                instrument_values[f].append(interned.setdefault(v, v) if f != 'deployment_number' else v)
+
+        columns = dict([(c, _column_array(v)) for (c, v) in zip(column_names, values)])
+        for c in EPOCH_COLUMNS:
+            if c in columns:
+                columns['{:s}Epoch'.format(c)] = iso8601_to_epoch(columns[c].tolist())
+
+        instrument_columns = dict([(f, _column_array(v)) for (f, v) in instrument_values.items()])
+        instrument_columns['deployment_number'] = np.array(instrument_values['deployment_number'], dtype=int)
+
+        return cls(column_names, columns, instrument_columns, erddap_url=erddap_url)
+
+    @classmethod
+    def empty(cls, erddap_url=None, failed=False):
+        '''Return an ErddapDatasets containing no datasets.  Set failed to True
+        if it stands in for a failed request.'''
+
+        return cls([],
+            {'datasetID' : _column_array([])},
+            dict([(f, _column_array([])) for f in INSTRUMENT_FIELDS]),
+            erddap_url=erddap_url,
+            failed=failed)
+
+    def __len__(self):
+
+        return len(self._columns['datasetID'])
+
+    def __iter__(self):
+
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            return self.take(np.arange(len(self))[i])
+
+        return self.row(i)
+
+    def __repr__(self):
+
+        return 'ErddapDatasets({:d} datasets, {:s})'.format(len(self), repr(self.erddap_url))
+
+    def row(self, i):
+        '''Return a new dict containing the columns of dataset i, plus the parsed
+        instrument dict, the erddap_base_url and the minTimeEpoch/maxTimeEpoch
+        values (None if the time is missing or invalid)'''
+
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('dataset index out of range')
+
+        dataset = {}
+        for c in self.column_names:
+            dataset[c] = self._columns[c][i]
+        for c in EPOCH_COLUMNS:
+            epoch_column = '{:s}Epoch'.format(c)
+            if epoch_column in self._columns:
+                epoch = float(self._columns[epoch_column][i])
+                dataset[epoch_column] = None if epoch != epoch else epoch
+
+        instrument = dict([(f, self._instrument_columns[f][i]) for f in INSTRUMENT_FIELDS])
+        instrument['deployment_number'] = int(instrument['deployment_number'])
+        dataset['instrument'] = instrument
+
+        dataset['erddap_base_url'] = self.erddap_url
+
+        return dataset
+
+    def column(self, name):
+        '''Return the array containing the named allDatasets, <time>Epoch or
+        instrument field column'''
+
+        if name in self._columns:
+            return self._columns[name]
+
+        return self._instrument_columns[name]
+
+    def index(self):
+        '''Return a dict mapping each datasetID to its row number'''
+
+        if self._index is None:
+            self._index = dict([(d, i) for (i, d) in enumerate(self._columns['datasetID'].tolist())])
+
+        return self._index
+
+    def by_id(self):
+        '''Return a read-only mapping of datasetID to dataset dict, creating each
+        dict only when it is looked up'''
+
+        return DatasetIndex(self)
+
+    def get(self, dataset_id, default=None):
+        '''Return the dict for dataset_id or default if it does not exist'''
+
+        i = self.index().get(dataset_id)
+        if i is None:
+            return default
+
+        return self.row(i)
+
+    def take(self, rows):
+        '''Return a new ErddapDatasets containing the datasets at the specified
+        row numbers'''
+
+        rows = np.asarray(rows, dtype=int)
+
+        return ErddapDatasets(self.column_names,
+            dict([(c, v[rows]) for (c, v) in self._columns.items()]),
+            dict([(f, v[rows]) for (f, v) in self._instrument_columns.items()]),
+            erddap_url=self.erddap_url)
+
+    def filter(self, **criteria):
+        '''Return a new ErddapDatasets containing the datasets matching all of the
+        criteria.  Each keyword is an instrument field (subsite, node, instrument,
+        reference_designator, method, stream, deployment_number) or allDatasets
+        column and each value is either a single value or a list of values.'''
+
+        mask = np.ones(len(self), dtype=bool)
+        for (name, value) in criteria.items():
+            column = self.column(name)
+            if isinstance(value, (list, tuple, set)):
+                values = set(value)
+                mask &= np.array([v in values for v in column.tolist()], dtype=bool)
+            else:
+                mask &= column == value
+
+        return self.take(np.flatnonzero(mask))
+
+    def to_list(self):
+        '''Return the datasets as a list of dicts'''
+
+        return list(self)
+
+class DatasetIndex(Mapping):
+    '''Read-only mapping of datasetID to the dataset dict in an ErddapDatasets'''
+
+    def __init__(self, datasets):
+
+        self._datasets = datasets
+        self._index = datasets.index()
+
+    def __getitem__(self, dataset_id):
+
+        return self._datasets.row(self._index[dataset_id])
+
+    def __contains__(self, dataset_id):
+
+        return dataset_id in self._index
+
+    def __iter__(self):
+
+        return iter(self._index)
+
+    def __len__(self):
+
+        return len(self._index)
+
+def parse_dataset_id(dataset_id):
+    '''Parse the OOI stream datasetID into the dict of instrument fields.  Returns
+    None if dataset_id is not a valid OOI stream datasetID.'''
+
+    id_tokens = dataset_id.split('-')
+    if len(id_tokens) != 7:
+        return None
+
+    deployment_match = _DEPLOYMENT_REGEX.search(id_tokens[6])
+    if not deployment_match:
+        sys.stderr.write('{:s}: Unknown deployment number\n'.format(dataset_id))
+        return None
+
+    return {'reference_designator' : '{:s}-{:s}-{:s}-{:s}'.format(id_tokens[0],
+            id_tokens[1],
+            id_tokens[2],
+            id_tokens[3]),
+        'subsite' : id_tokens[0],
+        'node' : id_tokens[1],
+        'instrument' : '{:s}-{:s}'.format(id_tokens[2], id_tokens[3]),
+        'method' : id_tokens[5],
+        'stream' : id_tokens[4],
+        'deployment_number' : int(deployment_match.groups()[0])}
+
+def _column_array(values):
+
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+
+    return column
@@ -0,0 +1,205 @@
+import os
+import re
+import sys
+import json
+import time
+import requests
+from asynclib import session
+from asynclib.filesystem import write_atomic
+
+# Default size, in bytes, of each chunk read from the response and written to disk
+DEFAULT_BUFFER_SIZE = 4 * 1048576
+
+_CONTENT_RANGE_REGEX = re.compile('bytes\s+(\d+|\*)(?:-(\d+))?/(\d+|\*)')
+
+def download_file(url, output_filename, buffer_size=DEFAULT_BUFFER_SIZE, fsync=False, params=None, resume=False, empty_status=None):
+    '''Stream the response body of url to output_filename using the shared HTTP
+    session.  If resume is True, the partial download (output_filename.part) and
+    its manifest (output_filename.part.json) are kept if the transfer fails and
+    the next call resumes the download with an HTTP Range request, provided the
+    server honours them.  If the server returns empty_status, the request is
+    considered successful but no file is written and the returned filename is
+    None.  The transfer holds one of the host's session.host_slot slots.  See
+    stream_to_file for the return value.'''
+
+    with session.host_slot(url):
+        return _download_file(url, output_filename, buffer_size, fsync, params, resume, empty_status)
+
+def _download_file(url, output_filename, buffer_size, fsync, params, resume, empty_status):
+
+    part_filename = '{:s}.part'.format(output_filename)
+    headers = {}
+    offset = 0
+    if resume:
+        # Byte ranges must refer to the unencoded response body
+        headers['Accept-Encoding'] = 'identity'
+        manifest = read_download_manifest(output_filename)
+        if manifest and manifest.get('url') == url and manifest.get('accept_ranges') and os.path.isfile(part_filename):
+            offset = os.path.getsize(part_filename)
+        if offset:
+            headers['Range'] = 'bytes={:d}-'.format(offset)
+            validator = manifest.get('etag') or manifest.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+            sys.stdout.write('Resuming download at byte {:d}: {:s}\n'.format(offset, output_filename))
+
+    try:
+        r = session.get(url, stream=True, params=params, headers=headers)
+    except requests.exceptions.RequestException as e:
+        sys.stderr.write('Download failed: {:s} ({:s})\n'.format(url, e))
+        return None
+
+    if empty_status and r.status_code == empty_status:
+        r.close()
+        remove_download_files(output_filename)
+        return {'filename' : None,
+            'bytes' : 0,
+            'elapsed' : 0.,
+            'mb_per_sec' : 0.}
+
+    expected_size = None
+    mode = 'wb'
+    if r.status_code == 206:
+        (start, total) = _parse_content_range(r.headers.get('Content-Range'))
+        if start != offset:
+            sys.stderr.write('Unexpected Content-Range ({:s}), restarting download: {:s}\n'.format(r.headers.get('Content-Range'), output_filename))
+            r.close()
+            remove_download_files(output_filename)
+            return _download_file(url, output_filename, buffer_size, fsync, params, False, empty_status)
+        expected_size = total
+        mode = 'ab'
+    elif r.status_code == 416 and offset:
+        # The partial download may already contain the entire response
+        (start, total) = _parse_content_range(r.headers.get('Content-Range'))
+        r.close()
+        if total == offset:
+            return _complete_download(output_filename, 0, 0.)
+        remove_download_files(output_filename)
+        return _download_file(url, output_filename, buffer_size, fsync, params, resume, empty_status)
+    elif r.status_code == 200:
+        if offset:
+            sys.stdout.write('Server ignored the Range request, restarting download: {:s}\n'.format(output_filename))
+        offset = 0
+        if r.headers.get('Content-Length') and not r.headers.get('Content-Encoding'):
+            expected_size = int(r.headers['Content-Length'])
+    else:
+        sys.stderr.write('Download failed: {:s} (Reason={:s})\n'.format(url, r.reason))
+        r.close()
+        return None
+
+    accept_ranges = r.status_code == 206 or r.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    if resume:
+        write_atomic('{:s}.part.json'.format(output_filename), json.dumps({'url' : url,
+            'etag' : r.headers.get('ETag'),
+            'last_modified' : r.headers.get('Last-Modified'),
+            'content_length' : expected_size,
+            'accept_ranges' : accept_ranges}))
+
+    return stream_to_file(r,
+        output_filename,
+        buffer_size=buffer_size,
+        fsync=fsync,
+        mode=mode,
+        expected_size=expected_size,
+        keep_partial=resume and accept_ranges)
+
+def stream_to_file(response, output_filename, buffer_size=DEFAULT_BUFFER_SIZE, fsync=False, mode='wb', expected_size=None, keep_partial=False):
+    '''Write the body of the streamed requests response to output_filename in
+    buffer_size chunks.  The body is written to output_filename.part, which is
+    renamed to output_filename once the download is complete and, if specified,
+    the file size equals expected_size, so output_filename never contains a
+    partial download.  Use mode='ab' to append to an existing partial download.
+    The partial download is deleted on failure unless keep_partial is True, but
+    the download manifest, if any, is kept.  The
+    file is only flushed to disk if fsync is True.  Returns a dict containing the
+    output filename, the number of bytes written, the elapsed time and the
+    throughput in MB/s or None if the download failed.'''
+
+    part_filename = '{:s}.part'.format(output_filename)
+
+    t0 = time.time()
+    num_bytes = 0
+    try:
+        with open(part_filename, mode, buffer_size) as fid:
+            for chunk in response.iter_content(chunk_size=buffer_size):
+                fid.write(chunk)
+                num_bytes += len(chunk)
+            if fsync:
+                fid.flush()
+                os.fsync(fid.fileno())
+    except (IOError, OSError, requests.exceptions.RequestException) as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(output_filename, e))
+        if keep_partial:
+            sys.stderr.write('Keeping partial download: {:s}\n'.format(part_filename))
+        elif os.path.isfile(part_filename):
+            os.unlink(part_filename)
+        return None
+    finally:
+        response.close()
+
+    if expected_size is not None and os.path.getsize(part_filename) != expected_size:
+        sys.stderr.write('Incomplete download ({:d} of {:d} bytes): {:s}\n'.format(os.path.getsize(part_filename),
+            expected_size,
+            output_filename))
+        if not keep_partial:
+            os.unlink(part_filename)
+        return None
+
+    return _complete_download(output_filename, num_bytes, time.time() - t0)
+
+def read_download_manifest(output_filename):
+    '''Return the manifest of the partial download of output_filename or None if
+    there is no partial download'''
+
+    manifest_file = '{:s}.part.json'.format(output_filename)
+    if not os.path.isfile(manifest_file):
+        return None
+
+    try:
+        with open(manifest_file, 'r') as fid:
+            return json.load(fid)
+    except (IOError, ValueError) as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(manifest_file, e))
+        return None
+
+def remove_download_files(output_filename):
+    '''Delete the partial download and manifest of output_filename'''
+
+    for filename in ['{:s}.part'.format(output_filename), '{:s}.part.json'.format(output_filename)]:
+        if os.path.isfile(filename):
+            os.unlink(filename)
+
+def _complete_download(output_filename, num_bytes, elapsed):
+
+    try:
+        os.rename('{:s}.part'.format(output_filename), output_filename)
+    except OSError as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(output_filename, e))
+        return None
+
+    manifest_file = '{:s}.part.json'.format(output_filename)
+    if os.path.isfile(manifest_file):
+        os.unlink(manifest_file)
+
+    mb_per_sec = num_bytes / 1048576. / max(elapsed, 1e-6)
+    sys.stdout.write('Downloaded {:s}: {:0.1f} MB in {:0.1f}s ({:0.1f} MB/s)\n'.format(output_filename,
+        num_bytes / 1048576.,
+        elapsed,
+        mb_per_sec))
+
+    return {'filename' : output_filename,
+        'bytes' : num_bytes,
+        'elapsed' : elapsed,
+        'mb_per_sec' : mb_per_sec}
+
+def _parse_content_range(content_range):
+
+    match = _CONTENT_RANGE_REGEX.match(content_range or '')
+    if not match:
+        return (None, None)
+
+    (start, end, total) = match.groups()
+    start = int(start) if start != '*' else None
+    total = int(total) if total != '*' else None
+
+    return (start, total)
@@ -1,12 +1,29 @@
 import os
 import sys
+import json
 import requests
-import re
 from dateutil import parser
 from dateutil.relativedelta import relativedelta as tdelta
 import string
 import random
+import threading
+import numpy as np
 from xml.etree import ElementTree
+from asynclib import session
+from asynclib.download import download_file, read_download_manifest, remove_download_files, DEFAULT_BUFFER_SIZE
+from asynclib.filesystem import write_atomic
+from asynclib.templating import load_xml_template
+from asynclib.timestamps import iso8601_to_epoch
+from asynclib.datasets import ErddapDatasets, EPOCH_COLUMNS
+
+# ResponseCache used by fetch_erddap_datasets if none is specified.  Set with
+# use_response_cache.
+_response_cache = None
+# Number of allDatasets metadata requests made by fetch_erddap_datasets and the
+# number avoided by passing a dataset record or snapshot to download_erddap_nc
+_metadata_counters = {'requests' : 0,
+    'skipped' : 0}
+_metadata_lock = threading.Lock()
 
 _NC_TYPES = ['CF',
     'CFMA']
@@ -28,13 +45,28 @@ _VALID_RELATIVE_TIMEDELTA_TYPES = ('years',
     'minutes',
     'seconds')
 
-def fetch_erddap_datasets(erddap_url, dataset_id=None, full_listing=False):
-    '''Fetch the allDatasets.json request at the specified erddap_url.  Returns
-    a list of dicts containing individual datasets.  A datetime object is added
-    to each dataset if the dataset contains a valid minTime and/or maxTime provided
-    skip_datetime is set to False <default=True>.'''
+def use_response_cache(cache):
+    '''Set the asynclib.cache.ResponseCache used by fetch_erddap_datasets to cache
+    and conditionally revalidate allDatasets.json responses.  Set to None to
+    disable caching.'''
+    
+    global _response_cache
+    
+    _response_cache = cache
     
-    datasets = []
+def fetch_erddap_datasets(erddap_url, dataset_id=None, full_listing=False, cache=None):
+    '''Fetch the allDatasets.json request at the specified erddap_url.  Returns
+    an ErddapDatasets table which, when iterated or indexed, returns a dict for
+    each dataset containing the allDatasets columns, the instrument fields parsed
+    from the datasetID and the minTime and maxTime parsed in bulk to minTimeEpoch
+    and maxTimeEpoch (seconds since 1970-01-01T00:00:00Z or None).  The table is
+    empty, with its failed attribute set to True, if the request fails.  If a
+    ResponseCache is specified, or one has been set with use_response_cache, the
+    response is served from the cache while it is fresh and revalidated with a
+    conditional GET once it is stale.'''
+    
+    # Returned if the request fails
+    datasets = ErddapDatasets.empty(erddap_url, failed=True)
     
     if full_listing:
         datasets_url = '{:s}/allDatasets.json'.format(erddap_url.strip('/'))
@@ -44,9 +76,19 @@ def fetch_erddap_datasets(erddap_url, dataset_id=None, full_listing=False):
     if dataset_id:
         datasets_url = '{:s}&datasetID=%22{:s}%22'.format(datasets_url, dataset_id)
     
+    cache = cache or _response_cache
+    if cache:
+        # Only requests the cache sends to the server are counted
+        cached_datasets = cache.fetch(datasets_url,
+            lambda body: ErddapDatasets.from_table(json.loads(body)['table'], erddap_url=erddap_url),
+            on_request=lambda: _count_metadata('requests'))
+        return cached_datasets if cached_datasets is not None else datasets
+        
+    _count_metadata('requests')
+    
     try:
-        r = requests.get(datasets_url)
-    except requests.exceptions.MissingSchema as e:
+        r = session.get(datasets_url)
+    except requests.exceptions.RequestException as e:
         sys.stderr.write('{:s}\n'.format(e))
         return datasets
         
@@ -61,45 +103,89 @@ def fetch_erddap_datasets(erddap_url, dataset_id=None, full_listing=False):
         sys.stderr.write('{:s}: {:s}\n'.format(e, datasets_url))
         return datasets
     
-    # Regex to extract the deployment number
-    deployment_regex = re.compile('d(\d{4,})$')
+    return ErddapDatasets.from_table(response['table'], erddap_url=erddap_url)
+    
+def metadata_request_stats():
+    '''Return a dict containing the number of allDatasets metadata requests made by
+    fetch_erddap_datasets and the number skipped because the dataset record was
+    passed to download_erddap_nc'''
     
-    col_count = range(len(response['table']['columnNames']))   
-    # Create a list of dicts containing each dataset
-    for row in response['table']['rows']:
+    with _metadata_lock:
+        return dict(_metadata_counters)
         
-        dataset = {response['table']['columnNames'][x]: row[x] for x in col_count}
+def format_metadata_request_stats():
+    '''Return the metadata request counters as a single line of text'''
+    
+    s = metadata_request_stats()
+    
+    return 'ERDDAP metadata requests: {:d}, skipped: {:d}'.format(s['requests'], s['skipped'])
+    
+def _count_metadata(name):
+    
+    with _metadata_lock:
+        _metadata_counters[name] += 1
         
-        id_tokens = dataset['datasetID'].split('-')
-        if len(id_tokens) != 7:
-            #sys.stderr.write('Invalid datasetID: {:s}\n'.format(dataset['datasetID']))
-            continue
+def resolve_erddap_dataset(erddap_url, dataset_id, dataset=None):
+    '''Return the allDatasets record for dataset_id.  dataset may be the record
+    itself, an ErddapDatasets snapshot or a dict-like index of records keyed by
+    datasetID, in which case no request is sent.  The record is fetched from
+    erddap_url if dataset is not specified or does not contain dataset_id.
+    Returns None if the dataset does not exist.'''
+    
+    record = None
+    if isinstance(dataset, dict) and dataset.get('datasetID') == dataset_id:
+        record = dataset
+    elif dataset is not None and hasattr(dataset, 'get'):
+        record = dataset.get(dataset_id)
+        
+    if record:
+        _count_metadata('skipped')
+        return record
+        
+    datasets = fetch_erddap_datasets(erddap_url, dataset_id=dataset_id)
+    if not datasets:
+        return None
         
-        deployment_match = deployment_regex.search(id_tokens[6])
-        if not deployment_match:
-            sys.stderr.write('{:s}: Unknown deployment number\n'.format(dataset['datasetID']))
+    return datasets[0]
+    
+def add_erddap_epochs(datasets):
+    '''Parse the minTime and maxTime of all datasets in bulk and store them in each
+    dataset as minTimeEpoch and maxTimeEpoch.  Missing or invalid times are
+    stored as None.'''
+    
+    for column in EPOCH_COLUMNS:
+        if not any([column in d for d in datasets]):
             continue
+        epochs = iso8601_to_epoch([d.get(column) for d in datasets])
+        epoch_column = '{:s}Epoch'.format(column)
+        for (dataset, epoch) in zip(datasets, epochs.tolist()):
+            dataset[epoch_column] = None if epoch != epoch else epoch
             
-        reference_designator = '{:s}-{:s}-{:s}-{:s}'.format(id_tokens[0],
-            id_tokens[1], 
-            id_tokens[2],
-            id_tokens[3])
-        instrument = {'reference_designator' : reference_designator,
-            'subsite' : id_tokens[0],
-            'node' : id_tokens[1],
-            'instrument' : '{:s}-{:s}'.format(id_tokens[2], id_tokens[3]),
-            'method' : id_tokens[5],
-            'stream' : id_tokens[4],
-            'deployment_number' : int(deployment_match.groups()[0])}
-        dataset['instrument'] = instrument
-        
-        # Add the erddap url
-        dataset['erddap_base_url'] = erddap_url
-            
-        datasets.append(dataset)
-        
     return datasets
     
+def erddap_epochs(datasets, column):
+    '''Return the column (minTime or maxTime) of datasets as a float array of
+    seconds since 1970-01-01T00:00:00Z, using the pre-parsed <column>Epoch values
+    if all datasets have them.  Missing or invalid times are NaN.'''
+    
+    epoch_column = '{:s}Epoch'.format(column)
+    if isinstance(datasets, ErddapDatasets):
+        return datasets.column(epoch_column).astype(float)
+    if all([epoch_column in d for d in datasets]):
+        return np.array([d[epoch_column] for d in datasets], dtype=float)
+        
+    return iso8601_to_epoch([d.get(column) for d in datasets])
+    
+def index_erddap_datasets(datasets):
+    '''Return a dict mapping each datasetID in datasets to the corresponding
+    dataset.  For an ErddapDatasets table, a read-only mapping that creates each
+    dataset dict when it is looked up is returned.'''
+    
+    if isinstance(datasets, ErddapDatasets):
+        return datasets.by_id()
+        
+    return {d['datasetID'] : d for d in datasets}
+    
 def create_dataset_xml_filename(instrument, stream, telemetry, deployment_number):
     
     return '{:s}-{:s}-{:s}-deployment{:04.0f}.dataset.xml'.format(
@@ -126,10 +212,10 @@ def create_dataset_xml(nc_dir, xml_template_file, dataset_id, title, summary, su
         sys.stderr.write('Invalid dataset XML file: {:s}\n'.format(xml_template_file))
         return
         
-    # Parse the xml template file
-    doc = ElementTree.parse(xml_template_file)
-    
-    root = doc.getroot()
+    # Copy the parsed xml template
+    root = load_xml_template(xml_template_file)
+    if root is None:
+        return
     # The root element must be 'dataset'
     if root.tag != 'dataset':
         sys.stderr.write('Invalid dataset XML template file (Root element must be of type=dataset): {:s}\n'.format(xml_template_file))
@@ -173,14 +259,10 @@ def create_dataset_xml(nc_dir, xml_template_file, dataset_id, title, summary, su
     atts[i].text = summary
     
     # Check the node type to see if we need to add trajectory DSG variables and attributes
-    node_type = dataset_id.split('-')[1][:2]
-    if node_type in _TRAJECTORY_NODE_TYPES:
+    if is_trajectory_dataset(dataset_id):
         sys.stdout.write('{:s}: Adding Trajectory DSG elements\n'.format(dataset_id))
         
-        traj_elements_dir = os.path.join(os.getenv('OOI_ERDDAP_ASYNC_HOME'),
-            'config',
-            'nc',
-            'trajectory')
+        traj_elements_dir = _trajectory_elements_dir()
         if not os.path.isdir(traj_elements_dir):
             sys.stderr.write('Invalid trajectory elements directory: {:s}\n'.format(traj_elements_dir))
             return ElementTree.tostring(root)
@@ -195,14 +277,14 @@ def create_dataset_xml(nc_dir, xml_template_file, dataset_id, title, summary, su
             sys.stderr.write('Invalid trajectory variable element file: {:s}\n'.format(traj_var_xml))
             return ElementTree.tostring(root)
             
-        traj_vars_doc = ElementTree.parse(traj_var_xml)
-        traj_vars_root = traj_vars_doc.getroot()
-        if traj_vars_root.tag != 'dataset':
+        traj_vars_root = load_xml_template(traj_var_xml)
+        if traj_vars_root is None or traj_vars_root.tag != 'dataset':
             sys.stderr.write('{:s}: root tag must be a dataset element\n'.format(traj_var_xml))
             return ElementTree.tostring(root)
             
-        traj_atts_doc = ElementTree.parse(traj_atts_xml)
-        traj_root = traj_atts_doc.getroot()
+        traj_root = load_xml_template(traj_atts_xml)
+        if traj_root is None:
+            return ElementTree.tostring(root)
         traj_atts = traj_root.findall('att')
         for traj_att in traj_atts:
             add_atts_e.append(traj_att)
@@ -216,6 +298,31 @@ def create_dataset_xml(nc_dir, xml_template_file, dataset_id, title, summary, su
     # Return the string XML
     return ElementTree.tostring(root)
 
+def is_trajectory_dataset(dataset_id):
+    '''Return True if the node type of dataset_id requires the trajectory DSG
+    attributes and variables'''
+    
+    return dataset_id.split('-')[1][:2] in _TRAJECTORY_NODE_TYPES
+    
+def dataset_xml_input_files(xml_template_file, dataset_id):
+    '''Return the list of files create_dataset_xml reads to create the dataset
+    XML for dataset_id from xml_template_file'''
+    
+    input_files = [xml_template_file]
+    if is_trajectory_dataset(dataset_id):
+        traj_elements_dir = _trajectory_elements_dir()
+        input_files.extend([os.path.join(traj_elements_dir, 'trajectory.atts.xml'),
+            os.path.join(traj_elements_dir, 'trajectory.vars.xml')])
+            
+    return input_files
+    
+def _trajectory_elements_dir():
+    
+    return os.path.join(os.getenv('OOI_ERDDAP_ASYNC_HOME', ''),
+        'config',
+        'nc',
+        'trajectory')
+        
 def create_frontend_dataset_xml(nc_dir, xml_template_file, dataset_id):
     
     # Validate input args
@@ -226,10 +333,10 @@ def create_frontend_dataset_xml(nc_dir, xml_template_file, dataset_id):
         sys.stderr.write('Invalid dataset XML file: {:s}\n'.format(xml_template_file))
         return
         
-    # Parse the xml template file
-    doc = ElementTree.parse(xml_template_file)
-    
-    root = doc.getroot()
+    # Copy the parsed xml template
+    root = load_xml_template(xml_template_file)
+    if root is None:
+        return
     # The root element must be 'dataset'
     if root.tag != 'dataset':
         sys.stderr.write('Invalid dataset XML template file (Root element must be of type=dataset): {:s}\n'.format(xml_template_file))
@@ -397,7 +504,10 @@ def get_new_erddap_datasets(erddap_datasets1, erddap_datasets2):
     new_datasets = []
     
     try:
-        dest_dataset_ids = [d['datasetID'] for d in erddap_datasets2]
+        if isinstance(erddap_datasets2, ErddapDatasets):
+            dest_dataset_ids = set(erddap_datasets2.column('datasetID').tolist())
+        else:
+            dest_dataset_ids = set([d['datasetID'] for d in erddap_datasets2])
     except KeyError as e:
         sys.stderr.write('{:s}\n'.format(e))
         return new_datasets
@@ -416,57 +526,54 @@ def get_updated_erddap_datasets(erddap_datasets1, erddap_datasets2, delta_second
     updated_datasets = []
     
     try:
-        dest_dataset_ids = [d['datasetID'] for d in erddap_datasets2]
+        dest_datasets = index_erddap_datasets(erddap_datasets2)
     except KeyError as e:
         sys.stderr.write('{:s}\n'.format(e))
         return updated_datasets
         
-    # Loop through each dataset in erddap_datasets1.  Skip the dataset if it is
-    # not present in erddap_datasets2.  If it is present, convert min/maxTime to
-    # datetimes to compare them.
+    # Compare whole columns if both tables are columnar
+    if isinstance(erddap_datasets1, ErddapDatasets) and isinstance(erddap_datasets2, ErddapDatasets):
+        dest_index = erddap_datasets2.index()
+        rows1 = []
+        rows2 = []
+        for (i, dataset_id) in enumerate(erddap_datasets1.column('datasetID').tolist()):
+            if dataset_id in dest_index:
+                rows1.append(i)
+                rows2.append(dest_index[dataset_id])
+        source_datasets = erddap_datasets1.take(rows1)
+        target_datasets = erddap_datasets2.take(rows2)
+        return _compare_erddap_times(source_datasets, target_datasets, delta_seconds)
+        
+    # Pair each dataset in erddap_datasets1 with the corresponding dataset in
+    # erddap_datasets2, skipping those that are not present in erddap_datasets2
+    source_datasets = []
+    target_datasets = []
     for dataset in erddap_datasets1:
-        if dataset['datasetID'] not in dest_dataset_ids:
-            continue
-            
-        # Get the corresponding dataset in erddap_datasets2
-        target_dataset = erddap_datasets2[dest_dataset_ids.index(dataset['datasetID'])]
-        # Parse the min/maxTimes from both datasets
-        try:
-            min_dt1 = parser.parse(dataset['minTime'])
-        except ValueError as e:
-            sys.stderr.write('Date parse error ({:s}): {:s}\n'.format(e, dataset['minTime']))
+        target_dataset = dest_datasets.get(dataset['datasetID'])
+        if not target_dataset:
             continue
-            
-        try:
-            max_dt1 = parser.parse(dataset['maxTime'])
-        except ValueError as e:
-            sys.stderr.write('Date parse error ({:s}): {:s}\n'.format(e, dataset['maxTime']))
-            continue
-            
-        try:
-            min_dt2 = parser.parse(target_dataset['minTime'])
-        except ValueError as e:
-            sys.stderr.write('Date parse error ({:s}): {:s}\n'.format(e, target_dataset['minTime']))
-            continue
-            
-            max_dt2 = parser.parse(target_dataset['maxTime'])
-        except ValueError as e:
-            sys.stderr.write('Date parse error ({:s}): {:s}\n'.format(e, target_dataset['maxTime']))
-            continue
-            
-        delta_start = min_dt1 - min_dt2
-        delta_end = max_dt1 - max_dt2
-        
-        # Compare the deltas to determine if the erddap_datasets1 dataset has
-        # been updated
-        if abs(delta_start.total_seconds()) > abs(delta_seconds):
-            updated_datasets.append(dataset)
-        elif abs(delta_end.total_seconds()) > abs(delta_seconds):
-            updated_datasets.append(dataset)
+        source_datasets.append(dataset)
+        target_datasets.append(target_dataset)
+        
+    return _compare_erddap_times(source_datasets, target_datasets, delta_seconds)
+    
+def _compare_erddap_times(source_datasets, target_datasets, delta_seconds):
+    
+    if not len(source_datasets):
+        return []
+        
+    # Compare the start and end times of all pairs at once.  Pairs with missing or
+    # invalid times compare as NaN and are not considered updated.
+    delta_start = np.abs(erddap_epochs(source_datasets, 'minTime') - erddap_epochs(target_datasets, 'minTime'))
+    delta_end = np.abs(erddap_epochs(source_datasets, 'maxTime') - erddap_epochs(target_datasets, 'maxTime'))
+    with np.errstate(invalid='ignore'):
+        updated = (delta_start > abs(delta_seconds)) | (delta_end > abs(delta_seconds))
+        
+    updated_datasets = [source_datasets[i] for i in np.flatnonzero(updated)]
             
     return updated_datasets
     
-def download_erddap_nc(erddap_url, dataset_id, output_filename=None, nc_type=None, time_delta_type=None, time_delta_value=None, start_time=None, end_time=None, clobber=None, print_url=False):
+def download_erddap_nc(erddap_url, dataset_id, output_filename=None, nc_type=None, time_delta_type=None, time_delta_value=None, start_time=None, end_time=None, clobber=None, print_url=False, buffer_size=DEFAULT_BUFFER_SIZE, fsync=False, start_inclusive=True, end_inclusive=True, resume=False, dataset=None):
     '''Download a flat, table-like, NetCDF-3 binary file for the specified datasetID,
     with COARDS/CF/ACDD metadata from the specified erddap_base_url.  The entire time 
     series is downloaded by default. 
@@ -487,6 +594,18 @@ def download_erddap_nc(erddap_url, dataset_id, output_filename=None, nc_type=Non
         start_time: string specifying the start of the time-series to download
         end_time: string specifying the end of the time-series to download
         print_url: set to True to print the request URL, but do not send the request.
+        buffer_size: number of bytes read from the response and written at a time
+            <default=4 MB>.
+        fsync: set to True to flush the file to disk once the download is complete
+            <default=False>.
+        start_inclusive: set to False to exclude rows at start_time, i.e. to request
+            only rows newer than start_time <default=True>.
+        end_inclusive: set to False to exclude rows at end_time <default=True>.
+        resume: set to True to keep the partial download if the transfer fails and
+            resume it with an HTTP Range request on the next call <default=False>.
+        dataset: allDatasets record for dataset_id, or an ErddapDatasets snapshot
+            or datasetID index containing it, used instead of requesting the
+            dataset metadata from erddap_url.
     '''
     
     # Check the nc_type if specified
@@ -494,20 +613,12 @@ def download_erddap_nc(erddap_url, dataset_id, output_filename=None, nc_type=Non
         sys.stderr.write('Invalid nc_type parameter: {:s}\n'.format(nc_type))
         return
     
-    # Fetch the ERDDAP dataset metadata to make sure the dataset exists
-    dataset = fetch_erddap_datasets(erddap_url, dataset_id=dataset_id)
+    # Fetch the ERDDAP dataset metadata to make sure the dataset exists, unless
+    # the caller already has it
+    dataset = resolve_erddap_dataset(erddap_url, dataset_id, dataset=dataset)
     if not dataset:
         sys.stderr.write('Invalid ERDDAP dataset (datasetID={:s})\n'.format(dataset_id))
         return
-    dataset = dataset[0]
-    
-    # Create the request url base    
-    request_url = '{:s}/{:s}.nc'.format(erddap_url.strip('/'),
-        dataset_id)
-    
-    # Add the optional nc_type, if specified and valid    
-    if nc_type:
-        request_url = '{:s}{:s}'.format(request_url, nc_type)
     
     # The user can use request a file by either using the time_delta_type and time_delta_value
     # kwargs or specifying a begin_ts and/or end_ts date string.  
@@ -573,10 +684,13 @@ def download_erddap_nc(erddap_url, dataset_id, output_filename=None, nc_type=Non
                 
     # We should have a start_dt and end_dt to add to the query, regardless of whether
     # the user specified time_delta* or start_time/end_time
-    time_params = 'time>={:s}&time<={:s}'.format(start_dt.strftime('%Y-%m-%dT%H:%M:%SZ'),
-        end_dt.strftime('%Y-%m-%dT%H:%M:%SZ'))
-        
-    request_url = '{:s}?&{:s}'.format(request_url, time_params)
+    request_url = create_nc_request_url(erddap_url,
+        dataset_id,
+        start_dt,
+        end_dt,
+        nc_type=nc_type,
+        start_inclusive=start_inclusive,
+        end_inclusive=end_inclusive)
     
     if print_url:
         sys.stderr.write('{:s}\n'.format(request_url))
@@ -596,25 +710,184 @@ def download_erddap_nc(erddap_url, dataset_id, output_filename=None, nc_type=Non
             sys.stderr.write('Output filename already exists (set clobber=True to overwrite): {:s}\n'.format(output_filename))
             return
     
-    # Send the download request        
-    r = requests.get(request_url, stream=True)
-    if r.status_code != 200:
-        sys.stderr.write('Download failed: {:s} (Reason={:s})\n'.format(request_url, r.reason))
-        return
-    
-    # Chunk the response and write the NetCDF file
-    try:    
-        with open(output_filename, 'wb') as fid:
-            for chunk in r.iter_content(chunk_size=1024):
-                fid.write(chunk)
-                fid.flush()
-    except IOError as e:
-        sys.stderr.write('{:s} (Query produced no matching rows?)\n'.format(e))
-        r.close()
+    # Stream the response to a temporary file that is renamed to output_filename
+    # once the download is complete
+    download = download_file(request_url, output_filename, buffer_size=buffer_size, fsync=fsync, resume=resume)
+    if not download:
         return None
             
     return output_filename
             
+def create_nc_request_url(erddap_url, dataset_id, start_dt, end_dt, nc_type=None, start_inclusive=True, end_inclusive=True):
+    '''Return the ERDDAP NetCDF request url for all rows of dataset_id between the
+    start_dt and end_dt datetimes'''
+    
+    request_url = _nc_request_base_url(erddap_url, dataset_id, nc_type=nc_type)
+        
+    time_params = 'time{:s}{:s}&time{:s}{:s}'.format('>=' if start_inclusive else '>',
+        _format_constraint_time(start_dt),
+        '<=' if end_inclusive else '<',
+        _format_constraint_time(end_dt))
+        
+    return '{:s}?&{:s}'.format(request_url, time_params)
+    
+def _format_constraint_time(dt):
+    
+    # Sub-second times are kept so that requests for rows newer than the last
+    # row of a high rate stream don't repeat rows within the same second
+    if dt.microsecond:
+        return dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+    
+def _nc_request_base_url(erddap_url, dataset_id, nc_type=None):
+    
+    # Create the request url base    
+    request_url = '{:s}/{:s}.nc'.format(erddap_url.strip('/'),
+        dataset_id)
+    
+    # Add the optional nc_type, if specified and valid    
+    if nc_type:
+        request_url = '{:s}{:s}'.format(request_url, nc_type)
+        
+    return request_url
+    
+def download_erddap_nc_windows(erddap_url, dataset_id, output_filename, nc_type=None, window_days=30, buffer_size=DEFAULT_BUFFER_SIZE, fsync=False, dataset=None):
+    '''Download the entire time series of dataset_id as a sequence of NetCDF files
+    each containing window_days of data, named output_filename.0000,
+    output_filename.0001, etc.  Completed windows are recorded in
+    output_filename.windows.json so that an interrupted download only re-requests
+    the incomplete windows on the next call.  Windows containing no data are
+    skipped.  dataset is passed to resolve_erddap_dataset to avoid requesting the
+    dataset metadata.  Returns the list of downloaded files or None if any window
+    failed.'''
+    
+    if nc_type and not nc_type in _NC_TYPES:
+        sys.stderr.write('Invalid nc_type parameter: {:s}\n'.format(nc_type))
+        return None
+        
+    dataset = resolve_erddap_dataset(erddap_url, dataset_id, dataset=dataset)
+    if not dataset:
+        sys.stderr.write('Invalid ERDDAP dataset (datasetID={:s})\n'.format(dataset_id))
+        return None
+    
+    try:
+        start_dt = parser.parse(dataset['minTime'])
+        end_dt = parser.parse(dataset['maxTime'])
+    except ValueError as e:
+        sys.stderr.write('Dataset time parse error: {:s}\n'.format(e))
+        return None
+        
+    windows = []
+    window_dt0 = start_dt
+    while True:
+        window_dt1 = min(window_dt0 + tdelta(days=window_days), end_dt)
+        windows.append((window_dt0, window_dt1))
+        if window_dt1 >= end_dt:
+            break
+        window_dt0 = window_dt1
+        
+    # Load the completed windows of a previous, interrupted download of the same
+    # time series
+    manifest_file = '{:s}.windows.json'.format(output_filename)
+    manifest = {'minTime' : dataset['minTime'],
+        'maxTime' : dataset['maxTime'],
+        'window_days' : window_days,
+        'completed' : {}}
+    if os.path.isfile(manifest_file):
+        try:
+            with open(manifest_file, 'r') as fid:
+                previous = json.load(fid)
+        except (IOError, ValueError) as e:
+            sys.stderr.write('{:s}: {:s}\n'.format(manifest_file, e))
+            previous = {}
+        if [previous.get(k) for k in ['minTime', 'maxTime', 'window_days']] == [manifest[k] for k in ['minTime', 'maxTime', 'window_days']]:
+            manifest['completed'] = previous['completed']
+        else:
+            for nc_file in previous.get('completed', {}).values():
+                if nc_file and os.path.isfile(nc_file):
+                    os.unlink(nc_file)
+                    
+    for (i, (window_dt0, window_dt1)) in enumerate(windows):
+        
+        if str(i) in manifest['completed']:
+            continue
+            
+        request_url = create_nc_request_url(erddap_url,
+            dataset_id,
+            window_dt0,
+            window_dt1,
+            nc_type=nc_type,
+            end_inclusive=i == len(windows) - 1)
+        sys.stdout.write('Requesting window {:d} of {:d}: {:s}\n'.format(i + 1, len(windows), request_url))
+        # ERDDAP responds with 404 if the window contains no data
+        download = download_file(request_url,
+            '{:s}.{:04d}'.format(output_filename, i),
+            buffer_size=buffer_size,
+            fsync=fsync,
+            resume=True,
+            empty_status=404)
+        if not download:
+            return None
+            
+        manifest['completed'][str(i)] = download['filename']
+        write_atomic(manifest_file, json.dumps(manifest))
+        
+    if os.path.isfile(manifest_file):
+        os.unlink(manifest_file)
+        
+    return [manifest['completed'][str(i)] for i in range(len(windows)) if manifest['completed'][str(i)]]
+    
+def download_erddap_nc_resumable(erddap_url, dataset_id, output_filename, nc_type=None, window_days=30, buffer_size=DEFAULT_BUFFER_SIZE, fsync=False, dataset=None):
+    '''Download the entire time series of dataset_id to output_filename.  If the
+    transfer fails, the partial download is resumed with an HTTP Range request on
+    the next call.  If the server does not honour Range requests, the time series
+    is downloaded in window_days windows instead (see download_erddap_nc_windows).
+    dataset is passed to resolve_erddap_dataset to avoid requesting the dataset
+    metadata.  Returns the list of downloaded files or None if the download
+    failed.'''
+    
+    # Resume an interrupted download with its original request url, including
+    # its end time, so that the byte range refers to the same response even if
+    # the dataset end time has since advanced.  Rows after the original end time
+    # are fetched on the next pass.
+    manifest = read_download_manifest(output_filename)
+    if manifest and manifest.get('accept_ranges') and '{}'.format(manifest.get('url')).startswith('{:s}?'.format(_nc_request_base_url(erddap_url, dataset_id, nc_type=nc_type))):
+        sys.stdout.write('Resuming original request: {:s}\n'.format(manifest['url']))
+        if not download_file(manifest['url'], output_filename, buffer_size=buffer_size, fsync=fsync, resume=True):
+            return None
+        return [output_filename]
+        
+    # Continue an interrupted time-windowed download
+    if not os.path.isfile('{:s}.windows.json'.format(output_filename)):
+        nc_file = download_erddap_nc(erddap_url,
+            dataset_id,
+            output_filename=output_filename,
+            nc_type=nc_type,
+            buffer_size=buffer_size,
+            fsync=fsync,
+            resume=True,
+            dataset=dataset)
+        if nc_file:
+            return [nc_file]
+            
+        # The request failed outright or the partial download can be resumed
+        manifest = read_download_manifest(output_filename)
+        if not manifest or manifest.get('accept_ranges'):
+            return None
+            
+        remove_download_files(output_filename)
+        sys.stdout.write('Server does not honour Range requests, downloading {:0.0f} day windows: {:s}\n'.format(window_days, dataset_id))
+        
+    return download_erddap_nc_windows(erddap_url,
+        dataset_id,
+        output_filename,
+        nc_type=nc_type,
+        window_days=window_days,
+        buffer_size=buffer_size,
+        fsync=fsync,
+        dataset=dataset)
+    
 def id_generator(size=16, chars=string.ascii_uppercase + string.digits):
     return ''.join(random.choice(chars) for _ in range(size))
     
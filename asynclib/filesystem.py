@@ -1,5 +1,12 @@
 import os
 import sys
+import errno
+import shutil
+import tempfile
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 OOI_ARRAYS = {'CP' : 'Coastal_Pioneer',
     'CE' : 'Coastal_Endurance',
@@ -8,6 +15,21 @@ OOI_ARRAYS = {'CP' : 'Coastal_Pioneer',
     'GA' : 'Global_Argentine_Basin',
     'RS' : 'Cabled_Array',
     'GP' : 'Global_Station_Papa'}
+
+# NetCDF ingestion methods tried, in order, for each ingest_file strategy
+INGEST_STRATEGIES = {'auto' : ['hardlink', 'reflink', 'copy'],
+    'reflink' : ['reflink', 'copy'],
+    'copy' : ['copy']}
+# Methods that share the source data blocks rather than writing a new copy
+ZERO_COPY_METHODS = ['hardlink', 'reflink']
+# Linux FICLONE ioctl request number used to create copy-on-write reflinks
+_FICLONE = 0x40049409
+# errnos indicating an ingestion method is not supported between 2 filesystems
+_UNSUPPORTED_ERRNOS = [errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOSYS, errno.ENOTTY,
+    getattr(errno, 'EOPNOTSUPP', errno.EINVAL),
+    getattr(errno, 'ENOTSUP', errno.EINVAL)]
+# (method, source device, destination device) combinations known not to work
+_unsupported_methods = set()
     
 def build_nc_dest(instrument, telemetry, stream, deployment_number):
         
@@ -29,3 +51,136 @@ def build_nc_dest(instrument, telemetry, stream, deployment_number):
         stream,
         telemetry,
         'deployment{:04.0f}'.format(deployment_number))
+        
+def write_atomic(filename, data, mode='w'):
+    '''Write data to a temporary file in the same directory as filename and
+    rename it to filename, so that readers never see a partially written file.
+    Returns True if the file was written.'''
+    
+    (dest_dir, fname) = os.path.split(os.path.abspath(filename))
+    
+    try:
+        (fd, tmp_filename) = tempfile.mkstemp(prefix='.{:s}.'.format(fname), dir=dest_dir)
+    except OSError as e:
+        sys.stderr.write('{:s}\n'.format(e))
+        return False
+        
+    try:
+        with os.fdopen(fd, mode) as fid:
+            fid.write(data)
+        os.chmod(tmp_filename, 0o644)
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError) as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(filename, e))
+        if os.path.isfile(tmp_filename):
+            os.unlink(tmp_filename)
+        return False
+        
+    return True
+
+def has_contents(filename, data):
+    '''Return True if filename exists and contains exactly data'''
+    
+    try:
+        if os.path.getsize(filename) != len(data):
+            return False
+        with open(filename, 'r') as fid:
+            return fid.read() == data
+    except (IOError, OSError):
+        return False
+        
+def lock_file(lock_filename, blocking=False):
+    '''Open lock_filename and take an exclusive lock on it, waiting for other
+    processes to release it if blocking is True.  The process id is written to
+    the file.  Returns the open file, which holds the lock until it is closed,
+    or None if another process holds the lock and blocking is False.'''
+
+    try:
+        fid = open(lock_filename, 'a+')
+    except IOError as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(lock_filename, e))
+        return None
+
+    if fcntl:
+        try:
+            fcntl.flock(fid.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            fid.seek(0)
+            pid = fid.read().strip()
+            fid.close()
+            if e.errno not in [errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK]:
+                sys.stderr.write('{:s}: {:s}\n'.format(lock_filename, e))
+            else:
+                sys.stderr.write('Locked by process {:s}: {:s}\n'.format(pid or 'unknown', lock_filename))
+            return None
+
+    fid.seek(0)
+    fid.truncate()
+    fid.write('{:d}\n'.format(os.getpid()))
+    fid.flush()
+
+    return fid
+
+def ingest_file(source, dest_dir, strategy='auto'):
+    '''Place a copy of the source file in dest_dir using the cheapest method
+    available for the strategy: a hardlink if source and dest_dir are on the same
+    filesystem, a copy-on-write reflink if the filesystem supports it and finally
+    a regular copy.  Methods that
+    fail between 2 filesystems are remembered and skipped for subsequent files.
+    The file is written under a temporary name and renamed, replacing any existing
+    destination file.  Returns a (method, size) tuple or None if the file could not
+    be ingested.'''
+
+    if strategy not in INGEST_STRATEGIES:
+        sys.stderr.write('Invalid ingest strategy: {:s}\n'.format(strategy))
+        return None
+
+    dest_file = os.path.join(dest_dir, os.path.basename(source))
+    try:
+        source_stat = os.stat(source)
+        dest_dev = os.stat(dest_dir).st_dev
+    except OSError as e:
+        sys.stderr.write('{:s}\n'.format(e))
+        return None
+
+    for method in INGEST_STRATEGIES[strategy]:
+
+        if (method, source_stat.st_dev, dest_dev) in _unsupported_methods:
+            continue
+        if method == 'hardlink' and source_stat.st_dev != dest_dev:
+            continue
+        if method == 'reflink' and not fcntl:
+            continue
+
+        try:
+            (fd, tmp_file) = tempfile.mkstemp(prefix='.{:s}.'.format(os.path.basename(source)), dir=dest_dir)
+        except OSError as e:
+            sys.stderr.write('{:s}\n'.format(e))
+            return None
+
+        try:
+            if method == 'hardlink':
+                os.close(fd)
+                os.unlink(tmp_file)
+                os.link(source, tmp_file)
+            else:
+                with os.fdopen(fd, 'wb') as dest_fid:
+                    with open(source, 'rb') as source_fid:
+                        if method == 'reflink':
+                            fcntl.ioctl(dest_fid.fileno(), _FICLONE, source_fid.fileno())
+                        else:
+                            shutil.copyfileobj(source_fid, dest_fid, 1048576)
+                shutil.copymode(source, tmp_file)
+            os.rename(tmp_file, dest_file)
+        except (IOError, OSError) as e:
+            if os.path.lexists(tmp_file):
+                os.unlink(tmp_file)
+            if method != 'copy' and e.errno in _UNSUPPORTED_ERRNOS:
+                _unsupported_methods.add((method, source_stat.st_dev, dest_dev))
+                continue
+            sys.stderr.write('{:s}: {:s}\n'.format(source, e))
+            return None
+
+        return (method, source_stat.st_size)
+
+    return None
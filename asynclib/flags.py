@@ -0,0 +1,60 @@
+import os
+import sys
+
+# Flag directories that have already been reported as missing
+_warned = set()
+
+def erddap_flag_home():
+    '''Return the directory containing the bigParentDirectory of each ERDDAP
+    instance: OOI_ERDDAP_FLAG_HOME if set, otherwise OOI_ERDDAP_DATA_HOME, which
+    contains the erddap-<version>-<n> instance directories.  Returns None if
+    neither is set.'''
+
+    return os.getenv('OOI_ERDDAP_FLAG_HOME') or os.getenv('OOI_ERDDAP_DATA_HOME')
+
+def erddap_flag_dir(erddap_instance):
+    '''Return ERDDAP's flag directory for erddap_instance (e.g. erddap-12-2):
+    <erddap_flag_home()>/<erddap_instance>/flag.  Returns None, and warns once
+    per instance, if the flag home is not set or the directory does not exist.'''
+
+    flag_home = erddap_flag_home()
+    if not flag_home:
+        if None not in _warned:
+            _warned.add(None)
+            sys.stderr.write('OOI_ERDDAP_FLAG_HOME and OOI_ERDDAP_DATA_HOME not set: datasets will not be flagged for reload\n')
+        return None
+
+    flag_dir = os.path.join(flag_home, erddap_instance, 'flag')
+    if not os.path.isdir(flag_dir):
+        if flag_dir not in _warned:
+            _warned.add(flag_dir)
+            sys.stderr.write('Invalid ERDDAP flag directory: {:s}: datasets will not be flagged for reload\n'.format(flag_dir))
+        return None
+
+    return flag_dir
+
+def flag_datasets(erddap_instance, dataset_ids):
+    '''Touch the flag file of each dataset in dataset_ids so that the
+    erddap_instance ERDDAP server reloads them as soon as possible, rather than
+    waiting for their reloadEveryNMinutes.  ERDDAP reloads flagged datasets
+    from its datasets.xml, so datasets whose xml has changed must only be
+    flagged once datasets.xml has been rewritten.  Returns the number of
+    datasets flagged.'''
+
+    flag_dir = erddap_flag_dir(erddap_instance)
+    if not flag_dir:
+        return 0
+
+    flagged = 0
+    for dataset_id in dataset_ids:
+        flag_file = os.path.join(flag_dir, dataset_id)
+        try:
+            with open(flag_file, 'a'):
+                os.utime(flag_file, None)
+        except (IOError, OSError) as e:
+            sys.stderr.write('{:s}: {:s}\n'.format(flag_file, e))
+            continue
+        sys.stdout.write('Flagged dataset for reload: {:s}\n'.format(dataset_id))
+        flagged += 1
+
+    return flagged
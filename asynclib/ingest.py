@@ -0,0 +1,581 @@
+import os
+import sys
+import json
+import glob
+import re
+import time
+import threading
+from dateutil import parser
+from asynclib.config import default_config_file, load_subsites, load_instrument_metadata
+from asynclib.templating import get_valid_dataset_template
+from asynclib.erddap import create_dataset_xml_filename, create_erddap_dataset_id, create_dataset_xml, dataset_xml_input_files
+from asynclib.filesystem import build_nc_dest, ingest_file, lock_file, has_contents, write_atomic, ZERO_COPY_METHODS
+from asynclib.manifest import open_build_manifest, hash_inputs
+from asynclib.flags import flag_datasets
+from asynclib.concurrency import KeyedLocks
+
+# Processing status of a UFrame async response file
+RESPONSE_COMPLETE = 'complete'
+RESPONSE_PENDING = 'pending'
+RESPONSE_FAILED = 'failed'
+
+# Values returned by write_dataset_xml if the dataset xml file is up to date
+DATASET_XML_WRITTEN = 'written'
+DATASET_XML_CURRENT = 'current'
+
+# Lock file, created in the stream-queue, held while response files are being
+# ingested and deleted
+STREAM_QUEUE_LOCK_FILENAME = '.stream-queue.lock'
+
+# Regex for pulling out the start and end times from a NetCDF filename
+_NC_TS_REGEX = re.compile('(\d{8}T\d{6}\.\d{1,})\-(\d{8}T\d{6}\.\d{1,})\.nc')
+
+def load_ingest_config(manifest=True):
+    '''Validate the environment and load the ERDDAP dataset template location,
+    subsite cable types and instrument metadata needed to process UFrame async
+    response files.  If manifest is True, the build manifest used to rebuild
+    only the dataset xml files whose inputs have changed is also opened.
+    Returns a dict containing the configuration or None if the environment or
+    configuration files are invalid.'''
+
+    # Check the environment
+    required_environment_dirs = ['OOI_ERDDAP_UFRAME_NC_ROOT',
+        'OOI_ERDDAP_DATA_HOME',
+        'OOI_ERDDAP_ASYNC_HOME']
+    env_ok = True
+    for d in required_environment_dirs:
+        if not os.getenv(d):
+            sys.stderr.write('Unset environment variable: {:s}\n'.format(d))
+            env_ok = False
+        elif not os.path.isdir(os.getenv(d)):
+            sys.stderr.write('{:s}: Directory does not exist\n'.format(os.getenv(d)))
+            env_ok = False
+
+    if not env_ok:
+        return None
+
+    # Use OOI_ERDDAP_ASYNC_HOME to create the erddap backend dataset templates location
+    template_dir = os.path.join(os.getenv('OOI_ERDDAP_ASYNC_HOME'),
+        'backend',
+        'templating',
+        'xml',
+        'production')
+    if not os.path.isdir(template_dir):
+        sys.stderr.write('Invalid ERDDAP XML template directory: {:s}\n'.format(template_dir))
+        return None
+
+    # Load the subsite cable types and instrument metadata lookup tables
+    subsite_csv = default_config_file('subsites.csv')
+    subsites = load_subsites(subsite_csv)
+    if not subsites:
+        return None
+
+    instruments = load_instrument_metadata()
+    if not instruments:
+        return None
+
+    return {'template_dir' : template_dir,
+        'subsite_csv' : subsite_csv,
+        'subsites' : subsites,
+        'instruments' : instruments,
+        'manifest' : open_build_manifest() if manifest else None}
+
+def new_result(response_file):
+    '''Return the RESPONSE_FAILED result dict returned by process_response_file
+    before response_file has been processed'''
+
+    return {'response_file' : response_file,
+        'dataset_id' : None,
+        'status' : RESPONSE_FAILED,
+        'dest_nc_dir' : None,
+        'files_copied' : 0,
+        'bytes_copied' : 0,
+        'bytes_avoided' : 0,
+        'ingest_methods' : {},
+        'flagged' : False}
+
+def default_stream_queue():
+    '''Return the location of the backend stream-queue or None if
+    OOI_ERDDAP_ASYNC_HOME is not set'''
+
+    async_home = os.getenv('OOI_ERDDAP_ASYNC_HOME')
+    if not async_home:
+        return None
+
+    return os.path.join(async_home, 'backend', 'stream-queue')
+
+def lock_stream_queue(stream_queue=None):
+    '''Take the exclusive lock on stream_queue (Default is default_stream_queue())
+    that prevents the stream-queue daemon and batch runs from ingesting and
+    deleting the same response files.  Returns the open lock file, which holds
+    the lock until it is closed, or None if another process holds the lock.'''
+
+    if not stream_queue:
+        stream_queue = default_stream_queue()
+    if not stream_queue:
+        sys.stderr.write('No stream-queue specified and OOI_ERDDAP_ASYNC_HOME not set\n')
+        return None
+    if not os.path.isdir(stream_queue):
+        sys.stderr.write('Invalid stream-queue directory: {:s}\n'.format(stream_queue))
+        return None
+
+    return lock_file(os.path.join(stream_queue, STREAM_QUEUE_LOCK_FILENAME))
+
+def process_response_file(response_file, config, debug=False, force=False, delete_on_success=False, locks=None, strategy='auto'):
+    '''Create or update the backend ERDDAP dataset for a single UFrame async
+    response_file using the configuration returned by load_ingest_config.  Returns
+    a dict containing the response_file, the ERDDAP dataset_id, if known, and the
+    processing status: RESPONSE_COMPLETE if the dataset was created or updated,
+    RESPONSE_PENDING if UFrame has not finished creating the NetCDF files or
+    RESPONSE_FAILED, along with the number of NetCDF files ingested, the bytes
+    copied and the bytes avoided by hardlinking or reflinking files using the
+    filesystem.ingest_file strategy.
+    Pass a KeyedLocks instance as locks when calling from multiple threads to
+    prevent two workers from writing to the same ERDDAP destination directory.'''
+
+    result = new_result(response_file)
+
+    if debug:
+        sys.stdout.write('==> DEBUG MODE: No file operations performed! <==\n')
+
+    sys.stdout.write('Processing response file: {:s}\n'.format(response_file))
+
+    try:
+        with open(response_file, 'r') as fid:
+            response = json.load(fid)
+    except (IOError, ValueError) as e:
+        sys.stderr.write('{:s}\n'.format(e))
+        return result
+
+    # Make sure the response dict exists
+    if 'response' not in response.keys():
+        sys.stderr.write('Invalid UFrame response object: {:s}\n'.format(response_file))
+        return result
+    # response code must == 200 to be ok
+    if response['response']['status_code'] != 200:
+        sys.stderr.write('Invalid UFrame request (Reason: {:s}\n'.format(response['reason']))
+        return result
+
+    # See if a template exists for this request
+    dataset_template = get_valid_dataset_template(response['stream']['stream'],
+        response['stream']['method'],
+        template_dir=config['template_dir'])
+    if not dataset_template:
+        return result
+
+    # Make sure the response has the proper number of allURLs items
+    if len(response['response']['response']['allURLs']) < 2:
+        sys.stderr.write('allURLs contains < 2 urls\n'.format(response_file))
+        return result
+
+    # Get the user product directory from response['response']['response']['allURLs'][1]
+    d_tokens = response['response']['response']['allURLs'][1].split('/')
+    if len(d_tokens) != 6:
+        sys.stderr.write('Badly formatted UFrame async destination url: {:s}\n'.format(response['response']['response']['allURLs'][1]))
+        return result
+    async_nc_dir = os.path.join(os.getenv('OOI_ERDDAP_UFRAME_NC_ROOT'), d_tokens[4], d_tokens[5])
+    if not os.path.isdir(async_nc_dir):
+        sys.stdout.write('UFrame async destination does not exist: {:s}\n'.format(async_nc_dir))
+        result['status'] = RESPONSE_PENDING
+        return result
+
+    # Check for the existence and contents of the status.txt file in async_nc_dir
+    # If it's there and it contains the work 'complete', the request is ready for processing
+    status_file = os.path.join(async_nc_dir, 'status.txt')
+    if not os.path.isfile(status_file):
+        sys.stdout.write('Production creation incomplete: {:s}\n'.format(async_nc_dir))
+        result['status'] = RESPONSE_PENDING
+        return result
+    try:
+        with open(status_file, 'r') as fid:
+            status = fid.readline().strip()
+    except IOError as e:
+        sys.stderr.write('{:s}\n'.format(e))
+        return result
+
+    if status != 'complete':
+        sys.stdout.write('Production creation incomplete: {:s}\n'.format(status_file))
+        result['status'] = RESPONSE_PENDING
+        return result
+
+    # Create the NetCDF filename glob string to search for created files
+    nc_filename_template = 'deployment{:04.0f}_{:s}-{:s}-{:s}*.nc'.format(
+        response['deployment']['deployment_number'],
+        response['deployment']['instrument']['reference_designator'],
+        response['stream']['method'],
+        response['stream']['stream'])
+    source_nc_files = glob.glob(os.path.join(async_nc_dir, nc_filename_template))
+    # Skip the rest if no NetCDF files were found in the UFrame product directory
+    if not source_nc_files:
+        sys.stderr.write('No source NetCDF files found: {:s}\n'.format(async_nc_dir))
+        return result
+
+    # Create the ERDDAP dataset xml filename
+    xml_filename = create_dataset_xml_filename(response['deployment']['instrument']['reference_designator'],
+        response['stream']['method'],
+        response['stream']['stream'],
+        response['deployment']['deployment_number'])
+
+    # Make sure the instrument subsite name exists in subsites
+    if response['response']['instrument']['subsite'] not in config['subsites']:
+        sys.stderr.write('Unknown subsite: {:s}\n'.format(response['response']['instrument']['subsite']))
+        return result
+
+    # Pull the subsite element out to create the ERDDAP stream-xml directory
+    subsite = config['subsites'][response['response']['instrument']['subsite']]
+    erddap_instance = None
+    if 'cabled_type' not in subsite:
+        sys.stderr.write('{:s}: Missing subsite cabled_type key ({:s})\n'.format(subsite['subsite'], config['subsite_csv']))
+        return result
+    elif subsite['cabled_type'] == 'cabled':
+        erddap_instance = 'erddap-12-1'
+    elif subsite['cabled_type'] == 'uncabled':
+        erddap_instance = 'erddap-12-2'
+    if not erddap_instance:
+        sys.stderr.write('{:s}: Unknown subsite cable type\n'.format(subsite['subsite']))
+        return result
+    # Create the stream-xml location and validate it's existence
+    datasets_xml_dir = os.path.join(os.getenv('OOI_ERDDAP_DATA_HOME'), erddap_instance, 'stream-xml')
+    if not os.path.isdir(datasets_xml_dir):
+        sys.stderr.write('Invalid ERDDAP stream-xml directory: {:s}\n'.format(datasets_xml_dir))
+        return result
+
+    # Create the ERDDAP product directory
+    nc_dest_product_dir = build_nc_dest(response['deployment']['instrument']['reference_designator'],
+        response['stream']['method'],
+        response['stream']['stream'],
+        response['deployment']['deployment_number'])
+    dest_nc_dir = os.path.join(os.getenv('OOI_ERDDAP_DATA_HOME'),
+        erddap_instance,
+        'nc',
+        nc_dest_product_dir)
+    result['dest_nc_dir'] = dest_nc_dir
+
+    # Only one worker at a time may create or update the dataset in dest_nc_dir
+    if locks is None:
+        locks = KeyedLocks()
+    with locks.locked(dest_nc_dir):
+
+        # Create the ERDDAP product directory if it does not exist
+        if not os.path.isdir(dest_nc_dir):
+            sys.stdout.write('ERDDAP destination does not exist: {:s}\n'.format(dest_nc_dir))
+            if not debug:
+                sys.stdout.write('Creating ERDDAP destination directory: {:s}\n'.format(dest_nc_dir))
+                try:
+                    os.makedirs(dest_nc_dir)
+                except OSError as e:
+                    sys.stderr.write('{:s}\n'.format(e))
+                    return result
+
+        # Create the ERDDAP dataset id
+        dataset_id = create_erddap_dataset_id(response['deployment']['instrument']['reference_designator'],
+            response['stream']['stream'],
+            response['stream']['method'],
+            response['deployment']['deployment_number'])
+        result['dataset_id'] = dataset_id
+
+        # Fully-qualified path to the dataset XML file, provided it exists
+        dataset_xml_file = os.path.join(datasets_xml_dir, xml_filename)
+        # If not debugging and -f option, remove the dataset_xml_file if it exists
+        if not debug and force and os.path.isfile(dataset_xml_file):
+            sys.stdout.write('Clobbering existing dataset XML file: {:s}\n'.format(dataset_xml_file))
+            os.unlink(dataset_xml_file)
+
+        # Does the dataset_xml_file exist? If it does exist, we need to UPDATE the
+        # dataset.  If it doesn't exist, we need to create it to add it to the ERDDAP
+        # instance
+        if os.path.isfile(dataset_xml_file):
+            sys.stdout.write('UPDATING existing dataset\n')
+            sys.stdout.write('ERDDAP dataset ID: {:s}\n'.format(dataset_id))
+            sys.stdout.write('ERDDAP XML file  : {:s}\n'.format(dataset_xml_file))
+            sys.stdout.write('UFrame directory : {:s}\n'.format(async_nc_dir))
+            sys.stdout.write('ERDDAP directory : {:s}\n'.format(dest_nc_dir))
+
+            if debug:
+                for nc in source_nc_files:
+                    sys.stdout.write('\tUFrame NetCDF file: {:s}\n'.format(nc))
+                return result
+
+            # Rebuild the dataset xml if the template, instrument metadata or
+            # destination it was created from have changed
+            if config.get('manifest'):
+                write_dataset_xml(response, config, dataset_template, dataset_id, dest_nc_dir, dataset_xml_file)
+
+            # Get this list of NetCDF files that are already in dest_nc_dir
+            last_nc_dt = None
+            destination_nc_files = glob.glob(os.path.join(dest_nc_dir, nc_filename_template))
+            if destination_nc_files:
+                # Take the last file, extract the end time and convert it to a datetime
+                last_nc = destination_nc_files[-1]
+                (ncp, ncf) = os.path.split(last_nc)
+                # See if we can pull out the NetCDF start and end times
+                match = _NC_TS_REGEX.search(ncf)
+                if match:
+                    try:
+                        last_nc_dt = parser.parse('{:s}Z'.format(match.groups()[-1]))
+                    except ValueError as e:
+                        sys.stderr.write('{:s}\n'.format(e))
+                        last_nc_dt = None
+                        return result
+
+            copy_count = 0
+            nc_status = True
+            for source_nc in source_nc_files:
+
+                (ncp, ncf) = os.path.split(source_nc)
+
+                # Skip the copy if the file already exists
+                dest_nc = os.path.join(dest_nc_dir, ncf)
+                # Clobber existing NetCDF files if the user specified -f (force).  Otherwise
+                # only copy files that don't already exist at the destination
+                if not force and os.path.isfile(dest_nc):
+                    sys.stderr.write('Skipping (Destination NetCDF exists): {:s}\n'.format(dest_nc))
+                    continue
+
+                # If we were able to pull out a last_nc_dt to compare file start times,
+                # see if we can pull out the file start time to compare with it.  Only
+                # source_nc NetCDF files with start times > last_nc_dt will be copied
+                # See if we can pull out the NetCDF start and end times
+                match = _NC_TS_REGEX.search(ncf)
+                nc_start_dt = None
+                if match:
+                    try:
+                        nc_start_dt = parser.parse('{:s}Z'.format(match.groups()[0]))
+                    except ValueError as e:
+                        sys.stderr.write('{:s}\n'.format(e))
+                        nc_status = False
+
+                if nc_start_dt < last_nc_dt:
+                    sys.stdout.write('Skipping earlier source file: {:s}\n'.format(source_nc))
+                    continue
+
+                sys.stdout.write('Copying file: {:s}\n'.format(source_nc))
+                ingested = ingest_file(source_nc, dest_nc_dir, strategy=strategy)
+                if not ingested:
+                    nc_status = False
+                    continue
+                copy_count = copy_count + 1
+                _count_ingested(result, ingested)
+
+            # Print the number of NetCDF files copied
+            sys.stdout.write('Updated dataset with {:0.0f} NetCDF files\n'.format(copy_count))
+
+            # Reload only the datasets whose files changed rather than relying on
+            # ERDDAP polling every dataset directory.  Changes to the dataset xml
+            # are flagged once the datasets.xml file has been rewritten.
+            if copy_count > 0:
+                result['flagged'] = flag_datasets(erddap_instance, [dataset_id]) > 0
+
+        else:
+            sys.stdout.write('CREATING new dataset\n')
+            sys.stdout.write('ERDDAP dataset ID: {:s}\n'.format(dataset_id))
+            sys.stdout.write('ERDDAP XML file  : {:s}\n'.format(dataset_xml_file))
+            sys.stdout.write('UFrame directory : {:s}\n'.format(async_nc_dir))
+            sys.stdout.write('ERDDAP directory : {:s}\n'.format(dest_nc_dir))
+
+            if debug:
+                for nc in source_nc_files:
+                    sys.stdout.write('\tUFrame NetCDF file: {:s}\n'.format(nc))
+                return result
+
+            if not write_dataset_xml(response, config, dataset_template, dataset_id, dest_nc_dir, dataset_xml_file):
+                return result
+
+            # If the xml file was successfully written, move any NetCDF files that
+            # don't already exist in dest_nc_dir
+            copy_count = 0
+            nc_status = True
+            for source_nc in source_nc_files:
+
+                (ncp, ncf) = os.path.split(source_nc)
+                dest_nc = os.path.join(dest_nc_dir, ncf)
+                # Clobber existing NetCDF files if the user specified -f (force).  Otherwise
+                # only copy files that don't already exist at the destination
+                if not force and os.path.isfile(dest_nc):
+                    sys.stderr.write('Skipping (Destination NetCDF exists): {:s}\n'.format(dest_nc))
+                    continue
+
+                sys.stdout.write('Copying file: {:s}\n'.format(source_nc))
+                ingested = ingest_file(source_nc, dest_nc_dir, strategy=strategy)
+                if not ingested:
+                    nc_status = False
+                    continue
+                copy_count = copy_count + 1
+                _count_ingested(result, ingested)
+
+            # Print the number of NetCDF files copied
+            sys.stdout.write('Created dataset with {:0.0f} NetCDF files\n'.format(copy_count))
+
+        if not nc_status:
+            sys.stderr.write('1 or more NetCDF copy issues. Keeping response file: {:s}\n'.format(response_file))
+            return result
+
+    result['status'] = RESPONSE_COMPLETE
+
+    # Delete the response file ONLY if the user said to and everything looks good with the NetCDF copies
+    if delete_on_success:
+        sys.stdout.write('SUCCESS: Deleting response file: {:s}\n'.format(response_file))
+        try:
+            os.unlink(response_file)
+        except OSError as e:
+            sys.stderr.write('{:s}: {:s}\n'.format(response_file, e))
+
+    return result
+
+def write_dataset_xml(response, config, dataset_template, dataset_id, dest_nc_dir, dataset_xml_file):
+    '''Create the dataset xml for the UFrame async response from dataset_template
+    and write it to dataset_xml_file.  If config contains a build manifest, the
+    file is only written if the template, instrument metadata, title, summary or
+    dest_nc_dir have changed since it was last written, and the inputs are
+    recorded in the manifest, which the caller must save.  An existing file
+    that already contains the same xml is recorded but not rewritten.  Returns
+    DATASET_XML_WRITTEN if the file was written, DATASET_XML_CURRENT if it was
+    already up to date or False on error.'''
+
+    # Make sure the reference designator referers to an instrument in instrument_descriptions
+    if response['deployment']['instrument']['reference_designator'] not in config['instruments']:
+        sys.stderr.write('{:s}: No instrument metadata entry found\n'.format(response['deployment']['instrument']['reference_designator']))
+        return False
+
+    instrument_meta = config['instruments'][response['deployment']['instrument']['reference_designator']]
+
+    # Create the dataset title
+    dataset_title = '{:s} {:s} {:s} {:s} {:s} - Deployment {:04.0f} ({:s})'.format(instrument_meta['site'],
+        instrument_meta['subsite'],
+        instrument_meta['node'],
+        instrument_meta['name'],
+        response['stream']['stream'],
+        response['deployment']['deployment_number'],
+        response['stream']['method'])
+
+    # Create the dataset summary text
+    summary = instrument_meta['description']
+    if not summary:
+        summary = ''
+
+    # Skip the file if it was built from the same inputs
+    manifest = config.get('manifest')
+    digest = None
+    if manifest:
+        digest = hash_inputs(files=dataset_xml_input_files(dataset_template, dataset_id),
+            values={'dataset_id' : dataset_id,
+                'instrument' : instrument_meta,
+                'title' : dataset_title,
+                'summary' : summary,
+                'file_dir' : dest_nc_dir})
+        if manifest.is_current(dataset_xml_file, digest):
+            sys.stdout.write('Dataset xml is up to date: {:s}\n'.format(dataset_xml_file))
+            return DATASET_XML_CURRENT
+
+    # Write the dataset xml file
+    sys.stdout.write('Creating dataset xml: {:s}\n'.format(dataset_id))
+    dataset_xml = create_dataset_xml(dest_nc_dir,
+        dataset_template,
+        dataset_id,
+        dataset_title,
+        summary)
+
+    if not dataset_xml:
+        sys.stderr.write('Failed to write dataset xml for dataset ID: {:s}\n'.format(dataset_id))
+        return False
+
+    # Files written before the manifest existed are recorded without being
+    # rewritten if they are unchanged
+    dataset_xml = '{:s}\n'.format(dataset_xml)
+    if manifest and has_contents(dataset_xml_file, dataset_xml):
+        sys.stdout.write('Dataset xml is unchanged: {:s}\n'.format(dataset_xml_file))
+        manifest.record(dataset_xml_file, digest)
+        return DATASET_XML_CURRENT
+
+    # Write the xml to the dataset_xml_file
+    if not write_atomic(dataset_xml_file, dataset_xml):
+        return False
+
+    if manifest:
+        manifest.record(dataset_xml_file, digest)
+
+    return DATASET_XML_WRITTEN
+
+def _count_ingested(result, ingested):
+
+    (method, size) = ingested
+    result['files_copied'] += 1
+    result['ingest_methods'][method] = result['ingest_methods'].get(method, 0) + 1
+    if method in ZERO_COPY_METHODS:
+        result['bytes_avoided'] += size
+    else:
+        result['bytes_copied'] += size
+
+class IngestStats(object):
+    '''Thread-safe throughput and latency counters for processed UFrame async
+    response files.  Latency is measured from the time a response file was
+    first queued to the time its dataset was created or updated.'''
+
+    def __init__(self):
+
+        self.started = time.time()
+        self.counts = {RESPONSE_COMPLETE : 0,
+            RESPONSE_PENDING : 0,
+            RESPONSE_FAILED : 0}
+        # Running totals rather than per-file lists, so that a long-running
+        # daemon does not grow without bound
+        self.num_latencies = 0
+        self.total_latency = 0.
+        self.max_latency = 0.
+        self.num_processed = 0
+        self.total_processing_time = 0.
+        self.max_processing_time = 0.
+        self.bytes_copied = 0
+        self.bytes_avoided = 0
+        self._lock = threading.Lock()
+
+    def record(self, result, processing_time, queued_time=None):
+        '''Record the result returned by process_response_file, the number of
+        seconds it took to process and the time the response file was queued'''
+
+        with self._lock:
+            self.counts[result['status']] += 1
+            self.num_processed += 1
+            self.total_processing_time += processing_time
+            self.max_processing_time = max(self.max_processing_time, processing_time)
+            self.bytes_copied += result['bytes_copied']
+            self.bytes_avoided += result['bytes_avoided']
+            if result['status'] == RESPONSE_COMPLETE and queued_time:
+                latency = time.time() - queued_time
+                self.num_latencies += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def stats(self):
+        '''Return a dict containing the response file counts, throughput in
+        completed responses per hour and the mean/max latency and processing times'''
+
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1.)
+            s = dict(self.counts)
+            s['uptime'] = elapsed
+            s['bytes_copied'] = self.bytes_copied
+            s['bytes_avoided'] = self.bytes_avoided
+            s['throughput'] = self.counts[RESPONSE_COMPLETE] * 3600. / elapsed
+            s['mean_latency'] = self.total_latency / self.num_latencies if self.num_latencies else 0.
+            s['max_latency'] = self.max_latency
+            s['mean_processing_time'] = self.total_processing_time / self.num_processed if self.num_processed else 0.
+            s['max_processing_time'] = self.max_processing_time
+
+        return s
+
+    def format_stats(self):
+        '''Return the ingest statistics as a single line of text'''
+
+        s = self.stats()
+
+        return 'Responses complete: {:d}, pending: {:d}, failed: {:d}, throughput: {:0.1f}/hour, latency mean/max: {:0.1f}/{:0.1f}s, processing mean/max: {:0.2f}/{:0.2f}s, bytes copied/avoided: {:d}/{:d}'.format(s[RESPONSE_COMPLETE],
+            s[RESPONSE_PENDING],
+            s[RESPONSE_FAILED],
+            s['throughput'],
+            s['mean_latency'],
+            s['max_latency'],
+            s['mean_processing_time'],
+            s['max_processing_time'],
+            s['bytes_copied'],
+            s['bytes_avoided'])
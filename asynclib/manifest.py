@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from asynclib.filesystem import write_atomic, lock_file
+from asynclib.cache import default_cache_dir
+
+# SHA-1 of input files, keyed by (filename, mtime, size), so that a template
+# shared by many datasets is only read once per process
+_file_hashes = {}
+_file_hash_lock = threading.Lock()
+
+def default_manifest_file():
+    '''Return the default location of the build manifest, which is created in
+    the cache directory.  Returns None if OOI_ERDDAP_ASYNC_HOME is not set.'''
+
+    cache_dir = default_cache_dir()
+    if not cache_dir:
+        return None
+
+    return os.path.join(cache_dir, 'build-manifest.json')
+
+def file_sha1(filename):
+    '''Return the SHA-1 hex digest of the contents of filename or None if it
+    cannot be read.  The digest is cached until the file's modification time or
+    size changes.'''
+
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    key = (os.path.abspath(filename), st.st_mtime, st.st_size)
+
+    with _file_hash_lock:
+        if key in _file_hashes:
+            return _file_hashes[key]
+
+    sha1 = hashlib.sha1()
+    try:
+        with open(filename, 'rb') as fid:
+            for block in iter(lambda: fid.read(1048576), b''):
+                sha1.update(block)
+    except IOError as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(filename, e))
+        return None
+
+    with _file_hash_lock:
+        _file_hashes[key] = sha1.hexdigest()
+
+    return _file_hashes[key]
+
+def hash_inputs(files=None, values=None):
+    '''Return a single SHA-1 hex digest of the contents of the input files and
+    the JSON serializable values (e.g. metadata dicts, titles and directories)
+    an output file is built from.  Returns None if any of the files cannot be
+    read.'''
+
+    inputs = {'files' : {},
+        'values' : values}
+    for f in files or []:
+        digest = file_sha1(f)
+        if not digest:
+            return None
+        inputs['files'][os.path.abspath(f)] = digest
+
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+class BuildManifest(object):
+    '''Records the digest of the inputs each output file was last built from, so
+    that outputs are only rebuilt when their inputs change.  Entries are keyed
+    by the absolute output filename.  Changes are merged into the manifest file
+    by save() while holding an exclusive lock on manifest_file.lock, so several
+    processes may share it.  All methods are thread-safe.'''
+
+    def __init__(self, manifest_file):
+
+        self.manifest_file = manifest_file
+        self.entries = self._load()
+        self.counters = {'current' : 0,
+            'built' : 0}
+        self._changed = {}
+        self._lock = threading.Lock()
+
+    def is_current(self, output_file, digest):
+        '''Return True if output_file exists and was last built from inputs with
+        the same digest'''
+
+        output_file = os.path.abspath(output_file)
+        with self._lock:
+            entry = self.entries.get(output_file)
+            current = bool(digest) and entry is not None and entry['digest'] == digest and os.path.isfile(output_file)
+            if current:
+                self.counters['current'] += 1
+
+        return current
+
+    def record(self, output_file, digest):
+        '''Record that output_file was built from inputs with digest'''
+
+        if not digest:
+            return
+
+        output_file = os.path.abspath(output_file)
+        entry = {'digest' : digest,
+            'built' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+        with self._lock:
+            self.entries[output_file] = entry
+            self._changed[output_file] = entry
+            self.counters['built'] += 1
+
+    def save(self):
+        '''Merge the entries recorded since the last save into the manifest file.
+        Returns True if the manifest was written.'''
+
+        with self._lock:
+            if not self._changed:
+                return True
+
+            # Other processes must not replace the file between the load and
+            # the write
+            manifest_lock = lock_file('{:s}.lock'.format(self.manifest_file), blocking=True)
+            if not manifest_lock:
+                return False
+            try:
+                entries = self._load()
+                entries.update(self._changed)
+                if not write_atomic(self.manifest_file, json.dumps(entries, sort_keys=True)):
+                    return False
+            finally:
+                manifest_lock.close()
+
+            self.entries = entries
+            self._changed = {}
+
+        return True
+
+    def stats(self):
+        '''Return a dict containing the number of outputs found to be current and
+        the number built'''
+
+        with self._lock:
+            s = dict(self.counters)
+            s['entries'] = len(self.entries)
+
+        return s
+
+    def format_stats(self):
+        '''Return the manifest counters as a single line of text'''
+
+        s = self.stats()
+
+        return 'Build manifest: {:d} entries, {:d} current, {:d} built'.format(s['entries'],
+            s['current'],
+            s['built'])
+
+    def _load(self):
+
+        if not os.path.isfile(self.manifest_file):
+            return {}
+
+        try:
+            with open(self.manifest_file, 'r') as fid:
+                return json.load(fid)
+        except (IOError, ValueError) as e:
+            sys.stderr.write('Ignoring invalid build manifest: {:s} ({:s})\n'.format(self.manifest_file, e))
+            return {}
+
+def open_build_manifest(manifest_file=None):
+    '''Open the build manifest, creating the manifest directory if necessary.
+    Returns None if the manifest cannot be opened.'''
+
+    if not manifest_file:
+        manifest_file = default_manifest_file()
+    if not manifest_file:
+        sys.stderr.write('No build manifest file specified and OOI_ERDDAP_ASYNC_HOME not set\n')
+        return None
+
+    manifest_dir = os.path.dirname(manifest_file)
+    if manifest_dir and not os.path.isdir(manifest_dir):
+        try:
+            os.makedirs(manifest_dir)
+        except OSError as e:
+            sys.stderr.write('{:s}\n'.format(e))
+            return None
+
+    return BuildManifest(manifest_file)
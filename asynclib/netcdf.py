@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import math
+import tempfile
+from datetime import datetime, timedelta
+import numpy as np
+from netCDF4 import Dataset
+
+# Default zlib compression level of the NetCDF-4 variables
+DEFAULT_DEFLATE_LEVEL = 1
+# Default number of records along the time dimension in each NetCDF-4 chunk.
+# tabledap requests read contiguous time ranges of a few variables, so chunks
+# span many records of a single variable.
+DEFAULT_TIME_CHUNK_SIZE = 8192
+# Number of chunks copied from the source file per read
+_CHUNKS_PER_COPY = 32
+
+def convert_nc3_to_nc4(nc3_file, nc4_file, deflate_level=DEFAULT_DEFLATE_LEVEL, shuffle=True, time_chunk_size=DEFAULT_TIME_CHUNK_SIZE):
+    '''Copy the dimensions, attributes and variables in nc3_file to the compressed
+    NetCDF-4 file nc4_file.  Variables are compressed with zlib at deflate_level,
+    using the shuffle filter if shuffle is True, and chunked every time_chunk_size
+    records along the dimension of the time variable.  Variables are copied in
+    blocks of records so that the entire file is never read into memory.  The
+    file is written to a temporary file and renamed to nc4_file when complete.
+    Returns a dict containing the output filename, the input and output sizes in
+    bytes, the compression ratio and the elapsed time or None if the conversion
+    failed.'''
+
+    (dest_dir, fname) = os.path.split(os.path.abspath(nc4_file))
+
+    t0 = time.time()
+    try:
+        (fd, tmp_file) = tempfile.mkstemp(prefix='.{:s}.'.format(fname), dir=dest_dir)
+        os.close(fd)
+    except OSError as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(nc4_file, e))
+        return None
+
+    try:
+        with Dataset(nc3_file, 'r') as src:
+            with Dataset(tmp_file, 'w', clobber=True, format='NETCDF4') as dst:
+                _copy_dataset(src, dst, deflate_level, shuffle, time_chunk_size)
+        os.chmod(tmp_file, 0o644)
+        os.rename(tmp_file, nc4_file)
+    except (IOError, OSError, RuntimeError) as e:
+        sys.stderr.write('NetCDF-4 conversion failed: {:s} ({:s})\n'.format(nc3_file, e))
+        if os.path.isfile(tmp_file):
+            os.unlink(tmp_file)
+        return None
+
+    elapsed = time.time() - t0
+    input_bytes = os.path.getsize(nc3_file)
+    output_bytes = os.path.getsize(nc4_file)
+    ratio = float(input_bytes) / max(output_bytes, 1)
+    sys.stdout.write('Converted {:s}: {:0.1f} MB -> {:0.1f} MB (ratio {:0.1f}) in {:0.1f}s\n'.format(nc4_file,
+        input_bytes / 1048576.,
+        output_bytes / 1048576.,
+        ratio,
+        elapsed))
+
+    return {'filename' : nc4_file,
+        'input_bytes' : input_bytes,
+        'output_bytes' : output_bytes,
+        'ratio' : ratio,
+        'elapsed' : elapsed}
+
+def nc_last_time(nc_files):
+    '''Return the latest value of the time variable in nc_files, as written by
+    ERDDAP in seconds since 1970-01-01T00:00:00Z, as an ISO-8601 timestamp with
+    microsecond resolution, rounded up so that it is never earlier than the
+    stored value.  Returns None if the time cannot be read from any file.'''
+
+    last_time = None
+    for nc_file in nc_files:
+        try:
+            with Dataset(nc_file, 'r') as nci:
+                if 'time' not in nci.variables:
+                    sys.stderr.write('No time variable: {:s}\n'.format(nc_file))
+                    return None
+                time_var = nci.variables['time']
+                units = getattr(time_var, 'units', '')
+                if not units.startswith('seconds since 1970-01-01'):
+                    sys.stderr.write('Unsupported time units ({:s}): {:s}\n'.format(units, nc_file))
+                    return None
+                values = np.ma.compressed(time_var[:])
+        except (IOError, OSError, RuntimeError) as e:
+            sys.stderr.write('{:s}: {:s}\n'.format(nc_file, e))
+            return None
+        if not values.size:
+            continue
+        file_last_time = float(values.max())
+        if last_time is None or file_last_time > last_time:
+            last_time = file_last_time
+
+    if last_time is None:
+        return None
+
+    microseconds = int(math.ceil(last_time * 1e6))
+    dt = datetime(1970, 1, 1) + timedelta(microseconds=microseconds)
+
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def _copy_dataset(src, dst, deflate_level, shuffle, time_chunk_size):
+
+    # Copy the raw values so that packed, masked and character data are written
+    # exactly as stored
+    src.set_auto_maskandscale(False)
+
+    dst.setncatts(dict([(a, src.getncattr(a)) for a in src.ncattrs()]))
+
+    for (name, dim) in src.dimensions.items():
+        dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+    # Chunk along the dimension of the time variable, if there is one
+    time_dim = None
+    if 'time' in src.variables and src.variables['time'].dimensions:
+        time_dim = src.variables['time'].dimensions[0]
+
+    for (name, var) in src.variables.items():
+
+        attrs = dict([(a, var.getncattr(a)) for a in var.ncattrs()])
+        fill_value = attrs.pop('_FillValue', None)
+
+        if not var.dimensions:
+            nc4_var = dst.createVariable(name, var.dtype, fill_value=fill_value)
+            nc4_var.setncatts(attrs)
+            nc4_var.set_auto_maskandscale(False)
+            nc4_var.assignValue(var.getValue())
+            continue
+
+        chunksizes = [max(len(src.dimensions[d]), 1) for d in var.dimensions]
+        for (i, d) in enumerate(var.dimensions):
+            if d == time_dim:
+                chunksizes[i] = min(chunksizes[i], time_chunk_size)
+
+        nc4_var = dst.createVariable(name,
+            var.dtype,
+            var.dimensions,
+            zlib=deflate_level > 0,
+            complevel=deflate_level,
+            shuffle=shuffle,
+            chunksizes=chunksizes,
+            fill_value=fill_value)
+        nc4_var.setncatts(attrs)
+        nc4_var.set_auto_maskandscale(False)
+
+        # Copy the variable in blocks of whole chunks along the first dimension
+        num_records = var.shape[0]
+        block_size = chunksizes[0] * _CHUNKS_PER_COPY
+        for r0 in range(0, num_records, block_size):
+            r1 = min(r0 + block_size, num_records)
+            nc4_var[r0:r1] = var[r0:r1]
@@ -0,0 +1,181 @@
+import sys
+import threading
+import requests
+from contextlib import contextmanager
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+# Default connection pool, timeout and retry settings used by the shared session.
+# Modify with configure() before the first request is sent.
+_DEFAULT_CONFIG = {'pool_connections' : 4,
+    'pool_maxsize' : 8,
+    'keep_alive' : True,
+    'connect_timeout' : 10,
+    'read_timeout' : 300,
+    'max_retries' : 3,
+    'backoff_factor' : 0.5,
+    'max_per_host' : 0}
+
+# Response status codes that are retried, with backoff, before giving up
+_RETRY_STATUS_CODES = [500, 502, 503, 504]
+
+_config = dict(_DEFAULT_CONFIG)
+_session = None
+_lock = threading.Lock()
+_counters = {'requests' : 0,
+    'pool_hits' : 0,
+    'pools_created' : 0,
+    'host_waits' : 0}
+# Semaphores limiting the number of concurrent transfers per host
+_host_slots = {}
+
+class _CountingAdapter(HTTPAdapter):
+    '''HTTPAdapter that keeps track of the number of requests served by an
+    existing per-host connection pool'''
+
+    def __init__(self, *args, **kwargs):
+
+        self.host_pools = []
+
+        super(_CountingAdapter, self).__init__(*args, **kwargs)
+
+    def get_connection(self, url, proxies=None):
+
+        pool = super(_CountingAdapter, self).get_connection(url, proxies=proxies)
+
+        with _lock:
+            if pool in self.host_pools:
+                _counters['pool_hits'] += 1
+            else:
+                _counters['pools_created'] += 1
+                self.host_pools.append(pool)
+
+        return pool
+
+def configure(**kwargs):
+    '''Set one or more of the shared session pool, timeout and retry parameters:
+    pool_connections, pool_maxsize, keep_alive, connect_timeout, read_timeout,
+    max_retries, backoff_factor and max_per_host (the maximum number of
+    concurrent transfers per host, 0 for no limit).  Any existing session is
+    closed and a new one is created on the next request.'''
+
+    global _session
+
+    for k in kwargs.keys():
+        if k not in _DEFAULT_CONFIG:
+            sys.stderr.write('Invalid session parameter: {:s}\n'.format(k))
+            return False
+
+    with _lock:
+        _config.update(kwargs)
+        _host_slots.clear()
+        if _session:
+            _session.close()
+            _session = None
+
+    return True
+
+def get_session():
+    '''Return the module-level requests.Session, creating it if necessary'''
+
+    global _session
+
+    with _lock:
+        if _session:
+            return _session
+
+        retries = Retry(total=_config['max_retries'],
+            backoff_factor=_config['backoff_factor'],
+            status_forcelist=_RETRY_STATUS_CODES,
+            raise_on_status=False)
+
+        adapter = _CountingAdapter(pool_connections=_config['pool_connections'],
+            pool_maxsize=_config['pool_maxsize'],
+            max_retries=retries)
+
+        _session = requests.Session()
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+        if not _config['keep_alive']:
+            _session.headers['Connection'] = 'close'
+
+    return _session
+
+def get(url, **kwargs):
+    '''Send a GET request for url using the shared session.  Keyword arguments
+    are passed to requests.Session.get.  The configured (connect, read) timeout
+    is used if no timeout is specified.'''
+
+    s = get_session()
+
+    if 'timeout' not in kwargs:
+        kwargs['timeout'] = (_config['connect_timeout'], _config['read_timeout'])
+
+    with _lock:
+        _counters['requests'] += 1
+
+    return s.get(url, **kwargs)
+
+@contextmanager
+def host_slot(url):
+    '''Context manager that blocks until fewer than max_per_host transfers to the
+    host in url are in progress and holds one of the host's slots.  Use it around
+    a request and the streaming of its response body.'''
+
+    if not _config['max_per_host']:
+        yield
+        return
+
+    host = urlparse(url).netloc
+    with _lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(_config['max_per_host'])
+        slot = _host_slots[host]
+
+    if not slot.acquire(False):
+        with _lock:
+            _counters['host_waits'] += 1
+        slot.acquire()
+
+    try:
+        yield
+    finally:
+        slot.release()
+
+def stats():
+    '''Return a dict containing the shared session request, pool and connection
+    counters'''
+
+    session_stats = dict(_counters)
+
+    connections_opened = 0
+    pool_requests = 0
+    if _session:
+        for adapter in set(_session.adapters.values()):
+            if not isinstance(adapter, _CountingAdapter):
+                continue
+            for pool in adapter.host_pools:
+                connections_opened += pool.num_connections
+                pool_requests += pool.num_requests
+
+    session_stats['connections_opened'] = connections_opened
+    session_stats['connections_reused'] = max(pool_requests - connections_opened, 0)
+
+    return session_stats
+
+def format_stats():
+    '''Return the shared session counters as a single line of text'''
+
+    s = stats()
+
+    return 'HTTP requests: {:d}, pool hits: {:d}, pools created: {:d}, connections opened: {:d}, connections reused: {:d}, host limit waits: {:d}'.format(
+        s['requests'],
+        s['pool_hits'],
+        s['pools_created'],
+        s['connections_opened'],
+        s['connections_reused'],
+        s['host_waits'])
@@ -0,0 +1,52 @@
+from asynclib.concurrency import host_rate_limiter, map_concurrent
+
+def fetch_instrument_streams(uframe, reference_designators, workers=1, rate=None, cache=None):
+    '''Resolve the streams produced by each instrument in reference_designators
+    using uframe.instrument_to_streams.  Duplicate reference designators are
+    requested once.  Up to workers requests are sent concurrently and, if rate is
+    specified, no more than rate requests per second are sent to the UFrame host.
+    If cache is a StreamCache, fresh cached listings are used instead of querying
+    UFrame and new listings are added to the cache.  Returns a dict mapping each
+    reference designator to the streams returned by uframe.instrument_to_streams.'''
+
+    instrument_streams = {}
+
+    unique_designators = []
+    seen = set()
+    for reference_designator in reference_designators:
+        if reference_designator in seen:
+            continue
+        seen.add(reference_designator)
+
+        if cache:
+            streams = cache.get(uframe.base_url, reference_designator)
+            if streams:
+                instrument_streams[reference_designator] = streams
+                continue
+
+        unique_designators.append(reference_designator)
+
+    limiter = None
+    if rate:
+        limiter = host_rate_limiter(uframe.base_url, rate, burst=workers)
+
+    def _fetch(reference_designator):
+
+        if limiter:
+            limiter.acquire()
+
+        return uframe.instrument_to_streams(reference_designator)
+
+    streams = map_concurrent(_fetch, unique_designators, workers=workers)
+
+    for (reference_designator, instrument_stream_list) in zip(unique_designators, streams):
+        instrument_streams[reference_designator] = instrument_stream_list
+        # Only cache successful lookups
+        if cache and instrument_stream_list:
+            cache.put(uframe.base_url, reference_designator, instrument_stream_list)
+
+    # Write the cache updates with a single commit
+    if cache:
+        cache.flush()
+
+    return instrument_streams
@@ -1,5 +1,17 @@
 import sys
 import os
+import copy
+import threading
+from xml.etree import ElementTree
+
+# Parsed XML templates, keyed by absolute filename.  Each entry holds the file
+# (mtime, size) it was parsed from and the parsed root element, which is never
+# modified; callers are given copies.
+_xml_templates = {}
+_xml_template_counters = {'hits' : 0,
+    'misses' : 0,
+    'reloads' : 0}
+_xml_template_lock = threading.Lock()
 
 def get_valid_dataset_template(stream, telemetry, template_dir=None):
     '''Checks for the existence of an ERDDAP dataset xml template for the specified
@@ -106,4 +118,69 @@ def create_erddap_dataset_xml(template_file, dataset_id, nc_dir, title, summary)
         sys.stderr.write('Failed to write XML: {:s}\n'.format(e))
         return None
         
-    return dataset_xml
\ No newline at end of file
+    return dataset_xml
+    
+def load_xml_template(xml_file):
+    '''Return a copy of the root element of the XML template xml_file that may be
+    modified by the caller.  The file is parsed once per process and parsed again
+    only if its modification time or size changes.  Returns None if the file
+    does not exist or cannot be parsed.'''
+    
+    xml_file = os.path.abspath(xml_file)
+    try:
+        st = os.stat(xml_file)
+    except OSError as e:
+        sys.stderr.write('Invalid XML template: {:s} ({:s})\n'.format(xml_file, e))
+        return None
+    version = (st.st_mtime, st.st_size)
+    
+    with _xml_template_lock:
+        cached = _xml_templates.get(xml_file)
+        if cached and cached[0] == version:
+            _xml_template_counters['hits'] += 1
+            return copy.deepcopy(cached[1])
+            
+    try:
+        root = ElementTree.parse(xml_file).getroot()
+    except (IOError, ElementTree.ParseError) as e:
+        sys.stderr.write('Failed to parse XML template: {:s} ({:s})\n'.format(xml_file, e))
+        return None
+        
+    with _xml_template_lock:
+        if cached:
+            _xml_template_counters['reloads'] += 1
+        else:
+            _xml_template_counters['misses'] += 1
+        _xml_templates[xml_file] = (version, root)
+        
+    return copy.deepcopy(root)
+    
+def clear_xml_templates():
+    '''Discard all parsed XML templates'''
+    
+    with _xml_template_lock:
+        _xml_templates.clear()
+        
+def xml_template_stats():
+    '''Return a dict containing the number of parsed XML templates and the number
+    of load_xml_template cache hits, misses and reloads of modified templates'''
+    
+    with _xml_template_lock:
+        s = dict(_xml_template_counters)
+        s['templates'] = len(_xml_templates)
+        
+    lookups = s['hits'] + s['misses'] + s['reloads']
+    s['hit_rate'] = float(s['hits']) / lookups if lookups else 0.
+    
+    return s
+    
+def format_xml_template_stats():
+    '''Return the XML template cache counters as a single line of text'''
+    
+    s = xml_template_stats()
+    
+    return 'XML templates: {:d}, hits: {:d}, misses: {:d}, reloads: {:d} (hit rate {:0.1f}%)'.format(s['templates'],
+        s['hits'],
+        s['misses'],
+        s['reloads'],
+        s['hit_rate'] * 100)
@@ -0,0 +1,57 @@
+import sys
+import numpy as np
+
+# Integer value of NaT once cast to int64
+_NAT = np.iinfo(np.int64).min
+
+def iso8601_to_datetime64(timestamps):
+    '''Parse the sequence of ISO-8601 timestamp strings, as returned by ERDDAP and
+    UFrame, into a datetime64[us] array in a single pass.  A trailing Z is
+    ignored and all timestamps are assumed to be UTC.  Empty or invalid
+    timestamps are returned as NaT.'''
+
+    values = [t.rstrip('Z') if t else 'NaT' for t in timestamps]
+
+    try:
+        return np.array(values, dtype='datetime64[ns]').astype('datetime64[us]')
+    except ValueError:
+        pass
+
+    # At least one timestamp is invalid, so parse them one at a time
+    parsed = np.empty(len(values), dtype='datetime64[us]')
+    for (i, v) in enumerate(values):
+        try:
+            parsed[i] = np.datetime64(v, 'ns')
+        except ValueError:
+            sys.stderr.write('Date parse error: {:s}\n'.format(v))
+            parsed[i] = np.datetime64('NaT')
+
+    return parsed
+
+def datetime64_to_epoch(values):
+    '''Return the datetime64 array values as a float array of seconds since
+    1970-01-01T00:00:00Z.  NaT values are returned as NaN.'''
+
+    microseconds = np.asarray(values).astype('datetime64[us]').astype(np.int64)
+
+    epochs = microseconds / 1e6
+    epochs[microseconds == _NAT] = np.nan
+
+    return epochs
+
+def iso8601_to_epoch(timestamps):
+    '''Return the sequence of ISO-8601 timestamp strings as a float array of
+    seconds since 1970-01-01T00:00:00Z.  Empty or invalid timestamps are
+    returned as NaN.'''
+
+    return datetime64_to_epoch(iso8601_to_datetime64(timestamps))
+
+def parse_iso8601(timestamp):
+    '''Parse a single ISO-8601 timestamp string into a naive UTC datetime.
+    Returns None if the timestamp is empty or invalid.'''
+
+    parsed = iso8601_to_datetime64([timestamp])[0]
+    if parsed.astype(np.int64) == _NAT:
+        return None
+
+    return parsed.astype(object)
@@ -1,5 +1,7 @@
 export OOI_ERDDAP_ASYNC_HOME=/var/local/erddap/erddap-storage/bin/erddap-async;
 export OOI_ERDDAP_DATA_HOME=/var/local/erddap/erddap-storage;
+# Contains the bigParentDirectory (flag directory) of each ERDDAP instance
+export OOI_ERDDAP_FLAG_HOME=/var/local/erddap/erddap-storage;
 export OOI_ERDDAP_UFRAME_NC_ROOT=/opendap_export/async_results;
 export OOI_ERDDAP_BACKEND_BASE_URL=http://192.168.163.231;
 export OOI_ERDDAP_FRONTEND_BASE_URL=http://192.168.161.231;
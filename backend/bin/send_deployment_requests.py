@@ -4,8 +4,20 @@ import os
 import sys
 import json
 import argparse
+from functools import partial
 from UFrame import UFrame
 from asynclib.templating import get_valid_dataset_template
+from asynclib.concurrency import RateLimiter, map_concurrent, retry_with_jitter
+from asynclib.filesystem import write_atomic
+
+# HTTP status codes returned before a request reaches UFrame
+_RETRY_STATUS_CODES = [502, 503]
+# requests exception messages for connections that failed before the request
+# was sent
+_NOT_SENT_REASONS = ['Failed to establish a new connection',
+    'Connection refused',
+    'Name or service not known',
+    'connect timeout']
 
 def main(args):
     '''Create and send the request urls for all deployment objects contained in 
@@ -42,6 +54,14 @@ def main(args):
         sys.stderr.write('Invalid ERDDAP XML template directory: {:s}\n'.format(template_dir))
         return 1
    
+    # UFrame instances, keyed by UFrame base url
+    uframe_instances = {}
+    
+    # Send no more than args.rate requests per second, if specified
+    limiter = None
+    if args.rate:
+        limiter = RateLimiter(args.rate, burst=args.workers)
+    
     # Send the requests from each .json file specified on the command line
     for deployment_file in args.deployment_json_files:
         
@@ -126,6 +146,7 @@ def main(args):
         
         # Otherwise, send the requests, add the response to the request object and
         # write the object to a file so that we can use it to move files later
+        pending_requests = []
         for data_request in data_requests:
     
             deployment_request = '{:s}-{:s}-{:s}-deployment{:04.0f}'.format(
@@ -142,31 +163,82 @@ def main(args):
         
             if not data_request['request_url']:
                 sys.stderr.write('{:s}: No request_url specified\n'.format(deployment_request))
+                continue
     
-            if uframe.base_url != data_request['request_params']['uframe_url']:
-                #sys.stderr.write('Creating new UFrame instance: {:s}\n'.format(deployment['request_params']['uframe_url']))
-                uframe = UFrame(base_url=deployment['request_params']['uframe_url'])
+            # Create one UFrame instance for each UFrame base url
+            uframe_url = data_request['request_params']['uframe_url']
+            if uframe_url not in uframe_instances:
+                uframe_instances[uframe_url] = UFrame(base_url=uframe_url)
+                
+            pending_requests.append({'name' : deployment_request,
+                'response_file' : response_file,
+                'data_request' : data_request,
+                'uframe' : uframe_instances[uframe_url]})
             
-            # send the data request
-            sys.stdout.write('Sending deployment request: {:s}...\n'.format(deployment_request))
+        # Send up to args.workers requests at a time
+        send_request = partial(send_deployment_request,
+            limiter=limiter,
+            retries=args.retries)
+        map_concurrent(send_request, pending_requests, workers=args.workers)
+    
+    return status
+    
+def send_deployment_request(pending_request, limiter=None, retries=0):
+    '''Send the UFrame asynchronous request for a pending deployment request,
+    retrying transient failures, and atomically write the request and response to
+    the pending request response_file.  Returns True if the response file was
+    written.'''
+    
+    data_request = pending_request['data_request']
+    
+    def _send():
+        
+        if limiter:
+            limiter.acquire()
             
-            get_response = uframe.send_async_requests(data_request['request_url'])
-            if not get_response:
-                sys.stderr.write('{:s}: Error sending request\n'.format(data_request['request_url']))
-            elif len(get_response) > 1:
-                sys.stderr.write('{:s}: Multiple unknown requests sent\n'.format(data_request['request_url']))
-    
-            data_request['response'] = get_response[0]
-            response = get_response[0]
-            if not response['status']:
-                sys.stderr.write('{:s}: {:s}\n'.format(response['reason'], data_request['request_url']))
-                continue
+        # send the data request
+        sys.stdout.write('Sending deployment request: {:s}...\n'.format(pending_request['name']))
+        
+        return pending_request['uframe'].send_async_requests(data_request['request_url'])
+        
+    get_response = retry_with_jitter(_send, is_transient_failure, retries=retries)
+    if not get_response:
+        sys.stderr.write('{:s}: Error sending request\n'.format(data_request['request_url']))
+        return False
+    elif len(get_response) > 1:
+        sys.stderr.write('{:s}: Multiple unknown requests sent\n'.format(data_request['request_url']))
+
+    data_request['response'] = get_response[0]
+    response = get_response[0]
+    if not response['status']:
+        sys.stderr.write('{:s}: {:s}\n'.format(response['reason'], data_request['request_url']))
+        return False
+
+    sys.stdout.write('Writing response: {:s}\n'.format(pending_request['response_file']))
     
-            sys.stdout.write('Writing response: {:s}\n'.format(response_file))
-            with open(response_file, 'w') as fid:
-                json.dump(data_request, fid)
+    return write_atomic(pending_request['response_file'], json.dumps(data_request))
     
-    return status
+def is_transient_failure(get_response):
+    '''Returns True if the UFrame request could not be delivered: the connection
+    to UFrame could not be established or a 502/503 was returned.  UFrame async
+    requests create jobs on the server and are not idempotent, so requests that
+    may have been received, including empty responses and read timeouts, are
+    never retried.'''
+    
+    if not get_response:
+        return False
+        
+    response = get_response[0]
+    if response['status']:
+        return False
+        
+    status_code = response.get('status_code')
+    if status_code:
+        return status_code in _RETRY_STATUS_CODES
+        
+    reason = '{}'.format(response.get('reason', ''))
+    
+    return any([r in reason for r in _NOT_SENT_REASONS])
     
 if __name__ == '__main__':
 
@@ -188,6 +260,17 @@ if __name__ == '__main__':
         type=int,
         default=120,
         help='Specify the timeout, in seconds (Default is 120 seconds).')
+    arg_parser.add_argument('-w', '--workers',
+        type=int,
+        default=1,
+        help='Number of requests to send concurrently (Default is 1).')
+    arg_parser.add_argument('-r', '--rate',
+        type=float,
+        help='Maximum number of requests sent per second.  No limit if not specified.')
+    arg_parser.add_argument('--retries',
+        type=int,
+        default=0,
+        help='Number of times to retry a request that could not be delivered to UFrame (connection failure or 502/503).  Requests that may have reached UFrame are never retried (Default is 0).')
     arg_parser.add_argument('--template_dir',
         type=str,
         help='Specify the ERDDAP dataset templates directory.  Derived from OOI_ERDDAP_ASYNC_HOME if not specified')
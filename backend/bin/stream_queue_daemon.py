@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import traceback
+from asynclib.ingest import load_ingest_config, process_response_file, lock_stream_queue, default_stream_queue, new_result, IngestStats, RESPONSE_COMPLETE, RESPONSE_FAILED
+from asynclib.filesystem import write_atomic, INGEST_STRATEGIES
+from asynclib.templating import format_xml_template_stats, xml_template_stats
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# Set by the signal handlers and checked once per pass through the queue
+_flags = {'stop' : False,
+    'reload' : False,
+    'stats' : False}
+
+def main(args):
+    '''Watch the backend stream-queue for UFrame async response files and create or
+    update the backend ERDDAP dataset for each response as soon as UFrame has
+    finished creating the NetCDF files.  Response files are deleted once their
+    dataset has been successfully created or updated.  The queue is watched with
+    inotify if pyinotify is installed and polled every --interval seconds otherwise.
+    Pending responses are re-checked every --interval seconds.  Send SIGHUP to reload
+    the configuration files and SIGUSR1 to print the throughput/latency statistics.'''
+
+    stream_queue = args.stream_queue or default_stream_queue()
+
+    # Only one daemon or batch run may ingest and delete the response files in
+    # the stream-queue.  The lock is held until the daemon exits.
+    queue_lock = lock_stream_queue(stream_queue)
+    if not queue_lock:
+        return 1
+
+    # Load the configuration once and keep it for the lifetime of the daemon
+    config = load_ingest_config(manifest=not args.no_manifest)
+    if not config:
+        return 1
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+    signal.signal(signal.SIGHUP, _handle_signal)
+    signal.signal(signal.SIGUSR1, _handle_signal)
+
+    notifier = None
+    if pyinotify and not args.poll:
+        notifier = watch_stream_queue(stream_queue)
+    if notifier:
+        sys.stdout.write('Watching stream-queue with inotify: {:s}\n'.format(stream_queue))
+    else:
+        sys.stdout.write('Polling stream-queue every {:0.0f} seconds: {:s}\n'.format(args.interval, stream_queue))
+
+    stats = IngestStats()
+    # Time each response file was first seen
+    queued = {}
+    # Modification time and last attempt time of each failed response file
+    failed = {}
+    last_stats = time.time()
+
+    while not _flags['stop']:
+
+        if _flags['reload']:
+            _flags['reload'] = False
+            sys.stdout.write('Reloading configuration\n')
+            new_config = load_ingest_config(manifest=not args.no_manifest)
+            if new_config:
+                config = new_config
+                # Retry everything that failed with the previous configuration
+                failed = {}
+
+        now = time.time()
+        response_files = find_response_files(stream_queue)
+        for response_file in response_files:
+
+            if _flags['stop']:
+                break
+
+            try:
+                mtime = os.path.getmtime(response_file)
+            except OSError:
+                continue
+
+            queued.setdefault(response_file, mtime)
+
+            # Don't retry failed responses until the file is modified or the retry
+            # interval has passed
+            if response_file in failed:
+                (failed_mtime, attempted) = failed[response_file]
+                if failed_mtime == mtime and now - attempted < args.retry_interval:
+                    continue
+
+            t0 = time.time()
+            try:
+                result = process_response_file(response_file,
+                    config,
+                    debug=args.debug,
+                    delete_on_success=not args.debug,
+                    strategy=args.strategy)
+            except Exception:
+                # A malformed response file must not stop the daemon
+                sys.stderr.write('Unexpected error processing response file: {:s}\n'.format(response_file))
+                traceback.print_exc()
+                result = new_result(response_file)
+            stats.record(result, time.time() - t0, queued_time=queued[response_file])
+
+            if result['status'] == RESPONSE_FAILED:
+                failed[response_file] = (mtime, time.time())
+            elif result['status'] == RESPONSE_COMPLETE:
+                failed.pop(response_file, None)
+
+        # Write the dataset xml inputs recorded during this pass
+        if config['manifest'] and not args.debug:
+            config['manifest'].save()
+
+        # Forget response files that are no longer in the queue
+        current = set(response_files)
+        for response_file in list(queued.keys()):
+            if response_file not in current:
+                del queued[response_file]
+                failed.pop(response_file, None)
+
+        if args.once:
+            break
+
+        if _flags['stats'] or time.time() - last_stats >= args.stats_interval:
+            _flags['stats'] = False
+            last_stats = time.time()
+            report_stats(stats, len(queued), args.stats_file)
+
+        wait_for_responses(notifier, args.interval)
+
+    if notifier:
+        notifier.stop()
+
+    report_stats(stats, len(queued), args.stats_file)
+
+    queue_lock.close()
+
+    return 0
+
+def find_response_files(stream_queue):
+    '''Return the sorted list of all UFrame async response files in the stream_queue
+    directory tree'''
+
+    response_files = []
+    for (root, dirs, files) in os.walk(stream_queue):
+        response_files.extend([os.path.join(root, f) for f in files if f.endswith('response.json')])
+
+    return sorted(response_files)
+
+def watch_stream_queue(stream_queue):
+    '''Return a pyinotify.Notifier watching the stream_queue directory tree for
+    new or modified files, or None if the watch cannot be created'''
+
+    wm = pyinotify.WatchManager()
+    mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO
+    try:
+        notifier = pyinotify.Notifier(wm)
+        wm.add_watch(stream_queue, mask, rec=True, auto_add=True, quiet=False)
+    except (OSError, pyinotify.WatchManagerError) as e:
+        sys.stderr.write('Failed to watch {:s} with inotify ({:s})\n'.format(stream_queue, e))
+        return None
+
+    return notifier
+
+def wait_for_responses(notifier, interval):
+    '''Wait up to interval seconds for new response files to be written to the
+    stream-queue.  Returns early if the daemon is signalled.'''
+
+    expires = time.time() + interval
+    while not _signalled() and time.time() < expires:
+        timeout = min(1., expires - time.time())
+        if not notifier:
+            time.sleep(max(timeout, 0))
+            continue
+        # pyinotify retries the poll when it is interrupted by a signal, so
+        # wait in short steps and check the flags in between
+        try:
+            if notifier.check_events(timeout=max(int(timeout * 1000), 0)):
+                notifier.read_events()
+                # Discard the events; the stream-queue is rescanned on every pass
+                notifier.process_events()
+                return
+        except (OSError, IOError):
+            return
+
+def _signalled():
+    '''Return True if a signal handler has set a flag the main loop acts on'''
+
+    return _flags['stop'] or _flags['stats'] or _flags['reload']
+
+def report_stats(stats, num_queued, stats_file=None):
+    '''Print the ingest statistics and, optionally, write them to stats_file as
+    JSON'''
+
+    sys.stdout.write('{:s}: {:s}, queued: {:d}, {:s}\n'.format(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        stats.format_stats(),
+        num_queued,
+        format_xml_template_stats()))
+    sys.stdout.flush()
+
+    if not stats_file:
+        return
+
+    s = stats.stats()
+    s['queued'] = num_queued
+    s['xml_templates'] = xml_template_stats()
+    s['updated'] = time.time()
+    write_atomic(stats_file, json.dumps(s))
+
+def _handle_signal(signum, frame):
+
+    if signum == signal.SIGHUP:
+        _flags['reload'] = True
+    elif signum == signal.SIGUSR1:
+        _flags['stats'] = True
+    else:
+        _flags['stop'] = True
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('stream_queue',
+        nargs='?',
+        help='Alternate stream-queue directory.  Defaults to OOI_ERDDAP_ASYNC_HOME/backend/stream-queue')
+    arg_parser.add_argument('-i', '--interval',
+        type=float,
+        default=60,
+        help='Number of seconds between checks of pending response files (Default is 60)')
+    arg_parser.add_argument('--retry_interval',
+        type=float,
+        default=3600,
+        help='Number of seconds to wait before retrying an unmodified failed response file (Default is 3600)')
+    arg_parser.add_argument('--stats_interval',
+        type=float,
+        default=900,
+        help='Number of seconds between statistics reports (Default is 900)')
+    arg_parser.add_argument('-s', '--stats_file',
+        help='Also write the statistics, as JSON, to the specified file')
+    arg_parser.add_argument('--ingest',
+        dest='strategy',
+        choices=sorted(INGEST_STRATEGIES.keys()),
+        default='auto',
+        help='NetCDF ingestion strategy (Default is auto).  See async_request_to_erddap.py --help')
+    arg_parser.add_argument('--poll',
+        action='store_true',
+        help='Poll the stream-queue even if pyinotify is available')
+    arg_parser.add_argument('-1', '--once',
+        action='store_true',
+        help='Process the stream-queue once and exit')
+    arg_parser.add_argument('--no_manifest',
+        action='store_true',
+        help='Do not use the build manifest to rebuild the dataset xml of existing datasets whose template, instrument metadata or destination have changed')
+    arg_parser.add_argument('-x',
+        dest='debug',
+        action='store_true',
+        help='Print the status of each request, but do not create or update any ERDDAP datasets')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
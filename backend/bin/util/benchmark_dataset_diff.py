@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import random
+import argparse
+import datetime
+from asynclib.erddap import get_new_erddap_datasets, get_updated_erddap_datasets
+
+def main(args):
+    '''Benchmark the hash join get_new_erddap_datasets and get_updated_erddap_datasets
+    dataset comparisons against the previous list scan implementation using synthetic
+    ERDDAP allDatasets listings.  The list scan implementation is O(N*M), so it is
+    only run for sizes <= --legacy_max.'''
+
+    random.seed(args.seed)
+
+    sys.stdout.write('{:>8s} {:>12s} {:>12s} {:>16s} {:>16s}\n'.format('datasets',
+        'new (s)',
+        'updated (s)',
+        'new list (s)',
+        'updated list (s)'))
+
+    for size in args.sizes:
+
+        (datasets1, datasets2) = synthetic_datasets(size, args.fraction)
+
+        t0 = time.time()
+        new_datasets = get_new_erddap_datasets(datasets1, datasets2)
+        new_elapsed = time.time() - t0
+
+        t0 = time.time()
+        updated_datasets = get_updated_erddap_datasets(datasets1, datasets2)
+        updated_elapsed = time.time() - t0
+
+        legacy_new = '-'
+        legacy_updated = '-'
+        if size <= args.legacy_max:
+            t0 = time.time()
+            legacy_new_datasets = list_scan_new_datasets(datasets1, datasets2)
+            legacy_new = '{:0.3f}'.format(time.time() - t0)
+
+            t0 = time.time()
+            legacy_updated_datasets = list_scan_updated_datasets(datasets1, datasets2)
+            legacy_updated = '{:0.3f}'.format(time.time() - t0)
+
+            if len(legacy_new_datasets) != len(new_datasets) or len(legacy_updated_datasets) != len(updated_datasets):
+                sys.stderr.write('{:d}: Results differ from the list scan implementation\n'.format(size))
+                return 1
+
+        sys.stdout.write('{:8d} {:12.3f} {:12.3f} {:>16s} {:>16s}\n'.format(size,
+            new_elapsed,
+            updated_elapsed,
+            legacy_new,
+            legacy_updated))
+
+    return 0
+
+def synthetic_datasets(size, fraction):
+    '''Return 2 synthetic allDatasets listings containing size datasets.  fraction
+    of the datasets in the first listing are missing from the second and another
+    fraction have a later maxTime.'''
+
+    t0 = datetime.datetime(2014, 1, 1)
+    datasets1 = []
+    datasets2 = []
+    for i in range(size):
+        min_dt = t0 + datetime.timedelta(hours=i)
+        max_dt = min_dt + datetime.timedelta(days=30)
+        dataset = {'datasetID' : 'XX{:06d}-SBD17-06-CTDBPC000-telemetered-ctdbp_cdef_dcl_instrument-d{:04d}'.format(i, i % 20),
+            'minTime' : min_dt.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'maxTime' : max_dt.strftime('%Y-%m-%dT%H:%M:%SZ')}
+        datasets1.append(dataset)
+
+        r = random.random()
+        if r < fraction:
+            continue
+        dataset = dataset.copy()
+        if r < 2 * fraction:
+            dataset['maxTime'] = (max_dt - datetime.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        datasets2.append(dataset)
+
+    random.shuffle(datasets2)
+
+    return (datasets1, datasets2)
+
+def list_scan_new_datasets(erddap_datasets1, erddap_datasets2):
+
+    dest_dataset_ids = [d['datasetID'] for d in erddap_datasets2]
+
+    return [d for d in erddap_datasets1 if d['datasetID'] not in dest_dataset_ids]
+
+def list_scan_updated_datasets(erddap_datasets1, erddap_datasets2):
+
+    updated_datasets = []
+
+    dest_dataset_ids = [d['datasetID'] for d in erddap_datasets2]
+    for dataset in erddap_datasets1:
+        if dataset['datasetID'] not in dest_dataset_ids:
+            continue
+        target_dataset = erddap_datasets2[dest_dataset_ids.index(dataset['datasetID'])]
+        if dataset['minTime'] != target_dataset['minTime'] or dataset['maxTime'] != target_dataset['maxTime']:
+            updated_datasets.append(dataset)
+
+    return updated_datasets
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('sizes',
+        nargs='*',
+        type=int,
+        default=[10000, 25000, 50000, 100000],
+        help='Numbers of synthetic datasets to compare (Default is 10000 25000 50000 100000)')
+    arg_parser.add_argument('-f', '--fraction',
+        type=float,
+        default=0.05,
+        help='Fraction of datasets that are new and fraction that are updated (Default is 0.05)')
+    arg_parser.add_argument('-l', '--legacy_max',
+        type=int,
+        default=25000,
+        help='Largest number of datasets to compare with the list scan implementation (Default is 25000)')
+    arg_parser.add_argument('-s', '--seed',
+        type=int,
+        default=0,
+        help='Random number generator seed')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
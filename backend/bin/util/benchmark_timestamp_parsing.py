@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import random
+import argparse
+import datetime
+from dateutil import parser
+from asynclib.timestamps import iso8601_to_epoch
+from asynclib.erddap import get_updated_erddap_datasets, add_erddap_epochs
+
+def main(args):
+    '''Benchmark parsing ERDDAP minTime/maxTime timestamps in bulk into NumPy
+    datetime64 arrays against parsing them one at a time with dateutil, and the
+    vectorized get_updated_erddap_datasets comparison against the previous
+    per-row dateutil comparison, using synthetic ERDDAP allDatasets listings.'''
+
+    random.seed(args.seed)
+
+    sys.stdout.write('{:>8s} {:>12s} {:>12s} {:>12s} {:>14s} {:>16s}\n'.format('datasets',
+        'parse (s)',
+        'bulk (s)',
+        'diff (s)',
+        'bulk diff (s)',
+        'bulk+epochs (s)'))
+
+    for size in args.sizes:
+
+        (datasets1, datasets2) = synthetic_datasets(size, args.fraction)
+        timestamps = [d['minTime'] for d in datasets1] + [d['maxTime'] for d in datasets1]
+
+        t0 = time.time()
+        for ts in timestamps:
+            parser.parse(ts)
+        parse_elapsed = time.time() - t0
+
+        t0 = time.time()
+        iso8601_to_epoch(timestamps)
+        bulk_elapsed = time.time() - t0
+
+        t0 = time.time()
+        legacy_updated_datasets = per_row_updated_datasets(datasets1, datasets2)
+        diff_elapsed = time.time() - t0
+
+        # Timestamps parsed during the comparison
+        t0 = time.time()
+        updated_datasets = get_updated_erddap_datasets(datasets1, datasets2)
+        bulk_diff_elapsed = time.time() - t0
+
+        # Timestamps pre-parsed when the listings are fetched, as fetch_erddap_datasets does
+        add_erddap_epochs(datasets1)
+        add_erddap_epochs(datasets2)
+        t0 = time.time()
+        epoch_updated_datasets = get_updated_erddap_datasets(datasets1, datasets2)
+        epoch_diff_elapsed = time.time() - t0
+
+        legacy_ids = [d['datasetID'] for d in legacy_updated_datasets]
+        if [d['datasetID'] for d in updated_datasets] != legacy_ids or [d['datasetID'] for d in epoch_updated_datasets] != legacy_ids:
+            sys.stderr.write('{:d}: Results differ from the per-row implementation\n'.format(size))
+            return 1
+
+        sys.stdout.write('{:8d} {:12.3f} {:12.3f} {:12.3f} {:14.3f} {:16.3f}\n'.format(size,
+            parse_elapsed,
+            bulk_elapsed,
+            diff_elapsed,
+            bulk_diff_elapsed,
+            epoch_diff_elapsed))
+
+    return 0
+
+def synthetic_datasets(size, fraction):
+    '''Return 2 synthetic allDatasets listings containing size datasets.  fraction
+    of the datasets in the second listing have a later minTime and another
+    fraction have a later maxTime.'''
+
+    t0 = datetime.datetime(2014, 1, 1)
+    datasets1 = []
+    datasets2 = []
+    for i in range(size):
+        min_dt = t0 + datetime.timedelta(seconds=i * 37)
+        max_dt = min_dt + datetime.timedelta(days=30)
+        dataset = {'datasetID' : 'XX{:06d}-SBD17-06-CTDBPC000-telemetered-ctdbp_cdef_dcl_instrument-d{:04d}'.format(i, i % 20),
+            'minTime' : min_dt.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'maxTime' : max_dt.strftime('%Y-%m-%dT%H:%M:%SZ')}
+        datasets1.append(dataset)
+
+        dataset = dataset.copy()
+        r = random.random()
+        if r < fraction:
+            dataset['minTime'] = (min_dt + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        elif r < 2 * fraction:
+            dataset['maxTime'] = (max_dt - datetime.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        datasets2.append(dataset)
+
+    random.shuffle(datasets2)
+
+    return (datasets1, datasets2)
+
+def per_row_updated_datasets(erddap_datasets1, erddap_datasets2, delta_seconds=0):
+
+    updated_datasets = []
+
+    dest_datasets = {d['datasetID'] : d for d in erddap_datasets2}
+    for dataset in erddap_datasets1:
+        target_dataset = dest_datasets.get(dataset['datasetID'])
+        if not target_dataset:
+            continue
+
+        delta_start = parser.parse(dataset['minTime']) - parser.parse(target_dataset['minTime'])
+        delta_end = parser.parse(dataset['maxTime']) - parser.parse(target_dataset['maxTime'])
+        if abs(delta_start.total_seconds()) > abs(delta_seconds) or abs(delta_end.total_seconds()) > abs(delta_seconds):
+            updated_datasets.append(dataset)
+
+    return updated_datasets
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('sizes',
+        nargs='*',
+        type=int,
+        default=[1000, 10000, 50000],
+        help='Numbers of synthetic datasets to compare (Default is 1000 10000 50000)')
+    arg_parser.add_argument('-f', '--fraction',
+        type=float,
+        default=0.05,
+        help='Fraction of datasets with a changed minTime and fraction with a changed maxTime (Default is 0.05)')
+    arg_parser.add_argument('-s', '--seed',
+        type=int,
+        default=0,
+        help='Random number generator seed')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+from asynclib.cache import open_stream_cache, _DEFAULT_TTL
+
+def main(args):
+    '''Display statistics for, or invalidate entries in, the local UFrame stream
+    listings cache.  Cached listings for the specified reference designators are
+    removed with --invalidate.  All listings are removed if --invalidate is
+    specified without reference designators or a --baseurl.'''
+
+    stream_cache = open_stream_cache(db_file=args.cache_file, ttl=args.cache_ttl * 3600)
+    if not stream_cache:
+        return 1
+
+    if args.invalidate:
+        count = stream_cache.invalidate(base_url=args.base_url,
+            reference_designators=args.reference_designators)
+        sys.stdout.write('Invalidated {:d} cached stream listings\n'.format(count))
+    elif args.reference_designators:
+        sys.stderr.write('Reference designators are only valid with --invalidate\n')
+        stream_cache.close()
+        return 1
+
+    if args.purge:
+        count = stream_cache.purge_expired()
+        sys.stdout.write('Purged {:d} expired stream listings\n'.format(count))
+
+    stats = stream_cache.stats()
+    sys.stdout.write('Cache file   : {:s}\n'.format(stream_cache.db_file))
+    sys.stdout.write('Entries      : {:d}\n'.format(stats['entries']))
+    sys.stdout.write('Total hits   : {:d}\n'.format(stats['total_hits']))
+    sys.stdout.write('Total misses : {:d}\n'.format(stats['total_misses']))
+
+    stream_cache.close()
+
+    return 0
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('reference_designators',
+        nargs='*',
+        help='One or more instrument reference designators to invalidate')
+    arg_parser.add_argument('-i', '--invalidate',
+        action='store_true',
+        help='Remove cached stream listings')
+    arg_parser.add_argument('-b', '--baseurl',
+        dest='base_url',
+        help='Limit --invalidate to listings from the specified UFrame base url')
+    arg_parser.add_argument('-p', '--purge',
+        action='store_true',
+        help='Remove all listings older than --cache_ttl hours')
+    arg_parser.add_argument('--cache_ttl',
+        type=float,
+        default=_DEFAULT_TTL / 3600.,
+        help='Maximum age, in hours, of cached UFrame stream listings (Default is {:g} hours).'.format(_DEFAULT_TTL / 3600.))
+    arg_parser.add_argument('-f', '--cache_file',
+        help='Alternate cache file.  Defaults to OOI_ERDDAP_ASYNC_HOME/cache/uframe-streams.db')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import argparse
+from asynclib.catalog import assemble_datasets_xml, format_assembly_stats, DEFAULT_FRAGMENT_PATTERN
+from asynclib.flags import flag_datasets
+
+def main(args):
+    '''Write the ERDDAP datasets.xml file consisting of the erddap-datasets head
+    xml, each dataset xml file in the stream-xml directory and the
+    erddap-datasets tail xml.  Only added or modified dataset xml files are read.
+    The datasets.xml file is left untouched if no dataset xml files were added,
+    modified or removed since it was last written.  If an ERDDAP instance is
+    specified with --flag, the datasets in the added, modified or removed xml
+    files are flagged for reload once the datasets.xml file has been written.'''
+
+    async_home = os.getenv('OOI_ERDDAP_ASYNC_HOME')
+    if not async_home or not os.path.isdir(async_home):
+        sys.stderr.write('$OOI_ERDDAP_ASYNC_HOME not set\n')
+        return 1
+
+    head_xml = args.head_xml
+    if not head_xml:
+        head_xml = os.path.join(async_home, 'frontend', 'templating', 'masters', 'erddap-datasets.head.xml')
+    tail_xml = args.tail_xml
+    if not tail_xml:
+        tail_xml = os.path.join(async_home, 'frontend', 'templating', 'masters', 'erddap-datasets.tail.xml')
+
+    if args.debug:
+        sys.stdout.write('==> DEBUG MODE <==\n')
+        sys.stdout.write('datasets.xml: {:s}\n'.format(args.datasets_xml_file))
+        sys.stdout.write('Header: {:s}\n'.format(head_xml))
+        sys.stdout.write('Tail  : {:s}\n'.format(tail_xml))
+
+    stats = assemble_datasets_xml(args.stream_xml_dir,
+        args.datasets_xml_file,
+        head_xml,
+        tail_xml,
+        pattern=args.pattern,
+        debug=args.debug)
+    if not stats:
+        return 1
+
+    if stats['written']:
+        sys.stdout.write('Writing: {:s}\n'.format(args.datasets_xml_file))
+    sys.stdout.write('{:s}\n'.format(format_assembly_stats(stats)))
+
+    if args.erddap_instance and stats['dataset_ids']:
+        flagged = flag_datasets(args.erddap_instance, stats['dataset_ids'])
+        sys.stdout.write('Flagged {:d} of {:d} changed datasets for reload\n'.format(flagged, len(stats['dataset_ids'])))
+
+    return 0
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('stream_xml_dir',
+        help='Location of the individual dataset xml files')
+    arg_parser.add_argument('datasets_xml_file',
+        help='ERDDAP datasets.xml file to write')
+    arg_parser.add_argument('--head',
+        dest='head_xml',
+        help='erddap-datasets head xml (Default is $OOI_ERDDAP_ASYNC_HOME/frontend/templating/masters/erddap-datasets.head.xml)')
+    arg_parser.add_argument('--tail',
+        dest='tail_xml',
+        help='erddap-datasets tail xml (Default is $OOI_ERDDAP_ASYNC_HOME/frontend/templating/masters/erddap-datasets.tail.xml)')
+    arg_parser.add_argument('-p', '--pattern',
+        default=DEFAULT_FRAGMENT_PATTERN,
+        help='Pattern matching the dataset xml files (Default is {:s})'.format(DEFAULT_FRAGMENT_PATTERN))
+    arg_parser.add_argument('-f', '--flag',
+        dest='erddap_instance',
+        help='ERDDAP instance (e.g. erddap-12-1) whose flag directory is used to reload the changed datasets')
+    arg_parser.add_argument('-x',
+        dest='debug',
+        action='store_true',
+        help='Print the numbers of added, modified and removed dataset xml files, but do not write the datasets.xml file')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
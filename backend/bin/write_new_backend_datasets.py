@@ -5,7 +5,9 @@ import sys
 import json
 import argparse
 from UFrame import UFrame
-from asynclib.util import csv2json
+from asynclib.config import load_subsites
+from asynclib.streams import fetch_instrument_streams
+from asynclib.cache import open_stream_cache
 from asynclib.erddap import create_dataset_xml_filename#, create_erddap_dataset_id
 
 def main(args):
@@ -51,11 +53,16 @@ def main(args):
         sys.stderr.write('Catalog destination does not exist: {:s}\n'.format(dest_dir))
         return 1
 
-    # Convert the subsite_csv to a list of sites and cable types
-    subsites = csv2json(subsite_csv)
+    # Load the subsite cable types, indexed by subsite name
+    subsites = load_subsites(subsite_csv)
     if not subsites:
         return 1
         
+    # Open the UFrame stream listings cache unless disabled via --no_cache
+    stream_cache = None
+    if not args.no_cache:
+        stream_cache = open_stream_cache(ttl=args.cache_ttl * 3600)
+        
     for subsite_deployments_json_catalog in args.subsite_deployments_json_catalogs:
         
         # Read in the specified subsite_deployments_json_catalog for deployed instruments
@@ -82,25 +89,28 @@ def main(args):
                 sys.stderr.write('Skipping existing catalog: {:s} (Use --clobber to overwrite or delete manually)\n'.format(new_datasets_catalog))
                 continue
         
-        try:
-            subsite_names = [s['subsite'] for s in subsites]
-        except KeyError as e:
-            sys.stderr.write('Failed to get subsite names from: {:s} ({:s})\n'.format(subsite_csv, e))
-            return 1
-            
         # Create the UFrame instance
         uframe = UFrame(base_url=args.base_url, timeout=args.timeout)
         
+        # Resolve the streams for all deployments on a known subsite concurrently
+        instrument_streams = fetch_instrument_streams(uframe,
+            [d['instrument']['reference_designator'] for d in deployments if d['instrument']['subsite'] in subsites],
+            workers=args.workers,
+            rate=args.rate,
+            cache=stream_cache)
+        if stream_cache:
+            sys.stdout.write('{:s}\n'.format(stream_cache.format_stats()))
+        
         new_datasets = []
         for deployment in deployments:
             
             # Make sure the instrument subsite name exists in subsites
-            if deployment['instrument']['subsite'] not in subsite_names:
+            if deployment['instrument']['subsite'] not in subsites:
                 sys.stderr.write('Unknown subsite: {:s}\n'.format(deployment['instrument']['subsite']))
                 continue
             
             # Pull the subsite element out to create the ERDDAP stream-xml directory    
-            subsite = subsites[subsite_names.index(deployment['instrument']['subsite'])]
+            subsite = subsites[deployment['instrument']['subsite']]
             erddap_instance = None
             if 'cabled_type' not in subsite:
                 sys.stderr.write('{:s}: Missing subsite cabled_type key ({:s})\n'.format(subsite['subsite'], subsite_csv))
@@ -124,7 +134,7 @@ def main(args):
                     continue
             
             # Get the list of all streams produced by this instrument
-            streams = uframe.instrument_to_streams(deployment['instrument']['reference_designator'])
+            streams = instrument_streams[deployment['instrument']['reference_designator']]
             if not streams:
                 sys.stderr.write('{:s}: No streams found\n'.format(deployment['instrument']['reference_designator']))
                 continue
@@ -198,6 +208,20 @@ if __name__ == '__main__':
         type=int,
         default=120,
         help='Specify the timeout, in seconds (Default is 120 seconds).')
+    arg_parser.add_argument('-w', '--workers',
+        type=int,
+        default=4,
+        help='Number of concurrent UFrame stream lookups (Default is 4).')
+    arg_parser.add_argument('-r', '--rate',
+        type=float,
+        help='Maximum number of UFrame stream lookups per second.  No limit if not specified.')
+    arg_parser.add_argument('--no_cache',
+        action='store_true',
+        help='Do not use the local UFrame stream listings cache')
+    arg_parser.add_argument('--cache_ttl',
+        type=float,
+        default=6,
+        help='Maximum age, in hours, of cached UFrame stream listings.  New streams on a cached instrument are not found until its listing expires (Default is 6 hours).')
 
     parsed_args = arg_parser.parse_args()
     #print parsed_args
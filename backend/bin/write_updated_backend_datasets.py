@@ -4,13 +4,17 @@ import os
 import sys
 import json
 import re
+import time
 import argparse
-from dateutil import parser
 from datetime import timedelta
 from UFrame import UFrame
-from asynclib.util import csv2json
+from asynclib.config import load_subsites
+from asynclib.streams import fetch_instrument_streams
+from asynclib.cache import open_stream_cache
 from asynclib.erddap import create_dataset_xml_filename, create_erddap_dataset_id
-from asynclib.erddap import fetch_erddap_datasets
+from asynclib.erddap import fetch_erddap_datasets, index_erddap_datasets
+from asynclib.timestamps import parse_iso8601
+from asynclib import session
 #from asynclib.backend import get_new_datasets
 
 def main(args):
@@ -66,23 +70,27 @@ def main(args):
         sys.stderr.write('Catalog destination does not exist: {:s}\n'.format(dest_dir))
         return 1
     
-    # Convert the subsite_csv to a list of sites and cable types
-    subsites = csv2json(subsite_csv)
+    # Load the subsite cable types, indexed by subsite name
+    subsites = load_subsites(subsite_csv)
     if not subsites:
         return 1
     
-    try:
-        subsite_names = [s['subsite'] for s in subsites]
-    except KeyError as e:
-        sys.stderr.write('Failed to get subsite names from: {:s} ({:s})\n'.format(subsite_csv, e))
-        return 1
-        
     # Create the UFrame instance
     uframe = UFrame(base_url=args.base_url, timeout=args.timeout)
     
+    # Stream endTime values are used to detect updates, so the UFrame stream
+    # listings cache is only used if requested via --stream_cache
+    stream_cache = None
+    if args.stream_cache:
+        stream_cache = open_stream_cache(ttl=args.cache_ttl * 3600)
+    
     # Create a regex for pulling out the datatype from the ERDDAP xml file provided
     # it exists
     erddap_type_regex = re.compile('type="EDD(Table|Grid)From')
+    
+    # allDatasets snapshots, indexed by datasetID, fetched once per ERDDAP
+    # cable type/dap type url.  None if the snapshot could not be fetched.
+    erddap_snapshots = {}
         
     for deployment_json_file in args.deployment_json_files:
         
@@ -112,16 +120,25 @@ def main(args):
             sys.stderr.write('{:s}: Deployment json file contains no deployments\n'.format(deployment_json_file))
             return 1
 
+        # Resolve the streams for all deployments on a known subsite concurrently
+        instrument_streams = fetch_instrument_streams(uframe,
+            [d['instrument']['reference_designator'] for d in deployments if d['instrument']['subsite'] in subsites],
+            workers=args.workers,
+            rate=args.rate,
+            cache=stream_cache)
+        if stream_cache:
+            sys.stdout.write('{:s}\n'.format(stream_cache.format_stats()))
+        
         new_datasets = []
         for deployment in deployments:
             
             # Make sure the instrument subsite name exists in subsites
-            if deployment['instrument']['subsite'] not in subsite_names:
+            if deployment['instrument']['subsite'] not in subsites:
                 sys.stderr.write('Unknown subsite: {:s}\n'.format(deployment['instrument']['subsite']))
                 continue
             
             # Pull the subsite element out to create the ERDDAP stream-xml directory    
-            subsite = subsites[subsite_names.index(deployment['instrument']['subsite'])]
+            subsite = subsites[deployment['instrument']['subsite']]
             erddap_instance = None
             if 'cabled_type' not in subsite:
                 sys.stderr.write('{:s}: Missing subsite cabled_type key ({:s})\n'.format(subsite['subsite'], subsite_csv))
@@ -140,7 +157,7 @@ def main(args):
                 continue
             
             # Get the list of all streams produced by this instrument
-            streams = uframe.instrument_to_streams(deployment['instrument']['reference_designator'])
+            streams = instrument_streams[deployment['instrument']['reference_designator']]
             if not streams:
                 sys.stderr.write('{:s}: No streams found\n'.format(deployment['instrument']['reference_designator']))
                 continue
@@ -195,12 +212,23 @@ def main(args):
                 # Create the all datasets URL that we'll need to hit to search for the 
                 # dataset's metadata    
                 erddap_daptype_url = '{:s}/{:s}/erddap/{:s}'.format(erddap_base_url, subsite['cabled_type'], erddap_dataset_type)
-                # Send the request for the specified datasetID
-                datasets = fetch_erddap_datasets(erddap_daptype_url, dataset_id=dataset_id)
-                if not datasets:
-                    continue    
+                # Fetch the full allDatasets table the first time we see this url
+                if erddap_daptype_url not in erddap_snapshots:
+                    erddap_snapshots[erddap_daptype_url] = fetch_erddap_snapshot(erddap_daptype_url)
+                    
+                snapshot = erddap_snapshots[erddap_daptype_url]
+                dataset = snapshot.get(dataset_id) if snapshot is not None else None
+                if not dataset:
+                    # Datasets are always queried individually if the snapshot
+                    # could not be fetched
+                    if snapshot is not None and not args.fallback_query:
+                        continue
+                    # Send the request for the specified datasetID
+                    datasets = fetch_erddap_datasets(erddap_daptype_url, dataset_id=dataset_id)
+                    if not datasets:
+                        continue    
                     
-                dataset = datasets[0]
+                    dataset = datasets[0]
                     
                 sys.stdout.write('Dataset found: {:s}\n'.format(dataset_id))
                 sys.stdout.write('Checking for UPDATES...\n')
@@ -212,13 +240,18 @@ def main(args):
                 if not event_stop_ts:
                     event_stop_ts = stream['endTime']
                 # Convert event_stop_ts to a datetime
-                event_stop_dt = parser.parse(event_stop_ts)
+                event_stop_dt = parse_iso8601(event_stop_ts)
+                if not event_stop_dt:
+                    continue
                 
                 # Convert the dataset['maxTime'] to a datetime and add the event_stop_dt.microsecond
                 # value to account for the fact that UFrame keeps track of microseconds but
                 # ERDDAP does not.  This will allow comparison of event_stop_ts and dataset_stop_dt
                 # while ignoring the microseconds
-                dataset_stop_dt = parser.parse(dataset['maxTime']) + timedelta(0, 0, event_stop_dt.microsecond)
+                dataset_stop_dt = parse_iso8601(dataset['maxTime'])
+                if not dataset_stop_dt:
+                    continue
+                dataset_stop_dt += timedelta(0, 0, event_stop_dt.microsecond)
                 if event_stop_dt < dataset_stop_dt:
                     continue
                 else:
@@ -252,8 +285,27 @@ def main(args):
             sys.stderr.write('{:s}\n'.format(e))
             return 1
     
+    sys.stdout.write('{:s}\n'.format(session.format_stats()))
+    
     return 0
     
+def fetch_erddap_snapshot(erddap_url, attempts=3, retry_delay=10):
+    '''Fetch the allDatasets table from erddap_url, making up to attempts
+    requests if the request fails, and return it indexed by datasetID.  Returns
+    None if the table could not be fetched.'''
+    
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(retry_delay)
+        sys.stdout.write('Fetching allDatasets snapshot: {:s}\n'.format(erddap_url))
+        datasets = fetch_erddap_datasets(erddap_url)
+        if not datasets.failed:
+            return index_erddap_datasets(datasets)
+            
+    sys.stderr.write('Failed to fetch allDatasets snapshot, querying datasets individually: {:s}\n'.format(erddap_url))
+    
+    return None
+    
 if __name__ == '__main__':
 
     arg_parser = argparse.ArgumentParser(description=main.__doc__)
@@ -273,6 +325,10 @@ if __name__ == '__main__':
     arg_parser.add_argument('-e', '--erddap_backend_base_url',
         dest='erddap_base_url',
         help='Alternate ERDDAP address.  Must start with \'http://\'.  Taken from OOI_ERDDAP_BACKEND_BASE_URL if not specified, provided it is set.')
+    arg_parser.add_argument('-q', '--fallback_query',
+        dest='fallback_query',
+        action='store_true',
+        help='Query the ERDDAP server for individual datasets that are not present in the allDatasets snapshot')
     arg_parser.add_argument('-b', '--baseurl',
         dest='base_url',
         help='Specify an alternate uFrame server URL. Must start with \'http://\'.  Value is taken from the UFRAME_BASE_URL environment variable, if set')
@@ -280,6 +336,20 @@ if __name__ == '__main__':
         type=int,
         default=120,
         help='Specify the timeout, in seconds (Default is 120 seconds).')
+    arg_parser.add_argument('-w', '--workers',
+        type=int,
+        default=4,
+        help='Number of concurrent UFrame stream lookups (Default is 4).')
+    arg_parser.add_argument('-r', '--rate',
+        type=float,
+        help='Maximum number of UFrame stream lookups per second.  No limit if not specified.')
+    arg_parser.add_argument('--stream_cache',
+        action='store_true',
+        help='Use the local UFrame stream listings cache.  Cached stream endTimes may be up to --cache_ttl hours old.')
+    arg_parser.add_argument('--cache_ttl',
+        type=float,
+        default=1,
+        help='Maximum age, in hours, of cached UFrame stream listings (Default is 1 hour).')
 
     parsed_args = arg_parser.parse_args()
     #print parsed_args
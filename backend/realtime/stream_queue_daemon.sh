@@ -0,0 +1,51 @@
+#! /bin/bash --
+#
+# Bash script to activate the python erddap virtual environment and start the
+# resident stream-queue daemon, which creates or updates backend ERDDAP datasets
+# as soon as each UFrame async request completes.  Replaces the periodic
+# update_erddap_datasets.sh batch pass.
+# Also checks for the existence and validity of the following environment
+# variables:
+#   OOI_ERDDAP_ASYNC_HOME
+#   OOI_ERDDAP_DATA_HOME
+#
+
+echo -e "\n==============================================================================";
+echo "$0: $(date --utc)";
+. ${HOME}/.bashrc;
+
+# Set up path
+PATH=${PATH}:/bin:$OOI_ERDDAP_ASYNC_HOME/backend/bin;
+
+# Source the python virtual env wrapper set up script
+. $VIRTUALENVWRAPPER_SCRIPT;
+
+workon erddap
+[ "$?" -ne 0 ] && exit 1;
+
+# Make sure $OOI_ERDDAP_ASYNC_HOME is set and valid
+if [ -z "$OOI_ERDDAP_ASYNC_HOME" ]
+then
+    echo "OOI_ERDDAP_ASYNC_HOME not set" >&2;
+    exit 1;
+elif [ ! -d "$OOI_ERDDAP_ASYNC_HOME" ]
+then
+    echo "Invalid OOI_ERDDAP_ASYNC_HOME location: $OOI_ERDDAP_ASYNC_HOME" >&2;
+    exit 1;
+fi
+
+# Make sure $OOI_ERDDAP_DATA_HOME is set and valid
+if [ -z "$OOI_ERDDAP_DATA_HOME" ]
+then
+    echo "OOI_ERDDAP_DATA_HOME not set" >&2;
+    exit 1;
+elif [ ! -d "$OOI_ERDDAP_DATA_HOME" ]
+then
+    echo "Invalid OOI_ERDDAP_DATA_HOME location: $OOI_ERDDAP_DATA_HOME" >&2;
+    exit 1;
+fi
+
+# Write the throughput/latency statistics alongside the logs
+stats_file="${OOI_ERDDAP_ASYNC_HOME}/backend/realtime/logs/stream_queue_daemon.stats.json";
+
+exec stream_queue_daemon.py --stats_file $stats_file "$@";
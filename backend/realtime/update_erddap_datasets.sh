@@ -67,10 +67,6 @@ then
     exit 1;
 fi
 
-# Process each response file separately
-for response in $responses
-do
-    echo "Checking response file: $response";
-    # Process the response file and delete it ONLY if there were no issues
-    async_request_to_erddap.py --delete_on_success $response;
-done
+# Process all response files in a single process and delete each one ONLY if
+# there were no issues
+async_request_to_erddap.py --delete_on_success --workers 4 $responses;
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import subprocess
+from functools import partial
+from asynclib.concurrency import map_concurrent
+from asynclib.filesystem import write_atomic
+from erddapDatasets_to_dataset_template import load_global_attributes, write_dataset_template
+
+# Location of ERDDAP's GenerateDatasetsXml.sh
+DEFAULT_XML_BUILDER = '/var/local/erddap/tomcat-12-2/webapps/erddap/WEB-INF/GenerateDatasetsXml.sh'
+# Name of the file, written to each template directory, recording the inputs of
+# the last successful GenerateDatasetsXml run
+STATE_FILENAME = '.generateDatasetsXml.json'
+
+def main(args):
+    '''Create the ERDDAP dataset xml templates for each template directory
+    containing a <stream>.erddapDatasets.args and <stream>.erddapDatasets.xml file.
+    GenerateDatasetsXml.sh is run for several directories at once and each result
+    is converted to a production dataset template as soon as it completes.
+    Directories whose args file, sample NetCDF file and erddapDatasets xml file
+    are unchanged since the last successful run are skipped.  If no directories
+    are specified, all directories in the default template datasets destination
+    are checked.'''
+
+    async_home = os.getenv('OOI_ERDDAP_ASYNC_HOME')
+    if not async_home:
+        sys.stderr.write('OOI_ERDDAP_ASYNC_HOME not defined\n')
+        return 1
+    if not os.path.isdir(async_home):
+        sys.stderr.write('Invalid OOI_ERDDAP_ASYNC_HOME directory: {:s}\n'.format(async_home))
+        return 1
+    if not os.path.isfile(args.xml_builder):
+        sys.stderr.write('Invalid GenerateDatasetsXml.sh: {:s}\n'.format(args.xml_builder))
+        return 1
+
+    # Set up directories
+    templating_home = os.path.join(async_home, 'backend', 'templating')
+    dirs = {'logs' : os.path.join(templating_home, 'xml', 'generateDatasetsXml-logs'),
+        'orig' : os.path.join(templating_home, 'xml', 'orig'),
+        'production' : os.path.join(templating_home, 'xml', 'production')}
+    for (name, d) in sorted(dirs.items()):
+        if not os.path.isdir(d):
+            sys.stderr.write('Invalid {:s} destination: {:s}\n'.format(name, d))
+            return 1
+
+    template_dirs = args.template_dirs
+    if not template_dirs:
+        datasets_dir = os.path.join(templating_home, 'datasets')
+        template_dirs = sorted([d for d in glob.glob(os.path.join(datasets_dir, '*')) if os.path.isdir(d)])
+
+    if args.debug:
+        sys.stdout.write('Logs destination: {:s}\n'.format(dirs['logs']))
+        sys.stdout.write('XML destination : {:s}\n'.format(dirs['orig']))
+        sys.stdout.write('XML builder     : {:s}\n'.format(args.xml_builder))
+
+    # Find the directories that need a new template
+    pending = []
+    for template_dir in template_dirs:
+        run = find_template_run(template_dir)
+        if not run:
+            continue
+        if not args.force and is_unchanged(run, dirs['production']):
+            sys.stdout.write('Inputs unchanged, skipping: {:s}\n'.format(template_dir))
+            continue
+        sys.stdout.write('Template pending: {:s}\n'.format(template_dir))
+        pending.append(run)
+
+    if args.debug or not pending:
+        return 0
+
+    global_attributes = load_global_attributes(async_home)
+
+    t0 = time.time()
+    results = map_concurrent(partial(create_dataset_template,
+            xml_builder=args.xml_builder,
+            dirs=dirs,
+            global_attributes=global_attributes),
+        pending,
+        workers=args.workers)
+
+    created = [r for r in results if r]
+    sys.stdout.write('Created {:d} of {:d} dataset templates in {:0.1f}s\n'.format(len(created),
+        len(pending),
+        time.time() - t0))
+
+    return 0 if len(created) == len(pending) else 1
+
+def find_template_run(template_dir):
+    '''Return a dict containing the stream name, args file, erddapDatasets xml
+    file and GenerateDatasetsXml arguments for template_dir or None if either
+    file is missing'''
+
+    template_dir = os.path.abspath(template_dir)
+    if not os.path.isdir(template_dir):
+        sys.stderr.write('Invalid directory specified: {:s}\n'.format(template_dir))
+        return None
+
+    # Directory name should be a stream-telemetry type
+    stream = os.path.basename(template_dir)
+    args_file = os.path.join(template_dir, '{:s}.erddapDatasets.args'.format(stream))
+    xml_template = os.path.join(template_dir, '{:s}.erddapDatasets.xml'.format(stream))
+
+    status = True
+    if not os.path.isfile(args_file):
+        sys.stderr.write('Missing stream-telemetry args file: {:s}\n'.format(args_file))
+        status = False
+    if not os.path.isfile(xml_template):
+        sys.stderr.write('Missing stream-telemetry xml file: {:s}\n'.format(xml_template))
+        status = False
+    if not status:
+        sys.stderr.write('Skipping directory: {:s}\n'.format(template_dir))
+        return None
+
+    try:
+        with open(args_file, 'r') as fid:
+            builder_args = fid.read().split()
+    except IOError as e:
+        sys.stderr.write('{:s}\n'.format(e))
+        return None
+
+    return {'template_dir' : template_dir,
+        'stream' : stream,
+        'args_file' : args_file,
+        'xml_template' : xml_template,
+        'builder_args' : builder_args}
+
+def template_inputs(run):
+    '''Return a dict describing the current state of the inputs of run: the
+    SHA-1 of the args and erddapDatasets xml files and the size and modification
+    time of the sample NetCDF file(s) named in the args'''
+
+    inputs = {'args' : _file_sha1(run['args_file']),
+        'xml' : _file_sha1(run['xml_template']),
+        'nc' : {}}
+    for nc_file in [a for a in run['builder_args'] if a.endswith('.nc')]:
+        try:
+            st = os.stat(nc_file)
+            inputs['nc'][nc_file] = [st.st_size, st.st_mtime]
+        except OSError:
+            inputs['nc'][nc_file] = None
+
+    return inputs
+
+def is_unchanged(run, production_dir):
+    '''Return True if the inputs of run are the same as those recorded after its
+    last successful run and the production template still exists'''
+
+    state_file = os.path.join(run['template_dir'], STATE_FILENAME)
+    try:
+        with open(state_file, 'r') as fid:
+            state = json.load(fid)
+    except (IOError, ValueError):
+        return False
+
+    if not os.path.isfile(state.get('template', '')):
+        return False
+    if os.path.dirname(state['template']) != os.path.abspath(production_dir):
+        return False
+
+    return state.get('inputs') == template_inputs(run)
+
+def create_dataset_template(run, xml_builder, dirs, global_attributes):
+    '''Run GenerateDatasetsXml.sh on run and write the resulting production
+    dataset template.  The inputs are recorded in the template directory if the
+    template is created.  Returns the template filename or None on failure.'''
+
+    stream = run['stream']
+
+    # Create the log files for writing STDOUT and STDERR from xml_builder
+    stream_stdout = os.path.join(dirs['logs'], '{:s}-generateDatasetsXml.sh.stdout'.format(stream))
+    stream_stderr = os.path.join(dirs['logs'], '{:s}-generateDatasetsXml.sh.stderr'.format(stream))
+
+    sys.stdout.write('Creating erddapDatasets XML template: {:s}\n'.format(stream))
+
+    # All paths in the xml_builder shell script are relative, so it must be run
+    # from the directory containing it
+    cmd = [xml_builder, '-i{:s}#dataset'.format(run['xml_template'])] + run['builder_args']
+    t0 = time.time()
+    try:
+        with open(stream_stdout, 'w') as out_fid:
+            with open(stream_stderr, 'w') as err_fid:
+                status = subprocess.call(cmd,
+                    cwd=os.path.dirname(xml_builder),
+                    stdout=out_fid,
+                    stderr=err_fid)
+    except (IOError, OSError) as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(stream, e))
+        return None
+
+    if status != 0:
+        sys.stderr.write('Error creating template: see {:s}\n'.format(stream_stdout))
+        sys.stderr.write('Error creating template: see {:s}\n'.format(stream_stderr))
+        return None
+
+    sys.stdout.write('Copying erddapDatasets XML template to: {:s}\n'.format(dirs['orig']))
+    erddap_datasets_xml = os.path.join(dirs['orig'], os.path.basename(run['xml_template']))
+    try:
+        shutil.copyfile(run['xml_template'], erddap_datasets_xml)
+    except IOError as e:
+        sys.stderr.write('Unknown error creating XML template: {:s}\n'.format(e))
+        return None
+
+    # Create the dataset.xml file from the erddap_datasets_xml file and stick it
+    # in the production directory
+    dataset_xml_file = write_dataset_template(erddap_datasets_xml,
+        xml_dest=dirs['production'],
+        global_attributes=global_attributes,
+        clobber=True)
+    if not dataset_xml_file:
+        sys.stderr.write('Failed to produce production template for {:s}\n'.format(erddap_datasets_xml))
+        return None
+
+    sys.stdout.write('Production template created ({:0.1f}s): {:s}\n'.format(time.time() - t0, dataset_xml_file))
+
+    # Record the inputs of this successful run
+    state = {'template' : os.path.abspath(dataset_xml_file),
+        'inputs' : template_inputs(run),
+        'created' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+    write_atomic(os.path.join(run['template_dir'], STATE_FILENAME), json.dumps(state))
+
+    return dataset_xml_file
+
+def _file_sha1(filename):
+
+    sha1 = hashlib.sha1()
+    try:
+        with open(filename, 'rb') as fid:
+            for block in iter(lambda: fid.read(1048576), b''):
+                sha1.update(block)
+    except IOError:
+        return None
+
+    return sha1.hexdigest()
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('template_dirs',
+        nargs='*',
+        help='One or more template directories (Default is all directories in $OOI_ERDDAP_ASYNC_HOME/backend/templating/datasets)')
+    arg_parser.add_argument('-w', '--workers',
+        type=int,
+        default=4,
+        help='Number of concurrent GenerateDatasetsXml.sh runs (Default is 4)')
+    arg_parser.add_argument('-g', '--xml_builder',
+        default=DEFAULT_XML_BUILDER,
+        help='Location of ERDDAP\'s GenerateDatasetsXml.sh (Default is {:s})'.format(DEFAULT_XML_BUILDER))
+    arg_parser.add_argument('-f', '--force',
+        action='store_true',
+        help='Create templates even if the inputs are unchanged since the last successful run')
+    arg_parser.add_argument('-x', '--debug',
+        action='store_true',
+        help='Print configuration and the pending directories only')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
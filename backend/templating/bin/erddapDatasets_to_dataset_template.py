@@ -13,12 +13,31 @@ def main(args):
     added to the XML.  By default, the new xml files are written to the same
     directory as they source files.'''
     
-    new_global_attributes = {}
     async_home = os.getenv('OOI_ERDDAP_ASYNC_HOME')
-    if not os.path.isdir(async_home):
+    if not async_home or not os.path.isdir(async_home):
         sys.stderr.write('OOI_ERDDAP_ASYNC_HOME is not set\n')
         return 1
     
+    new_global_attributes = load_global_attributes(async_home)
+            
+    for xml_file in args.erddap_datasets_xml_files:
+    
+        out_xml_file = write_dataset_template(xml_file,
+            xml_dest=args.destination,
+            global_attributes=new_global_attributes,
+            clobber=args.clobber)
+        if not out_xml_file:
+            continue
+            
+        sys.stdout.write('{:s}\n'.format(out_xml_file))
+        
+def load_global_attributes(async_home):
+    '''Return a dict of the global attributes to add to, or remove from, the
+    dataset XML templates.  Each OOI_ERDDAP_ASYNC_HOME/config/nc/attributes/*.att
+    file names an attribute and contains its value.'''
+    
+    new_global_attributes = {}
+    
     # See if the OOI_ERDDAP_ASYNC_HOME/config/nc/attributes directory exists.
     # This directory may contain .att files names for the global attribute that 
     # should be added or removed from the dataset XML template files
@@ -43,89 +62,95 @@ def main(args):
                     new_global_attributes[k] = att_text
             except IOError as e:
                 sys.stderr.write('{:s}\n'.format(e))
-            
-    for xml_file in args.erddap_datasets_xml_files:
+                
+    return new_global_attributes
     
-        (xml_path, xml_fname) = os.path.split(xml_file)
-        xml_dest = args.destination
-        if not xml_dest:
-            xml_dest = os.path.realpath(xml_path)
+def write_dataset_template(xml_file, xml_dest=None, global_attributes=None, clobber=False):
+    '''Write the <dataset /> element in the erddapDatasets xml_file to a
+    .template.xml file in xml_dest, or the same directory as xml_file.  Returns
+    the name of the template file or None if it was not written.'''
     
-        if not os.path.isdir(xml_dest):
-            sys.stderr.write('Invalid XML destination: {:s}\n'.format(xml_dest))
-            continue
-       
-        # split the filename on '.'.  If there are 3 tokens and the 2nd element
-        # is erddapDatasets, replace it with dataset
-        xml_tokens = xml_fname.split('.')
-        if xml_tokens[1] == 'erddapDatasets':
-            xml_tokens[1] = 'dataset'
-            xml_fname = '.'.join(xml_tokens)
-            
-        (xml_fname, ext) = os.path.splitext(xml_fname)
-        # Append 'template' to the output file
-        out_xml_file = os.path.join(xml_dest, '{:s}.template.xml'.format(xml_fname))
-        if os.path.isfile(out_xml_file) and not args.clobber:
-            sys.stderr.write('Skipping file (Output file already exists - remove the file or use the --clobber option to overwrite): {:s}\n'.format(out_xml_file))
-            continue
-            
-        # Validate the input xml file
-        if not os.path.isfile(xml_file):
-            sys.stderr.write('Invalid file: {:s}\n'.format(xml_file))
-            continue
+    (xml_path, xml_fname) = os.path.split(xml_file)
+    if not xml_dest:
+        xml_dest = os.path.realpath(xml_path)
+
+    if not os.path.isdir(xml_dest):
+        sys.stderr.write('Invalid XML destination: {:s}\n'.format(xml_dest))
+        return None
+   
+    # split the filename on '.'.  If there are 3 tokens and the 2nd element
+    # is erddapDatasets, replace it with dataset
+    xml_tokens = xml_fname.split('.')
+    if xml_tokens[1] == 'erddapDatasets':
+        xml_tokens[1] = 'dataset'
+        xml_fname = '.'.join(xml_tokens)
         
-        # Parse the xml file
-        doc = parse(xml_file)
+    (xml_fname, ext) = os.path.splitext(xml_fname)
+    # Append 'template' to the output file
+    out_xml_file = os.path.join(xml_dest, '{:s}.template.xml'.format(xml_fname))
+    if os.path.isfile(out_xml_file) and not clobber:
+        sys.stderr.write('Skipping file (Output file already exists - remove the file or use the --clobber option to overwrite): {:s}\n'.format(out_xml_file))
+        return None
         
-        # Get the root element
-        root = doc.getroot()
+    # Validate the input xml file
+    if not os.path.isfile(xml_file):
+        sys.stderr.write('Invalid file: {:s}\n'.format(xml_file))
+        return None
     
-        if root.tag != 'erddapDatasets':
-            sys.stderr.write('Root element is not of type <erddapDatasets> ({:s})\n'.format(root.tag))
-            continue
-            
-        # Get the first dataset tag (should only be one)
-        dataset = root.find('dataset')
-        if dataset is None:
-            sys.stderr.write('No <dataset /> element found: {:s}\n'.format(xml_file))
-            continue
+    # Parse the xml file
+    doc = parse(xml_file)
+    
+    # Get the root element
+    root = doc.getroot()
+
+    if root.tag != 'erddapDatasets':
+        sys.stderr.write('Root element is not of type <erddapDatasets> ({:s})\n'.format(root.tag))
+        return None
         
-        # Find the addAttributes element
-        add_attributes_e = dataset.find('addAttributes')
-        if add_attributes_e is None:
-            sys.stderr.write('<dataset /> does not contain an <addAttributes /> element\n')
+    # Get the first dataset tag (should only be one)
+    dataset = root.find('dataset')
+    if dataset is None:
+        sys.stderr.write('No <dataset /> element found: {:s}\n'.format(xml_file))
+        return None
+    
+    # Find the addAttributes element
+    add_attributes_e = dataset.find('addAttributes')
+    if add_attributes_e is None:
+        sys.stderr.write('<dataset /> does not contain an <addAttributes /> element\n')
+        return None
 
-        # Get the list of attributes
-        global_atts = add_attributes_e.getchildren()
-        global_att_names = [a.get('name') for a in global_atts]
+    # Get the list of attributes
+    global_atts = list(add_attributes_e)
+    global_att_names = [a.get('name') for a in global_atts]
 
-        # Add additional global attributes or remove existing global attributes
-        # if there are files (att_txt_file)
-        if new_global_attributes and add_attributes_e is not None:
-            for (k,v) in new_global_attributes.items():
-                if k in global_att_names:
-                    add_attributes_e.remove(global_atts[global_att_names.index(k)])
-                else:
-                    g_att = Element('att', {'name' : k})
-                    g_att.text = v
-                    add_attributes_e.append(g_att)
-            
-        # Find and remove the obs data variable provided it exists
-        data_vars = dataset.findall('dataVariable')
-        obs_vars = [d for d in data_vars if d.find('sourceName').text == 'obs']
-        if obs_vars:
-            for obs_var in obs_vars:
-                dataset.remove(obs_var)
+    # Add additional global attributes or remove existing global attributes
+    # if there are files (att_txt_file)
+    if global_attributes:
+        for (k,v) in global_attributes.items():
+            if k in global_att_names:
+                add_attributes_e.remove(global_atts[global_att_names.index(k)])
+            else:
+                g_att = Element('att', {'name' : k})
+                g_att.text = v
+                add_attributes_e.append(g_att)
+        
+    # Find and remove the obs data variable provided it exists
+    data_vars = dataset.findall('dataVariable')
+    obs_vars = [d for d in data_vars if d.find('sourceName').text == 'obs']
+    if obs_vars:
+        for obs_var in obs_vars:
+            dataset.remove(obs_var)
 
-        tree = ElementTree(dataset)
+    tree = ElementTree(dataset)
+    
+    try:
+        with open(out_xml_file, 'wb') as fid:
+            tree.write(fid)
+    except IOError as e:
+        sys.stderr.write('{:s}\n'.format(e))
+        return None
         
-        try:
-            with open(out_xml_file, 'w') as fid:
-                tree.write(fid)
-        except IOError as e:
-            sys.stderr.write('{:s}\n'.format(e))
-            
-        sys.stdout.write('{:s}\n'.format(out_xml_file))
+    return out_xml_file
     
 if __name__ == '__main__':
 
@@ -2,7 +2,8 @@
 
 import argparse
 import sys
-from asynclib.erddap import download_erddap_nc
+from asynclib.erddap import download_erddap_nc, use_response_cache
+from asynclib.cache import open_response_cache
 
 def main(args):
     '''Download a flat, table-like, NetCDF-3 binary file for the specified datasetID,
@@ -12,6 +13,9 @@ def main(args):
     generated filename.
     '''
     
+    if args.catalog_ttl is not None:
+        use_response_cache(open_response_cache(ttl=args.catalog_ttl))
+        
     nc_file = download_erddap_nc(args.erddap_url,
         args.dataset_id,
         output_filename=args.output_file,
@@ -21,7 +25,9 @@ def main(args):
         start_time=args.start_date,
         end_time=args.end_date,
         clobber=args.clobber,
-        print_url=args.url_only)
+        print_url=args.url_only,
+        buffer_size=int(args.buffer_size * 1048576),
+        fsync=args.fsync)
         
     if nc_file:
         sys.stdout.write('{:s}\n'.format(nc_file))
@@ -53,9 +59,19 @@ if __name__ == '__main__':
     arg_parser.add_argument('-c', '--clobber',
         action='store_true',
         help='Clobber existing file with the same name')
+    arg_parser.add_argument('-b', '--buffer_size',
+        type=float,
+        default=4,
+        help='Size, in MB, of the chunks read from the server and written to disk (Default is 4 MB)')
+    arg_parser.add_argument('--fsync',
+        action='store_true',
+        help='Flush the file to disk once the download is complete')
     arg_parser.add_argument('-u', '--url_only',
         action='store_true',
         help='Print the request URL, but do not send the request.')
+    arg_parser.add_argument('--catalog_ttl',
+        type=int,
+        help='Cache allDatasets responses under OOI_ERDDAP_ASYNC_HOME and use them for this many seconds before revalidating them with a conditional request.  Responses are not cached by default.')
 
     parsed_args = arg_parser.parse_args()
 
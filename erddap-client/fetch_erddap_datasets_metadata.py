@@ -2,7 +2,9 @@
 
 import argparse
 import sys
-from asynclib.erddap import fetch_erddap_datasets
+from asynclib.erddap import fetch_erddap_datasets, use_response_cache
+from asynclib.datasets import EPOCH_COLUMNS
+from asynclib.cache import open_response_cache
 import csv
 import json
 
@@ -10,17 +12,27 @@ def main(args):
     '''Fetch the allDatasets.json request at the specified erddap_url.  Prints the
     results STDOUT as comma-separated value records'''
     
+    if args.catalog_ttl is not None:
+        use_response_cache(open_response_cache(ttl=args.catalog_ttl))
+        
     metadata = fetch_erddap_datasets(args.erddap_url,
         dataset_id=args.dataset_id,
         full_listing=args.full)
         
+    # The <time>Epoch fields are parsed by fetch_erddap_datasets and are not
+    # part of the allDatasets response
+    skip_cols = []
+    if not args.epochs:
+        skip_cols = ['{:s}Epoch'.format(c) for c in EPOCH_COLUMNS]
+        
     if args.json:
-        sys.stdout.write('{:s}\n'.format(json.dumps(metadata)))
+        datasets = [dict([(k, v) for (k, v) in m.items() if k not in skip_cols]) for m in metadata]
+        sys.stdout.write('{:s}\n'.format(json.dumps(datasets)))
     else:
         if metadata:
             csv_writer = csv.writer(sys.stdout)
-            cols = metadata[0].keys()
-            cols.pop(cols.index('instrument'))
+            # The parsed instrument dict does not fit in a csv column
+            cols = [k for k in metadata[0].keys() if k not in skip_cols + ['instrument']]
             csv_writer.writerow(cols)
             for m in metadata:
                 csv_writer.writerow([m[k] for k in cols])
@@ -40,6 +52,12 @@ if __name__ == '__main__':
     arg_parser.add_argument('-f', '--full',
         action='store_true',
         help='Set to True to get the full dataset metadata listing <Default=False>')
+    arg_parser.add_argument('--epochs',
+        action='store_true',
+        help='Include the minTime and maxTime of each dataset as seconds since 1970-01-01T00:00:00Z (minTimeEpoch and maxTimeEpoch)')
+    arg_parser.add_argument('--catalog_ttl',
+        type=int,
+        help='Cache allDatasets responses under OOI_ERDDAP_ASYNC_HOME and use them for this many seconds before revalidating them with a conditional request.  Responses are not cached by default.')
 
     parsed_args = arg_parser.parse_args()
 
@@ -38,7 +38,9 @@ DESCRIPTION
         $stream_xml_dir
 
     for all dataset.xml files and creates a new ERDDAP datasets.xml file for
-        serving the individual datasets.
+        serving the individual datasets.  Only added, modified or removed
+        dataset.xml files are spliced into the existing datasets.xml file and
+        the datasets they contain are flagged for reload.
 
     The resulting datasets.xml file is written to:
 
@@ -84,77 +86,21 @@ fi
 # Files of interest
 erddap_head_xml="${OOI_ERDDAP_ASYNC_HOME}/frontend/templating/masters/erddap-datasets.head.xml";
 erddap_tail_xml="${OOI_ERDDAP_ASYNC_HOME}/frontend/templating/masters/erddap-datasets.tail.xml";
-stream_xml_files=$(find $stream_xml_dir -maxdepth 1 -type f -name '*dataset.xml' | sort);
 
 if [ ! -f "$datasets_xml_file" ]
 then
     echo "Invalid ERDDAP datasets.xml file: $datasets_xml_file" >&2;
     exit 1;
-elif [ ! -f "$erddap_head_xml" ]
-then
-    echo "Missing erddap head file: $erddap_head_xml" >&2;
-    exit 1;
-elif [ ! -f "$erddap_tail_xml" ]
-then
-    echo "Missing erddap tail file: $erddap_tail_xml" >&2;
-    exit 1;
-elif [ -z "$stream_xml_files" ]
-then
-    echo "No stream xml files found: $stream_xml_dir" >&2;
-    exit 1;
 fi
 
-# Create the datasets.xml file
-tmp_datasets_xml_file='/var/local/erddap/content/content-11-2/erddap/datasets.xml.tmp';
-if [ -z "$debug" ]
-then
-    cat $erddap_head_xml > $tmp_datasets_xml_file;
-else
-    echo '==> DEBUG MODE <==';
-    echo "datasets.xml: $datasets_xml_file";
-    echo "Header: $erddap_head_xml";
-fi
-
-if [ "$?" -ne 0 ]
-then
-    rm $tmp_datasets_xml_file;
-    exit 1;
-fi
-# cat each $xml file in $stream_xml_files to the temporary datasets xml file
-for xml_file in $stream_xml_files
-do
-    if [ -n "$debug" ]
-    then
-        echo "dataset XML file: $xml_file";
-    else    
-	    echo "Adding $xml_file";
-	    cat $xml_file >> $tmp_datasets_xml_file;
-		if [ "$?" -ne 0 ]
-		then
-	        echo "Removing temporary datasets.xml file: $tmp_datasets_xml_file" >&2;
-		    rm $tmp_datasets_xml_file;
-		    exit 1;
-		fi
-    fi
-done
-if [ -z "$debug" ]
-then
-    cat $erddap_tail_xml >> $tmp_datasets_xml_file;
-else
-    echo "Tail  : $erddap_tail_xml";
-fi
-if [ "$?" -ne 0 ]
-then
-    rm $tmp_datasets_xml_file;
-    exit 1;
-fi
-
-# Move the temporary file to the datasets.xml file
-if [ -z "$debug" ]
-then
-	echo "Writing: $datasets_xml_file...";
-	mv $tmp_datasets_xml_file $datasets_xml_file;
-fi
+# Splice added, modified and removed stream xml files into the datasets.xml
+# file.  The file is left untouched if no stream xml files have changed.
+${OOI_ERDDAP_ASYNC_HOME}/backend/bin/write_datasets_xml.py \
+    --head $erddap_head_xml \
+    --tail $erddap_tail_xml \
+    --flag erddap-11-2 \
+    ${debug:+-x} \
+    $stream_xml_dir \
+    $datasets_xml_file;
 
 exit $?;
-
@@ -4,24 +4,33 @@ import os
 import sys
 import glob
 import argparse
-from subprocess import check_output, CalledProcessError
-from dateutil import parser
 from asynclib.erddap import *
-from asynclib.templating import get_valid_dataset_template
-from asynclib.filesystem import build_nc_dest
+from asynclib.templating import get_valid_dataset_template, format_xml_template_stats
+from asynclib.filesystem import build_nc_dest, has_contents, write_atomic
+from asynclib.netcdf import convert_nc3_to_nc4, nc_last_time
+from asynclib.timestamps import parse_iso8601
+from asynclib.cache import open_response_cache
+from asynclib.manifest import open_build_manifest, hash_inputs
+from asynclib.flags import flag_datasets
+from functools import partial
+from asynclib.concurrency import BoundedProcessPool, map_concurrent
+from asynclib import session
+
+# Map of cable types to erddap instance
+_CABLE_TYPES = {'uncabled' : 'erddap-11-2',
+    'cabled' : 'erddap-11-1'}
+# ERDDAP data types served by each instance
+_DAP_TYPES = ['tabledap', 'griddap']
 
 def main(args):
     '''Compare the existing uncabled tabledap ERDDAP frontend datasets with the 
     corresponding ERDDAP backend datasets.  New datasets are created and existing 
-    datasets are updated if the start and/or end times differ'''
+    datasets are updated if the start and/or end times differ.  Use --all to
+    synchronise all cable type and dap type combinations concurrently.'''
     
     if args.debug:
         sys.stdout.write('==> DEBUG MODE: No file operations performed! <==\n')
         
-    # Map of cable types to erddap instance
-    _CABLE_TYPES = {'uncabled' : 'erddap-11-2',
-        'cabled' : 'erddap-11-1'}
-
     erddap_backend_base_url = os.getenv('OOI_ERDDAP_BACKEND_BASE_URL')
     if not erddap_backend_base_url:
         sys.stderr.write('OOI_ERDDAP_BACKEND_BASE_URL not set\n')
@@ -59,89 +68,357 @@ def main(args):
         sys.stderr.write('Invalid OOI_ERDDAP_DATA_HOME directory: {:s}\n'.format(data_home))
         return 1
         
+    # Cache the allDatasets listings and revalidate them once they are stale
+    response_cache = None
+    if not args.no_catalog_cache:
+        response_cache = open_response_cache(ttl=args.catalog_ttl)
+        use_response_cache(response_cache)
+        
+    # Cable type/dap type combinations to synchronise
+    if args.all:
+        targets = [(c, d) for c in sorted(_CABLE_TYPES.keys()) for d in _DAP_TYPES]
+    else:
+        targets = [(args.cable_type, args.dap_type)]
+        
+    # Limit the number of concurrent downloads from each ERDDAP host
+    session.configure(max_per_host=args.host_limit,
+        pool_maxsize=max(args.host_limit, len(targets) * args.workers))
+        
+    # NetCDF-4 conversions run in worker processes while the next dataset is
+    # downloaded.  At most args.max_pending downloaded NetCDF-3 files wait to be
+    # converted at any time.
+    pool = BoundedProcessPool(processes=args.processes, max_pending=args.max_pending)
+    
+    # Inputs of each dataset xml file written, used to rewrite only the dataset
+    # xml files whose template or destination have changed
+    manifest = None
+    if not args.no_manifest:
+        manifest = open_build_manifest()
+        
+    results = map_concurrent(partial(update_frontend_target,
+            erddap_backend_base_url=erddap_backend_base_url,
+            erddap_frontend_base_url=erddap_frontend_base_url,
+            data_home=data_home,
+            template_dir=template_dir,
+            pool=pool,
+            manifest=manifest,
+            args=args),
+        targets,
+        workers=len(targets))
+        
+    conversions = []
+    # New datasets whose dataset XML is written once their files are converted
+    pending_xml = []
+    # Updated datasets flagged for reload once their files are converted
+    pending_flags = []
+    for (target_conversions, target_pending_xml, target_pending_flags) in results:
+        conversions.extend(target_conversions)
+        pending_xml.extend(target_pending_xml)
+        pending_flags.extend(target_pending_flags)
+        
+    # Wait for the outstanding conversions
+    sys.stdout.write('\nWaiting for {:d} NetCDF-4 conversions\n'.format(len([c for c in conversions if not c.ready()])))
+    pool.join()
+    
+    for (dataset_id, dest_nc_dir, dataset_template, dataset_xml_file, dataset_conversions) in pending_xml:
+        if not all([c.get() for c in dataset_conversions]):
+            sys.stderr.write('NetCDF-4 conversion failed, skipping dataset xml for dataset ID: {:s}\n'.format(dataset_id))
+            continue
+        write_frontend_dataset_xml(dest_nc_dir, dataset_template, dataset_id, dataset_xml_file, manifest=manifest)
+        
+    if manifest and not args.debug:
+        manifest.save()
+        
+    # Reload only the updated datasets whose files were all converted, rather
+    # than relying on ERDDAP polling every dataset directory
+    flagged = 0
+    for (erddap_instance, dataset_id, dataset_conversions) in pending_flags:
+        if not all([c.get() for c in dataset_conversions]):
+            sys.stderr.write('NetCDF-4 conversion failed, not flagging dataset ID: {:s}\n'.format(dataset_id))
+            continue
+        flagged += flag_datasets(erddap_instance, [dataset_id])
+        
+    converted = [c.get() for c in conversions if c.get()]
+    sys.stdout.write('\nConverted {:d} of {:d} NetCDF files: {:0.1f} MB -> {:0.1f} MB in {:0.1f} CPU seconds\n'.format(len(converted),
+        len(conversions),
+        sum([c['input_bytes'] for c in converted]) / 1048576.,
+        sum([c['output_bytes'] for c in converted]) / 1048576.,
+        sum([c['elapsed'] for c in converted])))
+    sys.stdout.write('Flagged {:d} of {:d} updated datasets for reload\n'.format(flagged, len(pending_flags)))
+    sys.stdout.write('\n{:s}\n'.format(session.format_stats()))
+    sys.stdout.write('{:s}\n'.format(format_metadata_request_stats()))
+    sys.stdout.write('{:s}\n'.format(format_xml_template_stats()))
+    if response_cache:
+        sys.stdout.write('{:s}\n'.format(response_cache.format_stats()))
+    if manifest:
+        sys.stdout.write('{:s}\n'.format(manifest.format_stats()))
+    
+    if args.debug:
+        sys.stdout.write('\n==> DEBUG MODE: No file operations performed! <==\n')
+
+def update_frontend_target(target, erddap_backend_base_url, erddap_frontend_base_url, data_home, template_dir, pool, manifest, args):
+    '''Synchronise the frontend datasets of the (cable type, dap type) target with
+    the backend datasets, processing up to args.workers datasets concurrently.
+    Returns the list of queued NetCDF-4 conversions, the list of new datasets
+    waiting for their dataset XML and the list of updated datasets to flag for
+    reload once their conversions complete.'''
+    
+    (cable_type, dap_type) = target
+    
     # Get the list of available backend datasets
     backend_erddap_url = '{:s}/{:s}/erddap/{:s}'.format(erddap_backend_base_url,
-        args.cable_type,
-        args.dap_type)
+        cable_type,
+        dap_type)
     backend_datasets = fetch_erddap_datasets(backend_erddap_url)
     
     # Get the list of available frontend datasets
     frontend_erddap_url = '{:s}/{:s}/erddap/{:s}'.format(erddap_frontend_base_url,
-        args.cable_type,
-        args.dap_type)
+        cable_type,
+        dap_type)
     frontend_datasets = fetch_erddap_datasets(frontend_erddap_url)
-    # Create the list of frontend dataset ids
-    frontend_dataset_ids = [d['datasetID'] for d in frontend_datasets]
+    # Index the frontend datasets by datasetID
+    frontend_dataset_index = index_erddap_datasets(frontend_datasets)
+    
+    sys.stdout.write('{:s} {:s}: {:d} backend datasets, {:d} frontend datasets\n'.format(cable_type,
+        dap_type,
+        len(backend_datasets),
+        len(frontend_datasets)))
+        
+    results = map_concurrent(partial(update_frontend_dataset,
+            frontend_dataset_index=frontend_dataset_index,
+            backend_erddap_url=backend_erddap_url,
+            cable_type=cable_type,
+            data_home=data_home,
+            template_dir=template_dir,
+            pool=pool,
+            manifest=manifest,
+            args=args),
+        backend_datasets,
+        workers=args.workers)
+        
+    conversions = []
+    pending_xml = []
+    pending_flags = []
+    for (dataset_conversions, dataset_pending_xml, dataset_pending_flags) in results:
+        conversions.extend(dataset_conversions)
+        pending_xml.extend(dataset_pending_xml)
+        pending_flags.extend(dataset_pending_flags)
+        
+    return (conversions, pending_xml, pending_flags)
+    
+def update_frontend_dataset(dataset, frontend_dataset_index, backend_erddap_url, cable_type, data_home, template_dir, pool, manifest, args):
+    '''Create or update the frontend dataset corresponding to the backend dataset.
+    Returns the list of queued NetCDF-4 conversions, a list containing the
+    dataset XML to write once they complete, if the dataset is new, and a list
+    containing the dataset to flag for reload once they complete, if the dataset
+    was updated.'''
+    
+    conversions = []
+    pending_xml = []
+    # Updated datasets to flag for reload once their files are converted
+    pending_flags = []
+    
+    sys.stdout.write('\nChecking backend dataset: {:s}\n'.format(dataset['datasetID']))
     
-    for dataset in backend_datasets:
+    if dataset['datasetID'] in frontend_dataset_index:
         
-        sys.stdout.write('\nChecking backend dataset: {:s}\n'.format(dataset['datasetID']))
+        sys.stdout.write('Existing frontend dataset: {:s}\n'.format(dataset['datasetID']))
         
-        if dataset['datasetID'] in frontend_dataset_ids:
+        if manifest:
+            refresh_frontend_dataset_xml(dataset, cable_type, data_home, template_dir, manifest, args)
             
-            sys.stdout.write('Existing frontend dataset: {:s}\n'.format(dataset['datasetID']))
+        # Find the frontend dataset
+        frontend_dataset = frontend_dataset_index[dataset['datasetID']]
+        
+        # Dataset times, in seconds since 1970-01-01, parsed in bulk by
+        # fetch_erddap_datasets
+        frontend_dt0 = frontend_dataset['minTimeEpoch']
+        frontend_dt1 = frontend_dataset['maxTimeEpoch']
+        backend_dt0 = dataset['minTimeEpoch']
+        backend_dt1 = dataset['maxTimeEpoch']
+
+        updated = False
+        if frontend_dt0 != backend_dt0:
+            sys.stdout.write('Backend dataset start time has changed: {:s}\n'.format(dataset['datasetID']))
+            updated = True
+        if frontend_dt1 != backend_dt1:
+            sys.stdout.write('Backend dataset end time has changed: {:s}\n'.format(dataset['datasetID']))
+            updated = True
             
-            # Find the array element
-            i = frontend_dataset_ids.index(dataset['datasetID'])
+        if not updated:
+            return (conversions, pending_xml, pending_flags)
             
-            # Convert dataset times to datetimes
-            frontend_dt0 = parser.parse(frontend_datasets[i]['minTime'])
-            frontend_dt1 = parser.parse(frontend_datasets[i]['maxTime'])
-            backend_dt0 = parser.parse(dataset['minTime'])
-            backend_dt1 = parser.parse(dataset['maxTime'])
-    
-            updated = False
+        sys.stdout.write('Updating frontend dataset: {:s}\n'.format(dataset['datasetID']))
+        
+        # Create the ERDDAP product directory
+        nc_dest_product_dir = build_nc_dest(dataset['instrument']['reference_designator'],
+            dataset['instrument']['method'],
+            dataset['instrument']['stream'],
+            dataset['instrument']['deployment_number'])
+        dest_nc_dir = os.path.join(data_home,
+            _CABLE_TYPES[cable_type],
+            'nc',
+            nc_dest_product_dir)
+            
+        # Create the ERDDAP product directory if it does not exist
+        sys.stdout.write('ERDDAP destination: {:s}\n'.format(dest_nc_dir))
+        if not os.path.isdir(dest_nc_dir):
+            if not args.debug:
+                try:
+                    sys.stdout.write('Creating ERDDAP destination directory\n')
+                    os.makedirs(dest_nc_dir)
+                except OSError as e:
+                    sys.stderr.write('{:s}\n'.format(e))
+                    return (conversions, pending_xml, pending_flags)
+                    
+        # In incremental mode, only request the rows newer than the last time in
+        # the existing NetCDF-4 files and add them as an additional segment,
+        # provided the start time has not changed and there are fewer than
+        # args.max_segments segments.  Otherwise rebuild the entire dataset.
+        if args.incremental:
+            segments = glob.glob(os.path.join(dest_nc_dir, '{:s}*.ncCF-4.nc'.format(dataset['datasetID'])))
             if frontend_dt0 != backend_dt0:
-                sys.stdout.write('Backend dataset start time has changed: {:s}\n'.format(dataset['datasetID']))
-                updated = True
-            if frontend_dt1 != backend_dt1:
-                sys.stdout.write('Backend dataset end time has changed: {:s}\n'.format(dataset['datasetID']))
-                updated = True
+                sys.stdout.write('Start time has changed, rebuilding dataset: {:s}\n'.format(dataset['datasetID']))
+            elif backend_dt1 is None or frontend_dt1 is None or backend_dt1 <= frontend_dt1:
+                sys.stdout.write('End time has not advanced, rebuilding dataset: {:s}\n'.format(dataset['datasetID']))
+            elif not segments:
+                sys.stdout.write('No existing NetCDF-4 files, rebuilding dataset: {:s}\n'.format(dataset['datasetID']))
+            elif len(segments) >= args.max_segments:
+                sys.stdout.write('Dataset has {:d} segments, rebuilding dataset: {:s}\n'.format(len(segments), dataset['datasetID']))
+            else:
+                # allDatasets maxTime is truncated to whole seconds, so use the
+                # full resolution time of the last row already downloaded
+                last_time = nc_last_time(segments)
+                if not last_time:
+                    sys.stdout.write('Unable to read the last NetCDF-4 time, rebuilding dataset: {:s}\n'.format(dataset['datasetID']))
+                else:
+                    conversion = append_dataset_segment(backend_erddap_url,
+                        dataset,
+                        last_time,
+                        dest_nc_dir,
+                        pool,
+                        args)
+                    if conversion:
+                        conversions.append(conversion)
+                        pending_flags.append((_CABLE_TYPES[cable_type], dataset['datasetID'], [conversion]))
+                    return (conversions, pending_xml, pending_flags)
                 
-            if not updated:
-                continue
+        # Download the complete dataset as a single NetCDF file
+        nc_fname = '{:s}.ncCF-3.nc.tmp'.format(dataset['datasetID'])
+        nc_file = os.path.join(dest_nc_dir, nc_fname)
+        if not args.debug:
+            sys.stdout.write('Requesting UPDATED dataset: {:s}\n'.format(dataset['datasetID']))
+            # Interrupted downloads are resumed on the next run
+            downloaded_nc_files = download_erddap_nc_resumable(backend_erddap_url,
+                dataset['datasetID'],
+                nc_file,
+                nc_type='CF',
+                window_days=args.window_days,
+                buffer_size=int(args.buffer_size * 1048576),
+                fsync=args.fsync,
+                dataset=dataset)
+            # Skip this dataset if the file(s) were not downloaded
+            if not downloaded_nc_files:
+                return (conversions, pending_xml, pending_flags)
                 
-            sys.stdout.write('Updating frontend dataset: {:s}\n'.format(dataset['datasetID']))
+            for downloaded_nc_file in downloaded_nc_files:
+                sys.stdout.write('Temp NetCDF-3 file written: {:s}\n'.format(downloaded_nc_file))
             
-            # Create the ERDDAP product directory
-            nc_dest_product_dir = build_nc_dest(dataset['instrument']['reference_designator'],
-                dataset['instrument']['method'],
-                dataset['instrument']['stream'],
-                dataset['instrument']['deployment_number'])
-            dest_nc_dir = os.path.join(data_home,
-                _CABLE_TYPES[args.cable_type],
-                'nc',
-                nc_dest_product_dir)
-                
-            # Create the ERDDAP product directory if it does not exist
-            sys.stdout.write('ERDDAP destination: {:s}\n'.format(dest_nc_dir))
-            if not os.path.isdir(dest_nc_dir):
-                if not args.debug:
-                    try:
-                        sys.stdout.write('Creating ERDDAP destination directory\n')
-                        os.makedirs(dest_nc_dir)
-                    except OSError as e:
-                        sys.stderr.write('{:s}\n'.format(e))
-                        continue
-                        
-            # Download the complete dataset as a single NetCDF file
-            nc_fname = '{:s}.ncCF-3.nc.tmp'.format(dataset['datasetID'])
-            nc_file = os.path.join(dest_nc_dir, nc_fname)
+        # Delete existing NetCDF files since we'll replace them with a new updated
+        # version
+        old_nc_files = glob.glob(os.path.join(dest_nc_dir, '*.nc'))
+        for nc in old_nc_files:
+            if args.debug:
+                sys.stdout.write('Found existing NetCDF file: {:s}\n'.format(nc))
+            else:
+                sys.stdout.write('Deleting existing NetCDF file: {:s}\n'.format(nc))
+                try:
+                    os.unlink(nc)
+                except OSError as e:
+                    sys.stderr.write('{:s}\n'.format(e))
+        
+        if not args.debug:
+            # convert the .ncCF-3.nc.tmp file(s) to compressed NetCDF-4
+            dataset_conversions = []
+            for (i, downloaded_nc_file) in enumerate(downloaded_nc_files):
+                nc4_file = create_nc4_filename(dest_nc_dir, dataset['datasetID'], i, len(downloaded_nc_files))
+                dataset_conversions.append(pool.submit(compress_nc_file, downloaded_nc_file, nc4_file, args))
+            conversions.extend(dataset_conversions)
+            pending_flags.append((_CABLE_TYPES[cable_type], dataset['datasetID'], dataset_conversions))
+
+    else:
+        
+        sys.stdout.write('New frontend dataset: {:s}\n'.format(dataset['datasetID']))
+        
+        # See if a dataset.xml file already exists for this deployment
+        datasets_xml_dir = os.path.join(data_home,
+            _CABLE_TYPES[cable_type],
+            'stream-xml')
+        if not os.path.isdir(datasets_xml_dir):
+            sys.stderr.write('Invalid stream XML directory: {:s}\n'.format(datasets_xml_dir))
+            return (conversions, pending_xml, pending_flags)
+            
+        # Create the name of the dataset.xml file
+        xml_filename = '{:s}.dataset.xml'.format(dataset['datasetID'])
+        # Fully-qualified path to the dataset XML file, provided it exists    
+        dataset_xml_file = os.path.join(datasets_xml_dir, xml_filename)
+        if os.path.isfile(dataset_xml_file):
+            sys.stderr.write('Skipping existing dataset xml file: {:s}\n'.format(dataset_xml_file))
+            if manifest:
+                refresh_frontend_dataset_xml(dataset, cable_type, data_home, template_dir, manifest, args)
+            return (conversions, pending_xml, pending_flags)
+            
+        # See if a template exists for this request
+        dataset_template = get_valid_dataset_template(dataset['instrument']['stream'],
+            dataset['instrument']['method'],
+            template_dir=template_dir)
+        if not dataset_template:
+            return (conversions, pending_xml, pending_flags)
+            
+        # Create the ERDDAP product directory
+        nc_dest_product_dir = build_nc_dest(dataset['instrument']['reference_designator'],
+            dataset['instrument']['method'],
+            dataset['instrument']['stream'],
+            dataset['instrument']['deployment_number'])
+        dest_nc_dir = os.path.join(data_home,
+            _CABLE_TYPES[cable_type],
+            'nc',
+            nc_dest_product_dir)
+        # Create the ERDDAP product directory if it does not exist
+        sys.stdout.write('ERDDAP destination: {:s}\n'.format(dest_nc_dir))
+        if not os.path.isdir(dest_nc_dir):
             if not args.debug:
-                sys.stdout.write('Requesting UPDATED dataset: {:s}\n'.format(dataset['datasetID']))
-                downloaded_nc_file = download_erddap_nc(backend_erddap_url,
-                    dataset['datasetID'],
-                    output_filename=nc_file,
-                    nc_type='CF')
-                # Skip this dataset if the file was not downloaded
-                if not downloaded_nc_file:
-                    continue
+                try:
+                    sys.stdout.write('Creating ERDDAP destination directory\n')
+                    os.makedirs(dest_nc_dir)
+                except OSError as e:
+                    sys.stderr.write('{:s}\n'.format(e))
+                    return (conversions, pending_xml, pending_flags)
                     
-                sys.stdout.write('Temp NetCDF-3 file written: {:s}\n'.format(downloaded_nc_file))
+        # Download the complete dataset as a single NetCDF file
+        nc_fname = '{:s}.ncCF-3.nc.tmp'.format(dataset['datasetID'])
+        nc_file = os.path.join(dest_nc_dir, nc_fname)
+        if not args.debug:
+            sys.stdout.write('Requesting NEW dataset: {:s}\n'.format(dataset['datasetID']))
+            # Interrupted downloads are resumed on the next run
+            downloaded_nc_files = download_erddap_nc_resumable(backend_erddap_url,
+                dataset['datasetID'],
+                nc_file,
+                nc_type='CF',
+                window_days=args.window_days,
+                buffer_size=int(args.buffer_size * 1048576),
+                fsync=args.fsync,
+                dataset=dataset)
+            # Skip this dataset if the file(s) were not downloaded
+            if not downloaded_nc_files:
+                return (conversions, pending_xml, pending_flags)
                 
-            # Delete existing NetCDF files since we'll replace them with a new updated
-            # version
-            old_nc_files = glob.glob(os.path.join(dest_nc_dir, '*.nc'))
+            for downloaded_nc_file in downloaded_nc_files:
+                sys.stdout.write('Temp NetCDF-3 file written: {:s}\n'.format(downloaded_nc_file))
+            
+        # There shouldn't be NetCDF files, but check and remove any if they are present
+        old_nc_files = glob.glob(os.path.join(dest_nc_dir, '*.nc'))
+        if old_nc_files:
             for nc in old_nc_files:
                 if args.debug:
                     sys.stdout.write('Found existing NetCDF file: {:s}\n'.format(nc))
@@ -151,123 +428,172 @@ def main(args):
                         os.unlink(nc)
                     except OSError as e:
                         sys.stderr.write('{:s}\n'.format(e))
-            
-            if not args.debug:
-                # convert the .ncCF-3.nc.tmp file to NetCDF 4 using ncks
-                nc4_file = '{:s}.ncCF-4.nc'.format(downloaded_nc_file.split('.')[0])
-                try:
-                    sys.stdout.write('Converting to NetCDF-4 and compressing: {:s}\n'.format(nc4_file))
-                    check_output(['ncks', '-4', '-L 1', downloaded_nc_file, nc4_file])
-                    os.unlink(downloaded_nc_file)
-                except (CalledProcessError, OSError) as e:
-                    sys.stderr.write('NetCDF-3 to NetCDF-4 conversion or delete failed: {:s}\n'.format(e))
-    
-        else:
-            
-            sys.stdout.write('New frontend dataset: {:s}\n'.format(dataset['datasetID']))
-            
-            # See if a dataset.xml file already exists for this deployment
-            datasets_xml_dir = os.path.join(data_home,
-                _CABLE_TYPES[args.cable_type],
-                'stream-xml')
-            if not os.path.isdir(datasets_xml_dir):
-                sys.stderr.write('Invalid stream XML directory: {:s}\n'.format(datasets_xml_dir))
-                continue
-                
-            # Create the name of the dataset.xml file
-            xml_filename = '{:s}.dataset.xml'.format(dataset['datasetID'])
-            # Fully-qualified path to the dataset XML file, provided it exists    
-            dataset_xml_file = os.path.join(datasets_xml_dir, xml_filename)
-            if os.path.isfile(dataset_xml_file):
-                sys.stderr.write('Skipping existing dataset xml file: {:s}\n'.format(dataset_xml_file))
-                continue
-                
-            # See if a template exists for this request
-            dataset_template = get_valid_dataset_template(dataset['instrument']['stream'],
-                dataset['instrument']['method'],
-                template_dir=template_dir)
-            if not dataset_template:
-                continue
-                
-            # Create the ERDDAP product directory
-            nc_dest_product_dir = build_nc_dest(dataset['instrument']['reference_designator'],
-                dataset['instrument']['method'],
-                dataset['instrument']['stream'],
-                dataset['instrument']['deployment_number'])
-            dest_nc_dir = os.path.join(data_home,
-                _CABLE_TYPES[args.cable_type],
-                'nc',
-                nc_dest_product_dir)
-            # Create the ERDDAP product directory if it does not exist
-            sys.stdout.write('ERDDAP destination: {:s}\n'.format(dest_nc_dir))
-            if not os.path.isdir(dest_nc_dir):
-                if not args.debug:
-                    try:
-                        sys.stdout.write('Creating ERDDAP destination directory\n')
-                        os.makedirs(dest_nc_dir)
-                    except OSError as e:
-                        sys.stderr.write('{:s}\n'.format(e))
-                        continue
                         
-            # Download the complete dataset as a single NetCDF file
-            nc_fname = '{:s}.ncCF-3.nc.tmp'.format(dataset['datasetID'])
-            nc_file = os.path.join(dest_nc_dir, nc_fname)
-            if not args.debug:
-                sys.stdout.write('Requesting NEW dataset: {:s}\n'.format(dataset['datasetID']))
-                downloaded_nc_file = download_erddap_nc(backend_erddap_url,
-                    dataset['datasetID'],
-                    output_filename=nc_file,
-                    nc_type='CF')
-                # Skip this dataset if the file was not downloaded
-                if not downloaded_nc_file:
-                    continue
-                    
-                sys.stdout.write('Temp NetCDF-3 file written: {:s}\n'.format(downloaded_nc_file))
+        if not args.debug:
+            # convert the .ncCF-3.nc.tmp file(s) to compressed NetCDF-4
+            dataset_conversions = []
+            for (i, downloaded_nc_file) in enumerate(downloaded_nc_files):
+                nc4_file = create_nc4_filename(dest_nc_dir, dataset['datasetID'], i, len(downloaded_nc_files))
+                dataset_conversions.append(pool.submit(compress_nc_file, downloaded_nc_file, nc4_file, args))
+            conversions.extend(dataset_conversions)
+        
+            # Write the dataset XML once the files have been converted
+            pending_xml.append((dataset['datasetID'],
+                dest_nc_dir,
+                dataset_template,
+                dataset_xml_file,
+                dataset_conversions))
                 
-            # There shouldn't be NetCDF files, but check and remove any if they are present
-            old_nc_files = glob.glob(os.path.join(dest_nc_dir, '*.nc'))
-            if old_nc_files:
-                for nc in old_nc_files:
-                    if args.debug:
-                        sys.stdout.write('Found existing NetCDF file: {:s}\n'.format(nc))
-                    else:
-                        sys.stdout.write('Deleting existing NetCDF file: {:s}\n'.format(nc))
-                        try:
-                            os.unlink(nc)
-                        except OSError as e:
-                            sys.stderr.write('{:s}\n'.format(e))
-                            
-            if not args.debug:
-                try:
-                    # convert the .ncCF-3.nc.tmp file to NetCDF 4 using ncks
-                    nc4_file = '{:s}.ncCF-4.nc'.format(downloaded_nc_file.split('.')[0])
-                    sys.stdout.write('Converting to NetCDF-4 and compressing: {:s}\n'.format(nc4_file))
-                    check_output(['ncks', '-4', '-L 1', downloaded_nc_file, nc4_file])
-                    os.unlink(downloaded_nc_file)
-                except (CalledProcessError, OSError) as e:
-                    sys.stderr.write('NetCDF-3 to NetCDF-4 conversion or delete failed: {:s}\n'.format(e))
+    return (conversions, pending_xml, pending_flags)
+    
+def append_dataset_segment(backend_erddap_url, dataset, start_time, dest_nc_dir, pool, args):
+    '''Download the rows of the backend dataset newer than start_time and queue
+    their conversion to an additional NetCDF-4 segment in dest_nc_dir on pool.
+    Returns the AsyncResult of the conversion or None if nothing was queued.'''
+    
+    # There are no newer rows to request if the backend maxTime, which is
+    # truncated to whole seconds, does not follow the last downloaded row
+    max_dt = parse_iso8601(dataset['maxTime'])
+    if max_dt is None or parse_iso8601(start_time) >= max_dt:
+        return None
+        
+    # Name the segment after the time of the last row it follows so that segments
+    # sort chronologically
+    segment_ts = parse_iso8601(start_time).strftime('%Y%m%dT%H%M%S')
+    nc_file = os.path.join(dest_nc_dir, '{:s}.{:s}.ncCF-3.nc.tmp'.format(dataset['datasetID'], segment_ts))
+    nc4_file = os.path.join(dest_nc_dir, '{:s}.{:s}.ncCF-4.nc'.format(dataset['datasetID'], segment_ts))
+    
+    sys.stdout.write('Requesting rows newer than {:s}: {:s}\n'.format(start_time, dataset['datasetID']))
+    if args.debug:
+        sys.stdout.write('Segment: {:s}\n'.format(nc4_file))
+        return None
+        
+    downloaded_nc_file = download_erddap_nc(backend_erddap_url,
+        dataset['datasetID'],
+        output_filename=nc_file,
+        nc_type='CF',
+        start_time=start_time,
+        end_time=dataset['maxTime'],
+        start_inclusive=False,
+        buffer_size=int(args.buffer_size * 1048576),
+        fsync=args.fsync,
+        resume=True,
+        dataset=dataset)
+    if not downloaded_nc_file:
+        return None
+        
+    sys.stdout.write('Temp NetCDF-3 file written: {:s}\n'.format(downloaded_nc_file))
+    
+    return pool.submit(compress_nc_file, downloaded_nc_file, nc4_file, args)
+    
+def compress_nc_file(nc3_file, nc4_file, args):
+    '''Convert the downloaded NetCDF-3 nc3_file to the compressed NetCDF-4 nc4_file
+    and delete nc3_file.  Returns the convert_nc3_to_nc4 result or None if the
+    file was not converted.'''
+    
+    sys.stdout.write('Converting to NetCDF-4 and compressing: {:s}\n'.format(nc4_file))
+    converted = convert_nc3_to_nc4(nc3_file,
+        nc4_file,
+        deflate_level=args.deflate_level,
+        shuffle=not args.no_shuffle,
+        time_chunk_size=args.time_chunk_size)
+    if not converted:
+        return None
+        
+    try:
+        os.unlink(nc3_file)
+    except OSError as e:
+        sys.stderr.write('{:s}: {:s}\n'.format(nc3_file, e))
+        
+    return converted
+    
+def refresh_frontend_dataset_xml(dataset, cable_type, data_home, template_dir, manifest, args):
+    '''Rewrite the existing dataset XML file of the frontend dataset if its
+    template or NetCDF destination have changed since it was written.  Returns
+    True if the inputs had changed and the file now contains the new XML.'''
+    
+    dataset_xml_file = os.path.join(data_home,
+        _CABLE_TYPES[cable_type],
+        'stream-xml',
+        '{:s}.dataset.xml'.format(dataset['datasetID']))
+    if not os.path.isfile(dataset_xml_file):
+        return False
+        
+    dataset_template = get_valid_dataset_template(dataset['instrument']['stream'],
+        dataset['instrument']['method'],
+        template_dir=template_dir)
+    if not dataset_template:
+        return False
+        
+    dest_nc_dir = os.path.join(data_home,
+        _CABLE_TYPES[cable_type],
+        'nc',
+        build_nc_dest(dataset['instrument']['reference_designator'],
+            dataset['instrument']['method'],
+            dataset['instrument']['stream'],
+            dataset['instrument']['deployment_number']))
             
-                # Create the XML    
-                dataset_xml = create_frontend_dataset_xml(os.path.dirname(downloaded_nc_file),
-                    dataset_template,
-                    dataset['datasetID'])
-                    
-                if not dataset_xml:
-                    sys.stderr.write('Failed to write dataset xml for dataset ID: {:s}\n'.format(dataset['datasetID']))
-                    continue
+    if manifest.is_current(dataset_xml_file, frontend_dataset_xml_digest(dest_nc_dir, dataset_template, dataset['datasetID'])):
+        return False
         
-                # Write the XML file
-                try:
-                    with open(dataset_xml_file, 'w') as fid:
-                        sys.stdout.write('Writing XML: {:s}\n'.format(dataset_xml_file))
-                        fid.write('{:s}\n'.format(dataset_xml))
-                except IOError as e:
-                    sys.stderr.write('{:s}\n'.format(e))
-                    continue
-                    
+    sys.stdout.write('Dataset xml inputs have changed: {:s}\n'.format(dataset_xml_file))
     if args.debug:
-        sys.stdout.write('\n==> DEBUG MODE: No file operations performed! <==\n')
-
+        return False
+        
+    if not write_frontend_dataset_xml(dest_nc_dir, dataset_template, dataset['datasetID'], dataset_xml_file, manifest=manifest):
+        return False
+        
+    # The dataset is flagged for reload once the datasets.xml file containing
+    # the new xml has been written
+    return True
+    
+def frontend_dataset_xml_digest(dest_nc_dir, dataset_template, dataset_id):
+    '''Return the digest of the inputs create_frontend_dataset_xml uses to create
+    the dataset XML for dataset_id'''
+    
+    return hash_inputs(files=[dataset_template],
+        values={'dataset_id' : dataset_id,
+            'file_dir' : dest_nc_dir})
+            
+def write_frontend_dataset_xml(dest_nc_dir, dataset_template, dataset_id, dataset_xml_file, manifest=None):
+    '''Create the dataset XML for dataset_id from dataset_template and write it
+    to dataset_xml_file.  The inputs are recorded in manifest, if specified, in
+    which case an existing file already containing the same XML is not
+    rewritten.  Returns True if the file contains the dataset XML.'''
+    
+    dataset_xml = create_frontend_dataset_xml(dest_nc_dir,
+        dataset_template,
+        dataset_id)
+        
+    if not dataset_xml:
+        sys.stderr.write('Failed to write dataset xml for dataset ID: {:s}\n'.format(dataset_id))
+        return False
+        
+    # Files written before the manifest existed are recorded without being
+    # rewritten if they are unchanged
+    dataset_xml = '{:s}\n'.format(dataset_xml)
+    if manifest and has_contents(dataset_xml_file, dataset_xml):
+        sys.stdout.write('XML is unchanged: {:s}\n'.format(dataset_xml_file))
+    else:
+        # Write the XML file
+        sys.stdout.write('Writing XML: {:s}\n'.format(dataset_xml_file))
+        if not write_atomic(dataset_xml_file, dataset_xml):
+            return False
+        
+    if manifest:
+        manifest.record(dataset_xml_file, frontend_dataset_xml_digest(dest_nc_dir, dataset_template, dataset_id))
+        
+    return True
+    
+def create_nc4_filename(dest_nc_dir, dataset_id, segment, num_segments):
+    '''Return the NetCDF-4 filename for the segment of num_segments downloaded
+    segments of dataset_id'''
+    
+    if num_segments == 1:
+        return os.path.join(dest_nc_dir, '{:s}.ncCF-4.nc'.format(dataset_id))
+        
+    return os.path.join(dest_nc_dir, '{:s}.{:04d}.ncCF-4.nc'.format(dataset_id, segment))
+    
 if __name__ == '__main__':
 
     arg_parser = argparse.ArgumentParser(description=main.__doc__)
@@ -281,6 +607,63 @@ if __name__ == '__main__':
         dest='dap_type',
         default='tabledap',
         help='Specify the ERDDAP data type.  <Default=tabledap>')
+    arg_parser.add_argument('-a', '--all',
+        action='store_true',
+        help='Synchronise all cable type and dap type combinations concurrently, ignoring --cabletype and --daptype')
+    arg_parser.add_argument('-w', '--workers',
+        type=int,
+        default=1,
+        help='Number of datasets synchronised concurrently for each cable type and dap type <Default=1>')
+    arg_parser.add_argument('--host_limit',
+        type=int,
+        default=4,
+        help='Maximum number of concurrent downloads from each ERDDAP host.  0 for no limit <Default=4>')
+    arg_parser.add_argument('-b', '--buffer_size',
+        type=float,
+        default=4,
+        help='Size, in MB, of the chunks read from the backend ERDDAP server and written to disk <Default=4>')
+    arg_parser.add_argument('--fsync',
+        action='store_true',
+        help='Flush each downloaded NetCDF file to disk once the download is complete')
+    arg_parser.add_argument('--window_days',
+        type=int,
+        default=30,
+        help='Number of days of data per request if the backend server does not support resuming downloads <Default=30>')
+    arg_parser.add_argument('-i', '--incremental',
+        action='store_true',
+        help='Add the rows newer than the frontend dataset end time as an additional NetCDF-4 segment instead of downloading the entire dataset.  The dataset is rebuilt if the start time has changed or it contains --max_segments segments')
+    arg_parser.add_argument('-m', '--max_segments',
+        type=int,
+        default=30,
+        help='Rebuild incrementally updated datasets containing this many NetCDF-4 files <Default=30>')
+    arg_parser.add_argument('-l', '--deflate_level',
+        type=int,
+        choices=range(10),
+        default=1,
+        help='NetCDF-4 zlib compression level.  0 disables compression <Default=1>')
+    arg_parser.add_argument('--no_shuffle',
+        action='store_true',
+        help='Do not apply the NetCDF-4 shuffle filter before compressing')
+    arg_parser.add_argument('-t', '--time_chunk_size',
+        type=int,
+        default=8192,
+        help='Number of records along the time dimension in each NetCDF-4 chunk <Default=8192>')
+    arg_parser.add_argument('-p', '--processes',
+        type=int,
+        help='Number of NetCDF-4 conversion worker processes <Default=number of CPUs>')
+    arg_parser.add_argument('--max_pending',
+        type=int,
+        help='Maximum number of downloaded NetCDF-3 files waiting to be converted before downloads pause <Default=2 x processes>')
+    arg_parser.add_argument('--catalog_ttl',
+        type=int,
+        default=60,
+        help='Number of seconds cached allDatasets responses are used before they are revalidated with a conditional request <Default=60>')
+    arg_parser.add_argument('--no_catalog_cache',
+        action='store_true',
+        help='Do not cache allDatasets responses')
+    arg_parser.add_argument('--no_manifest',
+        action='store_true',
+        help='Do not use the build manifest to rewrite the dataset xml of existing datasets whose template or destination have changed')
     arg_parser.add_argument('-x',
         dest='debug',
         action='store_true',
@@ -1,17 +1,54 @@
 #!/usr/bin/env python
 
 from xml.dom import minidom
+from xml.etree import ElementTree
 import sys
 import os
+import glob
+import time
 import argparse
 
+# List of dataVariables that we want to either delete from the DOM
+BAD_VARIABLES = {'obs',
+    'driver_timestamp',
+    'internal_timestamp',
+    'ingestion_timestamp',
+    'port_timestamp',
+    'provenance'}
+# List of attributes we want to either add, if not already present, or modify
+# if present
+ADD_ATTRIBUTES = {'title' : None,
+    'summary' : None,
+    'institution' : 'Ocean Observatories Initiative'}
+# 2016-09-09: kerfoot@marine - bug in ERDDAP v1.72[3] displaying bad time values (year=2086)
+# Fix from Bob Simons is to set <updateEveryNMillis /> to -1 and
+# <reloadEveryNMinutes /> to 1.  The ingest and catalog scripts now touch the
+# flag file of each dataset they change in $OOI_ERDDAP_FLAG_HOME/<instance>/flag,
+# so the reload interval is only a daily fallback for missed flags.
+DEFAULT_RELOAD_MINUTES = 1440
+RELOAD_SETTINGS = {'updateEveryNMillis' : '-1',
+    'reloadEveryNMinutes' : '{:d}'.format(DEFAULT_RELOAD_MINUTES)}
+
 def main(args):
+    '''Convert one or more ERDDAP GenerateDatasetsXml outputs into dataset
+    templates.  Directories are searched for *.xml files, so a whole directory
+    of templates is converted in one process.'''
     
-    for orig_xml_file in args.xml_files:
+    xml_files = find_xml_files(args.xml_files)
+    if not xml_files:
+        sys.stderr.write('No XML files specified\n')
+        return 1
+        
+    if args.benchmark:
+        return benchmark(xml_files, args.repeat, reload_minutes=args.reload_minutes)
         
-        dataset_node = modify_template_dom(orig_xml_file)
-        if not dataset_node:
-            return 1
+    status = 0
+    for orig_xml_file in xml_files:
+        
+        dataset_node = modify_template_dom(orig_xml_file, reload_minutes=args.reload_minutes)
+        if dataset_node is None:
+            status = 1
+            continue
         
         # split the file path and name
         (xml_path, xml_file) = os.path.split(orig_xml_file)
@@ -19,9 +56,8 @@ def main(args):
         (xml_file, xml_ext) = os.path.splitext(xml_file)
         
         if args.stdout:
-            sys.stdout.write('stdout')
-            sys.stdout.write('{:s}'.format(dataset_node.toxml()))
-            return 0
+            getattr(sys.stdout, 'buffer', sys.stdout).write(dataset_to_xml(dataset_node) + b'\n')
+            continue
             
         # Create the output filename to write the <dataset /> DOM element to
         xml_filename = '{:s}.dataset.xml'.format(xml_file)
@@ -41,26 +77,169 @@ def main(args):
         sys.stdout.write('Writing XML DOM: {:s}\n'.format(xml_out))
         
         # Open the output file and write the <dataset /> element    
-        fid = open(xml_out, 'w')
-        fid.write(dataset_node.toxml())
-        fid.close()
+        with open(xml_out, 'wb') as fid:
+            fid.write(dataset_to_xml(dataset_node))
+    
+    return status
+    
+def find_xml_files(paths):
+    '''Return the list of files in paths, replacing each directory with the
+    sorted list of *.xml files it contains'''
+    
+    xml_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            xml_files.extend(sorted(glob.glob(os.path.join(path, '*.xml'))))
+        else:
+            xml_files.append(path)
+            
+    return xml_files
+    
+def dataset_to_xml(dataset):
+    '''Return the <dataset /> element as UTF-8 encoded XML'''
+    
+    return ElementTree.tostring(dataset, encoding='utf-8')
+    
+def modify_template_dom(orig_xml_file, reload_minutes=DEFAULT_RELOAD_MINUTES):
+    '''Apply the template transformations to the single <dataset /> element in
+    the GenerateDatasetsXml output orig_xml_file in one pass with iterparse.
+    Each element is modified, or bad variables dropped, as soon as it has been
+    parsed.  <reloadEveryNMinutes /> is set to reload_minutes.  Returns the
+    modified <dataset /> Element or None on error.'''
+    
+    reload_settings = _reload_settings(reload_minutes)
     
+    if not os.path.isfile(orig_xml_file):
+        sys.stderr.write('Invalid file specified: {:s}\n'.format(orig_xml_file))
+        return None
+        
+    # Ancestors of the current element
+    stack = []
+    dataset = None
+    num_datasets = 0
+    num_erddap = 0
+    global_atts = None
+    try:
+        for (event, e) in ElementTree.iterparse(orig_xml_file, events=('start', 'end')):
+            
+            if event == 'start':
+                if e.tag == 'erddapDatasets':
+                    num_erddap += 1
+                elif e.tag == 'dataset' and num_erddap:
+                    num_datasets += 1
+                    dataset = e
+                stack.append(e)
+                continue
+                
+            stack.pop()
+            if dataset is None or num_datasets != 1:
+                continue
+                
+            if e is dataset:
+                # Set the datasetID
+                e.set('datasetID', '{dataset_id}')
+            elif e.tag == 'fileDir':
+                e.text = '{file_dir}'
+            elif e.tag in reload_settings:
+                e.text = reload_settings[e.tag]
+            elif e.tag == 'addAttributes' and global_atts is None:
+                # The first <addAttributes /> holds the global attributes
+                global_atts = e
+                _set_global_attributes(e)
+            elif e.tag == 'dataVariable' and stack and stack[-1] is dataset:
+                source_name = e.findtext('sourceName')
+                if source_name in BAD_VARIABLES:
+                    dataset.remove(e)
+    except (IOError, ElementTree.ParseError) as e:
+        sys.stderr.write('Failed to parse {:s} ({:s})\n'.format(orig_xml_file, e))
+        return None
+        
+    # Make sure the DOM has a single <erddapDatasets /> node
+    if not num_erddap:
+        sys.stderr.write('Invalid erddap datasets.xml file: {:s}\n'.format(orig_xml_file))
+        return None
+    elif num_erddap != 1:
+        sys.stderr.write('XML file contains more than one top level DOM node (<erddapDatasets />): {:s}\n'.format(orig_xml_file))
+        return None
+    elif num_datasets != 1:
+        sys.stderr.write('DOM contains more than one dataset element: {:s}\n'.format(orig_xml_file))
+        return None
+        
+    dataset.tail = None
+    
+    return dataset
+    
+def _reload_settings(reload_minutes):
+    
+    settings = dict(RELOAD_SETTINGS)
+    settings['reloadEveryNMinutes'] = '{:d}'.format(reload_minutes)
+    
+    return settings
+    
+def _set_global_attributes(add_atts):
+    
+    # Update or add (if it doesn't exist) the ADD_ATTRIBUTES
+    attributes = dict([(a.get('name'), a) for a in add_atts.findall('att')])
+    for (k,v) in ADD_ATTRIBUTES.items():
+        
+        att = attributes.get(k)
+        if att is None:
+            # Create and append the new node
+            att = ElementTree.SubElement(add_atts, 'att', {'name' : k})
+            att.tail = '\n'
+            
+        if v:
+            att.text = '{:s}'.format(v)
+        else:
+            att.text = '{{{:s}}}'.format(k)
+            
+def benchmark(xml_files, repeat=1, reload_minutes=DEFAULT_RELOAD_MINUTES):
+    '''Time converting xml_files with modify_template_dom and the previous
+    minidom implementation and check that both produce the same elements'''
+    
+    timings = {'iterparse' : 0.,
+        'minidom' : 0.}
+    for n in range(repeat):
+        for xml_file in xml_files:
+            
+            t0 = time.time()
+            dataset = modify_template_dom(xml_file, reload_minutes=reload_minutes)
+            if dataset is not None:
+                dataset_xml = dataset_to_xml(dataset)
+            timings['iterparse'] += time.time() - t0
+            
+            t0 = time.time()
+            dom_dataset = modify_template_minidom(xml_file, reload_minutes=reload_minutes)
+            if dom_dataset:
+                dom_xml = dom_dataset.toxml()
+            timings['minidom'] += time.time() - t0
+            
+            if n or (dataset is None) != (not dom_dataset):
+                continue
+            if dataset is not None and _canonical(ElementTree.fromstring(dataset_xml)) != _canonical(ElementTree.fromstring(dom_xml.encode('utf-8'))):
+                sys.stderr.write('Templates differ: {:s}\n'.format(xml_file))
+                
+    sys.stdout.write('{:d} templates x {:d}: minidom {:0.3f}s, iterparse {:0.3f}s ({:0.1f}x)\n'.format(len(xml_files),
+        repeat,
+        timings['minidom'],
+        timings['iterparse'],
+        timings['minidom'] / max(timings['iterparse'], 1e-6)))
+        
     return 0
     
-def modify_template_dom(orig_xml_file):
-    
-    # List of dataVariables that we want to either delete from the DOM
-    bad_atts = {'obs',
-        'driver_timestamp',
-        'internal_timestamp',
-        'ingestion_timestamp',
-        'port_timestamp',
-        'provenance'}
-    # List of attributes we want to either add, if not already present, or modify
-    # if present
-    add_attributes = {'title' : None,
-        'summary' : None,
-        'institution' : 'Ocean Observatories Initiative'}
+def _canonical(e):
+    
+    return (e.tag,
+        sorted(e.attrib.items()),
+        (e.text or '').strip(),
+        [_canonical(c) for c in e])
+    
+def modify_template_minidom(orig_xml_file, reload_minutes=DEFAULT_RELOAD_MINUTES):
+    '''Previous minidom implementation of modify_template_dom, kept for
+    benchmark comparisons'''
+    
+    bad_atts = BAD_VARIABLES
+    add_attributes = ADD_ATTRIBUTES
     
     if not os.path.isfile(orig_xml_file):
         sys.stderr.write('Invalid file specified: {:s}\n'.format(orig_xml_file))
@@ -96,15 +275,10 @@ def modify_template_dom(orig_xml_file):
         fileDir = fileDirs[0]
         fileDir.firstChild.replaceWholeText('{file_dir}')
         
-    # 2016-09-09: kerfoot@marine - bug in ERDDAP v1.72[3] displaying bad time values (year=2086)
-    # Fix from Bob Simons is to set <updateEveryNMillis /> to -1 and
-    # <reloadEveryNMinutes /> to 1
-    update_nodes = dataset.getElementsByTagName('updateEveryNMillis')
-    if len(update_nodes) == 1:
-        update_nodes[0].firstChild.replaceWholeText('-1')
-    reload_nodes = dataset.getElementsByTagName('reloadEveryNMinutes')
-    if len(reload_nodes) == 1:
-        reload_nodes[0].firstChild.replaceWholeText('1')
+    for (tag, value) in _reload_settings(reload_minutes).items():
+        nodes = dataset.getElementsByTagName(tag)
+        if len(nodes) == 1:
+            nodes[0].firstChild.replaceWholeText(value)
         
     # Get the first <addAttributes /> node
     addAtts = dataset.getElementsByTagName('addAttributes')[0]
@@ -156,7 +330,7 @@ if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser(description=main.__doc__)
     arg_parser.add_argument('xml_files',
         nargs="*",
-        help='One or more ERDDAP datasets.xml template(s) files')
+        help='One or more ERDDAP datasets.xml template(s) files or directories containing them')
     arg_parser.add_argument('-f', '--force',
         action='store_true',
         help='Overwrite existing XML template(s)')
@@ -167,6 +341,17 @@ if __name__ == '__main__':
         dest='stdout',
         action='store_true',
         help='Print xml to STDOUT')
+    arg_parser.add_argument('--reload_minutes',
+        type=int,
+        default=DEFAULT_RELOAD_MINUTES,
+        help='<reloadEveryNMinutes /> value written to the templates.  Datasets changed by the ingest and catalog scripts are flagged for reload, provided ERDDAP\'s flag directory is found in $OOI_ERDDAP_FLAG_HOME, so this is the fallback interval (Default is {:d})'.format(DEFAULT_RELOAD_MINUTES))
+    arg_parser.add_argument('-b', '--benchmark',
+        action='store_true',
+        help='Time the conversion against the previous minidom implementation.  No files are written')
+    arg_parser.add_argument('-r', '--repeat',
+        type=int,
+        default=1,
+        help='Number of times to convert each file when benchmarking (Default is 1)')
 
     parsed_args = arg_parser.parse_args()
 
@@ -8,7 +8,8 @@ from shutil import copyfile
 import argparse
 from dateutil import parser
 from datetime import timedelta
-from asynclib.erddap import fetch_erddap_datasets, download_erddap_nc
+from asynclib.erddap import fetch_erddap_datasets, download_erddap_nc, use_response_cache, format_metadata_request_stats
+from asynclib.cache import open_response_cache
 
 def main(args):
     '''Download a small NetCDF file, create the .args and .xml files necessary
@@ -18,6 +19,10 @@ def main(args):
     tabledap or griddap.
     '''
 
+    # Cache the allDatasets listings and revalidate them once they are stale
+    if not args.no_catalog_cache:
+        use_response_cache(open_response_cache(ttl=args.catalog_ttl))
+        
     # Fetch the erddap datasets listing
     erddap_datasets = fetch_erddap_datasets(args.erddap_url)
     if not erddap_datasets:
@@ -112,7 +117,8 @@ def main(args):
             time_delta_value=1,
             clobber=True,
             nc_type='CF',
-            print_url=args.url_only);
+            print_url=args.url_only,
+            dataset=dataset);
 
         if not nc_file:
             continue
@@ -174,6 +180,8 @@ def main(args):
     for template_run in template_runs:
         sys.stdout.write('{:s}\n'.format(template_run))
         
+    sys.stderr.write('{:s}\n'.format(format_metadata_request_stats()))
+        
     return 0
     
 if __name__ == '__main__':
@@ -189,6 +197,13 @@ if __name__ == '__main__':
     arg_parser.add_argument('-u', '--url_only',
         action='store_true',
         help='Print the request URL, but do not send the request.')
+    arg_parser.add_argument('--catalog_ttl',
+        type=int,
+        default=60,
+        help='Number of seconds cached allDatasets responses are used before they are revalidated with a conditional request <Default=60>')
+    arg_parser.add_argument('--no_catalog_cache',
+        action='store_true',
+        help='Do not cache allDatasets responses')
         
     parsed_args = arg_parser.parse_args()
     